@@ -0,0 +1,157 @@
+import csv
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# 跨运行累计的实测数据，供 batch_process.estimate_processing_cost 使用
+# （batch_process 不导入 Config，因为 Config 在没有API密钥时会报错）
+HISTORY_PATH = os.getenv('API_METRICS_HISTORY_PATH', './.cache/api_metrics_history.json')
+
+REQUEST_FIELDS = ('time', 'status', 'segments', 'latency', 'total_time', 'prompt_tokens', 'completion_tokens',
+                  'retries', 'rate_limited', 'success')
+# batch_* 只累计成功的批量请求（segments > 0），每段token、每批段落数和批次延迟都由它们计算，
+# 单次调用和失败请求的token与延迟不会摊到段落上；
+# batch_wall_seconds 为批量请求（含失败和重试）在途时间的并集，并发的批次只计一次，用于计算每秒处理的段落数
+_TOTAL_FIELDS = ('requests', 'successful', 'segments', 'prompt_tokens', 'completion_tokens', 'latency',
+                 'retries', 'rate_limited', 'batch_requests', 'batch_prompt_tokens', 'batch_completion_tokens',
+                 'batch_latency', 'batch_wall_seconds')
+
+
+class APIMetrics:
+    """
+    GLM API调用遥测：每次 _make_api_call 记录一条
+
+    latency 为最后一次HTTP请求的耗时，total_time 包含退避等待和重试；token数取自响应的 usage 字段；
+    segments 为请求中包含的段落数（单次调用为0）。多个批次线程并发记录，内部加锁。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = []
+        self.totals = dict.fromkeys(_TOTAL_FIELDS, 0)
+        self._batch_covered_until = 0.0  # 已计入 batch_wall_seconds 的在途时间的结束时刻
+
+    def record(self, status: Optional[int], segments: int, latency: float, total_time: float,
+               usage: Optional[Dict], retries: int, rate_limited: int, success: bool):
+        usage = usage or {}
+        finished = time.time()
+        entry = {
+            'time': round(finished - self.started, 3),
+            'status': status,
+            'segments': segments,
+            'latency': round(latency, 3),
+            'total_time': round(total_time, 3),
+            'prompt_tokens': int(usage.get('prompt_tokens') or 0),
+            'completion_tokens': int(usage.get('completion_tokens') or 0),
+            'retries': retries,
+            'rate_limited': rate_limited,
+            'success': success,
+        }
+        with self._lock:
+            self.requests.append(entry)
+            totals = self.totals
+            totals['requests'] += 1
+            totals['successful'] += int(success)
+            totals['prompt_tokens'] += entry['prompt_tokens']
+            totals['completion_tokens'] += entry['completion_tokens']
+            totals['latency'] += latency
+            totals['retries'] += retries
+            totals['rate_limited'] += rate_limited
+            if segments > 0:
+                # 记录按完成顺序到达：[开始, 完成] 中尚未被之前的批次覆盖的部分才计入
+                start = max(finished - total_time, self._batch_covered_until)
+                totals['batch_wall_seconds'] += max(0.0, finished - start)
+                self._batch_covered_until = max(self._batch_covered_until, finished)
+            if segments > 0 and success:
+                totals['segments'] += segments
+                totals['batch_requests'] += 1
+                totals['batch_prompt_tokens'] += entry['prompt_tokens']
+                totals['batch_completion_tokens'] += entry['completion_tokens']
+                totals['batch_latency'] += latency
+
+    def summary(self) -> Dict:
+        with self._lock:
+            stats = dict(self.totals)
+        stats['elapsed'] = time.time() - self.started
+        stats.update(derived_rates(stats))
+        return stats
+
+    def progress_line(self) -> str:
+        """一行实时进度：请求数、段落数、token、平均延迟、吞吐和限流次数"""
+        stats = self.summary()
+        throughput = stats['segments'] / stats['elapsed'] if stats['elapsed'] else 0.0
+        return (f"📈 请求 {stats['successful']}/{stats['requests']} | 段落 {stats['segments']} | "
+                f"token 输入 {stats['prompt_tokens']:,} 输出 {stats['completion_tokens']:,} | "
+                f"平均延迟 {stats['avg_latency']:.2f}秒 | {throughput:.1f} 段/秒 | "
+                f"重试 {stats['retries']} | 429 {stats['rate_limited']} 次")
+
+    def export(self, output_dir: str) -> Tuple[str, str]:
+        """写出 api_metrics_<时间>.json（汇总+逐请求）和同名 .csv（逐请求），返回两个路径"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(output_dir, f"api_metrics_{timestamp}")
+        with self._lock:
+            requests = list(self.requests)
+
+        with open(f"{base}.json", 'w', encoding='utf-8') as f:
+            json.dump({'summary': self.summary(), 'requests': requests}, f, ensure_ascii=False, indent=2)
+        with open(f"{base}.csv", 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REQUEST_FIELDS)
+            writer.writeheader()
+            writer.writerows(requests)
+        return f"{base}.json", f"{base}.csv"
+
+    def update_history(self, path: str = HISTORY_PATH):
+        """把本次运行的累计数据合并进历史文件"""
+        history = load_history(path) or dict.fromkeys(_TOTAL_FIELDS, 0)
+        with self._lock:
+            for field in _TOTAL_FIELDS:
+                history[field] = history.get(field, 0) + self.totals[field]
+        history['updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(history, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def derived_rates(stats: Dict) -> Dict:
+    """
+    由累计数据计算每段token、每批段落数、批次平均延迟（只用成功的批量请求）、全部请求的平均延迟，
+    以及批量请求在途期间每秒完成的段落数（已包含并发）
+    """
+    segments = stats.get('segments', 0)
+    batch_requests = stats.get('batch_requests', 0)
+    requests = stats.get('requests', 0)
+    return {
+        'prompt_tokens_per_segment': stats.get('batch_prompt_tokens', 0) / segments if segments else 0.0,
+        'completion_tokens_per_segment': stats.get('batch_completion_tokens', 0) / segments if segments else 0.0,
+        'segments_per_request': segments / batch_requests if batch_requests else 0.0,
+        'avg_batch_latency': stats.get('batch_latency', 0) / batch_requests if batch_requests else 0.0,
+        'avg_latency': stats.get('latency', 0) / requests if requests else 0.0,
+        'segments_per_second': segments / stats['batch_wall_seconds'] if stats.get('batch_wall_seconds') else 0.0,
+    }
+
+
+def load_history(path: str = HISTORY_PATH) -> Optional[Dict]:
+    """读取历史实测数据；不存在或无法读取时返回None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def format_summary_lines(stats: Dict) -> List[str]:
+    """批量总结报告中的API遥测部分"""
+    return [
+        f"  请求数: {stats['requests']} (成功 {stats['successful']})",
+        f"  实际输入/输出token: {stats['prompt_tokens']:,} / {stats['completion_tokens']:,}",
+        f"  每段token (输入/输出): {stats['prompt_tokens_per_segment']:.1f} / {stats['completion_tokens_per_segment']:.1f}",
+        f"  平均延迟: {stats['avg_latency']:.2f}秒",
+        f"  重试: {stats['retries']} 次, 429限流: {stats['rate_limited']} 次",
+    ]
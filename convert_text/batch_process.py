@@ -8,6 +8,10 @@ import os
 import sys
 import glob
 from pathlib import Path
+from api_metrics import derived_rates, load_history
+
+# 与 Config.MAX_INFLIGHT_BATCHES 相同（这里不导入 Config，见 api_metrics.HISTORY_PATH）
+MAX_INFLIGHT_BATCHES = int(os.getenv('GLM_MAX_INFLIGHT_BATCHES', '4'))
 
 def show_menu():
     """显示操作菜单"""
@@ -97,6 +101,28 @@ def estimate_processing_cost(files):
     
     # 基于大批次优化的全新预估模型
     batch_size = 30  # 每批处理30个段落
+    base_prompt_tokens = 180  # 优化后的prompt token数
+    tokens_per_segment = 25   # 每个段落的平均token数（输入）
+    response_tokens_per_segment = 30  # 每个段落的响应token数（更精准）
+    seconds_per_batch = 3.0   # 每个大批次约3秒（包含网络延迟）
+    segments_per_second = 0.0  # 实测的每秒处理段落数（已包含并发），没有实测数据时按批次延迟和并发数估算
+    
+    # 有历史遥测数据（main.py 运行后累计）时改用实测值：每段token已分摊提示词开销
+    # 没有 batch_requests 的旧历史文件把单次调用也摊到了段落上，不使用
+    history = load_history()
+    if history and history.get('batch_requests'):
+        measured = derived_rates(history)
+        batch_size = max(1, round(measured['segments_per_request']))
+        base_prompt_tokens = 0
+        tokens_per_segment = measured['prompt_tokens_per_segment']
+        response_tokens_per_segment = measured['completion_tokens_per_segment']
+        seconds_per_batch = measured['avg_batch_latency']
+        segments_per_second = measured['segments_per_second']
+        print(f"使用实测数据 ({history['requests']} 次请求, {history['segments']:,} 个段落, 更新于 {history.get('updated', '未知')}):")
+        print(f"  每段token 输入 {tokens_per_segment:.1f} / 输出 {response_tokens_per_segment:.1f}, "
+              f"每批 {batch_size} 段, 平均延迟 {seconds_per_batch:.2f}秒, {segments_per_second:.1f} 段/秒")
+    else:
+        print("暂无实测遥测数据，使用默认参数估算")
     
     # 优化后的处理分布估算
     quick_fixes_estimated = int(total_estimated_segments * 0.08)    # 快速修正8%
@@ -107,10 +133,6 @@ def estimate_processing_cost(files):
     api_batches = max(1, (api_segments + batch_size - 1) // batch_size)  # 向上取整
     
     # Token估算 - 大批次优化模型
-    base_prompt_tokens = 180  # 优化后的prompt token数
-    tokens_per_segment = 25   # 每个段落的平均token数（输入）
-    response_tokens_per_segment = 30  # 每个段落的响应token数（更精准）
-    
     # 大批次处理的token计算
     total_input_tokens = 0
     total_output_tokens = 0
@@ -122,13 +144,17 @@ def estimate_processing_cost(files):
         batch_input_tokens = base_prompt_tokens + (segments_in_batch * tokens_per_segment)
         batch_output_tokens = segments_in_batch * response_tokens_per_segment
         
-        total_input_tokens += batch_input_tokens
-        total_output_tokens += batch_output_tokens
+        total_input_tokens += int(batch_input_tokens)
+        total_output_tokens += int(batch_output_tokens)
     
     total_tokens_estimated = total_input_tokens + total_output_tokens
     
     # 时间估算 - 优化版
-    api_batch_time = api_batches * 3.0   # 每个大批次约3秒（包含网络延迟）
+    # 最多 MAX_INFLIGHT_BATCHES 个批次同时在途，不能按串行累加批次延迟
+    if segments_per_second > 0:
+        api_batch_time = api_segments / segments_per_second
+    else:
+        api_batch_time = api_batches * seconds_per_batch / max(1, min(MAX_INFLIGHT_BATCHES, api_batches))
     quick_fix_time = quick_fixes_estimated * 0.005  # 快速修正更快
     pre_filter_time = pre_filter_estimated * 0.001   # 预过滤极快
     total_time = api_batch_time + quick_fix_time + pre_filter_time
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+转录解析基准测试
+
+生成 1k~1M 行的合成转录文件（"发言人N mm:ss" 格式），分别测量：
+  - parse:   Transcript.parse，解析文本得到列式转录（不读写缓存）
+  - sidecar: load_transcript，从二进制缓存加载列式转录
+  - list:    parse_transcription_file，一次返回全部段落
+  - stream:  iter_transcription_file，逐段消费、不保留结果
+的耗时、吞吐量和峰值内存（tracemalloc）。
+
+用法: python benchmark_parser.py [--lines 1000,10000,100000,1000000] [--keep]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from text_processor import TextProcessor
+from transcript import Transcript, load_transcript, sidecar_path
+
+SAMPLE_SENTENCES = [
+    "我觉得这个方案可以再考虑一下",
+    "好的，那我们下周再确认具体的时间",
+    "嗯嗯，这个问题之前也讨论过",
+    "因为预算的原因，所以暂时先放一放",
+    "然后我们需要把数据整理好发给大家",
+]
+
+
+def write_synthetic_transcript(path: str, num_lines: int, seed: int = 0):
+    """每条发言为一行说话人+时间戳、1~2行内容和一个空行"""
+    rng = random.Random(seed)
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("chat-1 转录记录\n\n")
+        written += 2
+        turn = 0
+        while written < num_lines:
+            minutes, seconds = divmod(turn * 7, 60)
+            f.write(f"发言人{rng.randint(1, 4)} {minutes % 100:02d}:{seconds:02d}\n")
+            written += 1
+            for _ in range(rng.randint(1, 2)):
+                f.write(rng.choice(SAMPLE_SENTENCES) + "\n")
+                written += 1
+            f.write("\n")
+            written += 1
+            turn += 1
+
+
+def measure(func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='转录解析基准测试')
+    parser.add_argument('--lines', default='1000,10000,100000,1000000', help='合成文件的行数，逗号分隔')
+    parser.add_argument('--keep', action='store_true', help='保留生成的合成文件')
+    args = parser.parse_args()
+
+    processor = TextProcessor()
+    tmp_dir = tempfile.mkdtemp(prefix='transcript_bench_')
+
+    print(f"{'行数':>10} {'文件MB':>8} {'模式':>8} {'段落数':>9} {'耗时(s)':>9} {'行/秒':>12} {'峰值内存MB':>11}")
+    for num_lines in map(int, args.lines.split(',')):
+        path = os.path.join(tmp_dir, f"synthetic_{num_lines}.txt")
+        write_synthetic_transcript(path, num_lines)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+
+        load_transcript(path)  # 写入二进制缓存
+        with contextlib.redirect_stdout(io.StringIO()):
+            modes = {
+                'parse': measure(lambda: len(Transcript.parse(path))),
+                'sidecar': measure(lambda: len(load_transcript(path))),
+                'list': measure(lambda: len(processor.parse_transcription_file(path))),
+                'stream': measure(lambda: sum(1 for _ in processor.iter_transcription_file(path))),
+            }
+
+        for mode, (count, elapsed, peak) in modes.items():
+            print(f"{num_lines:>10} {size_mb:>8.1f} {mode:>8} {count:>9} {elapsed:>9.3f} "
+                  f"{num_lines / elapsed:>12,.0f} {peak / 1024 / 1024:>11.2f}")
+
+        if not args.keep:
+            os.remove(path)
+            os.remove(sidecar_path(path))
+
+    if not args.keep:
+        os.rmdir(tmp_dir)
+    else:
+        print(f"合成文件保存在: {tmp_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,4 +25,14 @@ class Config:
     # API调用配置
     MAX_RETRIES = 3
     REQUEST_TIMEOUT = 30
-    RATE_LIMIT_DELAY = 0.1
\ No newline at end of file
+    RATE_LIMIT_DELAY = 0.1
+    REQUEST_TOKEN_BUDGET = int(os.getenv('GLM_REQUEST_TOKEN_BUDGET', '4000'))  # 每个批量请求 提示+输出 的token预算
+    MAX_COMPLETION_TOKENS = int(os.getenv('GLM_MAX_COMPLETION_TOKENS', '2048'))  # 每个批量请求max_tokens的上限
+    MAX_INFLIGHT_BATCHES = int(os.getenv('GLM_MAX_INFLIGHT_BATCHES', '4'))  # 同时在途的批量请求数
+    
+    # 纠错结果缓存（设为空字符串时不使用缓存）
+    CORRECTION_CACHE_PATH = os.getenv('CORRECTION_CACHE_PATH', './.cache/corrections.sqlite')
+    CORRECTION_CACHE_MAX_ENTRIES = int(os.getenv('CORRECTION_CACHE_MAX_ENTRIES', '200000'))
+    
+    # 快速修复词典（多个文件用系统路径分隔符分隔），格式见 quick_fix_engine.load_quick_fix_rules
+    QUICK_FIX_DICTS = [p for p in os.getenv('QUICK_FIX_DICTS', '').split(os.pathsep) if p]
\ No newline at end of file
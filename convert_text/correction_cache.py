@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+def normalize_segment(text: str) -> str:
+    """缓存键使用的规范化文本：合并空白并去掉首尾空白"""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class CorrectionCache:
+    """
+    跨文件、跨运行的纠错结果缓存（SQLite）
+
+    键为 (规范化后的段落文本, 模型, 提示词版本)，值为API返回的修正结果。
+    超过 max_entries 条时按最近使用时间淘汰最久未用的条目（LRU），每次淘汰到容量的90%。
+    """
+
+    def __init__(self, path: str, max_entries: int = 200000):
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS corrections ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_corrections_last_used ON corrections (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text: str, model: str, prompt_version: str) -> str:
+        digest = hashlib.sha256(normalize_segment(text).encode('utf-8')).hexdigest()
+        return f"{model}:{prompt_version}:{digest}"
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict]:
+        """批量查询，返回命中的 {key: result}，并刷新命中条目的使用时间"""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                chunk = unique[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, result FROM corrections WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, result in rows:
+                    found[key] = json.loads(result)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE corrections SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items: Dict[str, Dict]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO corrections (key, result, last_used) VALUES (?, ?, ?)",
+                [(key, json.dumps(result, ensure_ascii=False), now) for key, result in items.items()]
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM corrections").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        excess = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM corrections WHERE key IN "
+            "(SELECT key FROM corrections ORDER BY last_used ASC LIMIT ?)", (excess,)
+        )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM corrections").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_correction_cache(path: Optional[str], max_entries: int) -> Optional[CorrectionCache]:
+    """path 为空时不使用缓存"""
+    return CorrectionCache(path, max_entries) if path else None
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+# 结果中需要保存的字段（与 GLMClient._create_result 一致）
+RESULT_FIELDS = ('original_text', 'corrected_text', 'has_errors', 'confidence', 'errors', 'method')
+# 这些处理方式表示API失败或回复中缺少该段落，下次重新处理
+RETRY_METHODS = ('api_failed', 'api_error', 'batch_api_missing')
+
+
+def segment_hash(segment: Dict) -> str:
+    return hashlib.sha256(segment.get('text', '').strip().encode('utf-8')).hexdigest()
+
+
+class CorrectionManifest:
+    """
+    保存在修正文件旁的逐段清单：每个段落文本的哈希 -> 该段落的修正结果
+
+    重新处理同一个转录文件时（例如ASR只重跑了少数段落），只有新增或内容变化的段落需要再经过
+    快速修复、预过滤和API，其余段落直接复用清单中的结果。fingerprint（模型、提示词版本、快速修复规则）
+    变化时整个清单失效。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.entries = {}
+        self._recorded = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  无法读取修正清单 {self.path}: {e}")
+            return
+        if data.get('version') == self.VERSION and data.get('fingerprint') == self.fingerprint:
+            self.entries = data.get('segments', {})
+        else:
+            print(f"修正配置已变化，忽略旧的修正清单: {self.path}")
+
+    def lookup(self, segment: Dict) -> Optional[Dict]:
+        """清单中有该段落时返回可复用的结果，否则返回None"""
+        entry = self.entries.get(segment_hash(segment))
+        if entry is None:
+            return None
+        result = segment.copy()
+        result.update(entry)
+        return result
+
+    def split(self, segments: List[Dict]) -> Tuple[List[Optional[Dict]], List[int]]:
+        """返回 (结果列表：可复用的位置已填好、其余为None, 需要重新处理的段落下标)"""
+        results = []
+        changed = []
+        for i, segment in enumerate(segments):
+            result = self.lookup(segment)
+            if result is None:
+                changed.append(i)
+            results.append(result)
+        return results, changed
+
+    def record(self, segment: Dict, result: Optional[Dict]):
+        """记录一个段落本次的结果（结果可以逐个到达），commit() 时写入清单；需要重试的结果不记录"""
+        if result is None or result.get('method') in RETRY_METHODS:
+            return
+        self._recorded[segment_hash(segment)] = {field: result[field] for field in RESULT_FIELDS if field in result}
+
+    def commit(self):
+        """用本次记录的结果重写清单（已不存在的段落随之删除）"""
+        self.entries, self._recorded = self._recorded, {}
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'fingerprint': self.fingerprint, 'segments': self.entries},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def save(self, segments: List[Dict], results: List[Dict]):
+        """用本次的全部结果重写清单"""
+        for segment, result in zip(segments, results):
+            self.record(segment, result)
+        self.commit()
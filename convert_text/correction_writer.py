@@ -0,0 +1,217 @@
+import os
+import shutil
+import tempfile
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+# 报告和摘要中列出的处理方式
+METHOD_LABELS = (
+    ('batch_api', '批量API处理'),
+    ('batch_api_missing', 'API回复缺失'),
+    ('quick_fix', '快速修正'),
+    ('pre_filter', '预过滤跳过'),
+    ('cache_hit', '缓存命中'),
+)
+
+
+class CorrectionTally:
+    """修正统计的累计计数，结果逐个加入，不需要保留结果列表"""
+
+    def __init__(self):
+        self.total = 0
+        self.corrected = 0
+        self.errors = 0
+        self.methods = Counter()
+
+    def add(self, result: Dict):
+        self.total += 1
+        if result.get('has_errors', False):
+            self.corrected += 1
+        if 'error' in result:
+            self.errors += 1
+        self.methods[result.get('method')] += 1
+
+    @property
+    def unchanged(self) -> int:
+        return self.total - self.corrected - self.errors
+
+    def percent(self, count: int) -> float:
+        return count / self.total * 100 if self.total else 0.0
+
+
+def format_corrected_entry(result: Dict) -> str:
+    """修正文件中一个段落的内容（无需输出时返回空字符串）"""
+    speaker = result.get('speaker', 'Unknown')
+    timestamp = result.get('timestamp', 'Unknown')
+
+    if 'error' in result:
+        # API调用出错，使用原文并标记错误
+        return f"{speaker} {timestamp}\n❌ {result.get('text', '【处理出错】')}\n\n"
+    if result.get('has_errors', False) and result.get('corrected_text'):
+        # 有修正，使用修正后的文本（多行文本保持原有换行）
+        return f"{speaker} {timestamp}\n{result['corrected_text']}\n\n"
+    # 无需修正，使用原文；只有非空文本才输出
+    original_text = result.get('text', '')
+    if original_text.strip():
+        return f"{speaker} {timestamp}\n{original_text}\n\n"
+    return ''
+
+
+def format_report_entry(number: int, result: Dict) -> str:
+    """检测报告详细修正列表中的一个段落"""
+    lines = [
+        f"【段落 {number}】",
+        f"时间: {result.get('timestamp', 'Unknown')}",
+        f"发言人: {result.get('speaker', 'Unknown')}",
+        f"处理方式: {result.get('method', 'Unknown')}",
+    ]
+
+    if 'error' in result:
+        lines.append(f"❌ API调用错误: {result['error']}")
+        lines.append(f"原文: {result.get('text', '')}")
+    elif result.get('has_errors', False):
+        lines.append("🔧 已修正")
+        lines.append(f"原文: {result.get('original_text', result.get('text', ''))}")
+        lines.append(f"修正: {result.get('corrected_text', '')}")
+        lines.append(f"置信度: {result.get('confidence', 0):.2f}")
+
+        errors = result.get('errors', [])
+        if errors:
+            lines.append("错误详情:")
+            for j, error in enumerate(errors, 1):
+                line = f"  {j}. {error.get('type', 'Unknown')}: '{error.get('original', '')}' → '{error.get('corrected', '')}'"
+                if 'start' in error:
+                    line += f" (位置 {error['start']}-{error['end']})"
+                lines.append(line)
+                if error.get('reason'):
+                    lines.append(f"     原因: {error.get('reason')}")
+    else:
+        lines.append("✅ 无需修正")
+        lines.append(f"文本: {result.get('text', '')}")
+
+    return '\n'.join(lines) + "\n\n" + "-" * 50 + "\n\n"
+
+
+class CorrectionOutputWriter:
+    """
+    流式写出修正文件和检测报告
+
+    结果可以按任意顺序通过 add(段落下标, 结果) 加入，写出时按段落顺序：连续的部分立即写入，
+    提前到达的段落格式化后暂存到临时文件（内存中只保留下标和偏移量），轮到时再读回写出。
+    报告开头的统计要等全部结果到齐才知道，所以明细先写入临时文件，close() 时写好统计后再把明细拷贝到报告末尾。
+    修正文件先写到 .part 文件，close() 时才改为正式文件名；处理出错时调用 discard() 删除所有部分输出。
+    """
+
+    def __init__(self, input_file: str, output_dir: str, write_report: bool = True):
+        self.input_file = input_file
+        self.tally = CorrectionTally()
+        self._next = 0
+        self._spilled = {}  # 段落下标 -> (暂存文件中的偏移, 修正文件内容字节数, 报告明细字节数)
+        self._spill = None
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = os.path.splitext(os.path.basename(input_file))[0]
+        self.corrected_path = os.path.join(output_dir, f"{filename}_corrected_{timestamp}.txt")
+        self.report_path = (os.path.join(output_dir, f"{filename}_correction_report_{timestamp}.txt")
+                            if write_report else None)
+
+        self._partial_path = f"{self.corrected_path}.part"
+        self._corrected = open(self._partial_path, 'w', encoding='utf-8')
+        self._corrected.write(f"{filename} - 自动修正版 (批量处理优化)\n\n")
+        self._corrected.write(f"修正时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        self._corrected.write(f"原始文件: {input_file}\n")
+        self._corrected.write("=" * 50 + "\n\n")
+
+        self._details = None
+        if self.report_path is not None:
+            self._details = tempfile.TemporaryFile('w+', encoding='utf-8', dir=output_dir)
+
+    def add(self, index: int, result: Dict):
+        self.tally.add(result)
+        corrected = format_corrected_entry(result)
+        report = format_report_entry(index + 1, result) if self._details is not None else ''
+        if index != self._next:
+            self._spill_entry(index, corrected, report)
+            return
+        self._write(corrected, report)
+        self._next += 1
+        while self._next in self._spilled:
+            self._write(*self._read_spilled(self._spilled.pop(self._next)))
+            self._next += 1
+
+    def _spill_entry(self, index: int, corrected: str, report: str):
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile()
+        corrected_bytes, report_bytes = corrected.encode('utf-8'), report.encode('utf-8')
+        offset = self._spill.seek(0, os.SEEK_END)
+        self._spill.write(corrected_bytes)
+        self._spill.write(report_bytes)
+        self._spilled[index] = (offset, len(corrected_bytes), len(report_bytes))
+
+    def _read_spilled(self, entry: Tuple[int, int, int]) -> Tuple[str, str]:
+        offset, corrected_len, report_len = entry
+        self._spill.seek(offset)
+        return (self._spill.read(corrected_len).decode('utf-8'),
+                self._spill.read(report_len).decode('utf-8'))
+
+    def _write(self, corrected: str, report: str):
+        self._corrected.write(corrected)
+        if self._details is not None:
+            self._details.write(report)
+
+    def close(self) -> Tuple[Optional[str], str]:
+        """写完剩余结果并关闭文件，返回 (检测报告路径或None, 修正文件路径)"""
+        for index in sorted(self._spilled):
+            self._write(*self._read_spilled(self._spilled[index]))
+        self._spilled.clear()
+        self._close_spill()
+        self._corrected.close()
+        os.replace(self._partial_path, self.corrected_path)
+
+        if self._details is not None:
+            with open(self.report_path, 'w', encoding='utf-8') as f:
+                self._write_report_header(f)
+                self._details.seek(0)
+                shutil.copyfileobj(self._details, f)
+            self._details.close()
+            self._details = None
+
+        return self.report_path, self.corrected_path
+
+    def discard(self):
+        """处理出错时关闭并删除所有部分输出（不生成修正文件和报告）"""
+        self._spilled.clear()
+        self._close_spill()
+        self._corrected.close()
+        if os.path.exists(self._partial_path):
+            os.remove(self._partial_path)
+        if self._details is not None:
+            self._details.close()
+            self._details = None
+
+    def _close_spill(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def _write_report_header(self, f):
+        tally = self.tally
+        f.write("=" * 70 + "\n")
+        f.write("语音转录文本自动修正报告 (批量优化版)\n")
+        f.write("=" * 70 + "\n")
+        f.write(f"输入文件: {self.input_file}\n")
+        f.write(f"处理时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"总段落数: {tally.total}\n")
+        f.write(f"修正段落数: {tally.corrected}\n")
+        f.write(f"修正率: {tally.percent(tally.corrected):.2f}%\n")
+        if tally.errors > 0:
+            f.write(f"API错误数: {tally.errors}\n")
+
+        f.write(f"\n处理方式分布:\n")
+        for method, label in METHOD_LABELS:
+            f.write(f"  {label}: {tally.methods[method]} ({tally.percent(tally.methods[method]):.1f}%)\n")
+
+        f.write("\n" + "=" * 70 + "\n")
+        f.write("详细修正列表\n")
+        f.write("=" * 70 + "\n\n")
@@ -1,18 +1,19 @@
 import os
-import json
-import pandas as pd
 import time
-from datetime import datetime
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 from glm_client import GLMClient
+from correction_manifest import CorrectionManifest
+from correction_writer import METHOD_LABELS, CorrectionOutputWriter, CorrectionTally
 from text_processor import TextProcessor
 from config import Config
 
 class ErrorDetector:
-    def __init__(self, api_key: str = None):
-        self.glm_client = GLMClient(api_key)
+    def __init__(self, api_key: str = None, quick_fix_dicts: List[str] = None, cache_path: str = None,
+                 incremental: bool = True):
+        self.glm_client = GLMClient(api_key, quick_fix_dicts, cache_path)
         self.text_processor = TextProcessor()
         self.results = []
+        self.incremental = incremental  # 是否根据修正清单只处理新增或变化的段落
         
         # 创建必要的目录
         os.makedirs(Config.OUTPUT_DIR, exist_ok=True)
@@ -26,187 +27,138 @@ class ErrorDetector:
         print(f"开始处理文件: {input_file}")
         
         # 1. 解析转录文件
-        segments = self.text_processor.parse_transcription_file(input_file)
-        print(f"解析得到 {len(segments)} 个文本段落")
-        
-        # 过滤掉空文本段落
-        valid_segments = [seg for seg in segments if seg.get('text', '').strip()]
-        print(f"有效段落数: {len(valid_segments)}")
+        valid_segments = self.load_valid_segments(input_file)
         
-        # 2. 批量检测和自动修正 - 使用优化版批量处理
+        # 2. 批量检测和自动修正 - 使用优化版批量处理，结果边处理边写入报告和修正文件
         print("开始错误检测和自动修正...")
         print("使用批量处理模式，大幅减少API调用次数和token消耗...")
         
         start_time = time.time()
-        results = self.glm_client.batch_detect_and_correct_segments(valid_segments)
+        report_path, corrected_path = self.correct_and_write(valid_segments, input_file)
         end_time = time.time()
         
         processing_time = end_time - start_time
         print(f"批量处理完成，耗时: {processing_time:.1f}秒")
         
-        # 3. 生成检测报告
-        report_path = self._generate_correction_report(results, input_file)
-        
-        # 4. 生成修正版本文件
-        corrected_path = self._generate_corrected_file(results, input_file)
-        
-        # 5. 生成统计摘要
-        self._print_correction_summary(results)
-        
         print(f"处理完成！")
         print(f"📊 检测报告: {report_path}")
         print(f"📝 修正文件: {corrected_path}")
         
         return report_path, corrected_path
 
-    def _generate_correction_report(self, results: List[Dict], input_file: str) -> str:
+    def manifest_path(self, input_file: str) -> str:
+        """逐段修正清单的路径（与修正文件在同一目录）"""
+        filename = os.path.splitext(os.path.basename(input_file))[0]
+        return os.path.join(Config.OUTPUT_DIR, f"{filename}_corrected.manifest.json")
+
+    def open_manifest(self, input_file: str):
+        """增量模式下返回该文件的修正清单，否则返回None"""
+        if not self.incremental:
+            return None
+        return CorrectionManifest(self.manifest_path(input_file), self.glm_client.correction_fingerprint())
+
+    def split_segments(self, segments: List[Dict], manifest) -> tuple:
+        """返回 (结果列表：可复用的已填好, 需要重新处理的段落下标)"""
+        if manifest is None:
+            return [None] * len(segments), list(range(len(segments)))
+        results, changed = manifest.split(segments)
+        print(f"增量处理: 复用 {len(segments) - len(changed)} 个段落, 新增或变化 {len(changed)} 个段落")
+        return results, changed
+
+    def merge_segment_results(self, segments: List[Dict], results: List[Dict], changed: List[int],
+                              changed_results: List[Dict], manifest) -> List[Dict]:
+        """把重新处理的结果填回原位置，并更新修正清单"""
+        for i, result in zip(changed, changed_results):
+            results[i] = result
+        if manifest is not None:
+            manifest.save(segments, results)
+        return results
+
+    def correct_segments(self, segments: List[Dict], input_file: str,
+                         on_result: Callable[[int, Dict], None] = None) -> Optional[List[Dict]]:
         """
-        生成包含修正信息的详细报告
+        修正一个文件的段落；增量模式下只处理新增或内容变化的段落
+        给出 on_result 时，每个段落一有结果就调用 on_result(段落下标, 结果)，结果不在内存中保留，返回None；
+        否则返回按段落顺序的结果列表
         """
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = os.path.splitext(os.path.basename(input_file))[0]
-        report_path = os.path.join(Config.OUTPUT_DIR, f"{filename}_correction_report_{timestamp}.txt")
-        
-        total_segments = len(results)
-        corrected_segments = sum(1 for r in results if r.get('has_errors', False))
-        api_errors = sum(1 for r in results if 'error' in r)
-        
-        # 统计处理方式
-        batch_api_count = len([r for r in results if r.get('method') == 'batch_api'])
-        quick_fix_count = len([r for r in results if r.get('method') == 'quick_fix'])
-        pre_filter_count = len([r for r in results if r.get('method') == 'pre_filter'])
-        
-        with open(report_path, 'w', encoding='utf-8') as f:
-            f.write("=" * 70 + "\n")
-            f.write("语音转录文本自动修正报告 (批量优化版)\n")
-            f.write("=" * 70 + "\n")
-            f.write(f"输入文件: {input_file}\n")
-            f.write(f"处理时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"总段落数: {total_segments}\n")
-            f.write(f"修正段落数: {corrected_segments}\n")
-            f.write(f"修正率: {corrected_segments/total_segments*100:.2f}%\n")
-            if api_errors > 0:
-                f.write(f"API错误数: {api_errors}\n")
-            
-            # 新增：处理方式统计
-            f.write(f"\n处理方式分布:\n")
-            f.write(f"  批量API处理: {batch_api_count} ({batch_api_count/total_segments*100:.1f}%)\n")
-            f.write(f"  快速修正: {quick_fix_count} ({quick_fix_count/total_segments*100:.1f}%)\n")
-            f.write(f"  预过滤跳过: {pre_filter_count} ({pre_filter_count/total_segments*100:.1f}%)\n")
-            
-            f.write("\n" + "=" * 70 + "\n")
-            f.write("详细修正列表\n")
-            f.write("=" * 70 + "\n\n")
-            
-            for i, result in enumerate(results, 1):
-                # 写入基本信息
-                f.write(f"【段落 {i}】\n")
-                f.write(f"时间: {result.get('timestamp', 'Unknown')}\n")
-                f.write(f"发言人: {result.get('speaker', 'Unknown')}\n")
-                f.write(f"处理方式: {result.get('method', 'Unknown')}\n")
-                
-                # 检查是否有API错误
-                if 'error' in result:
-                    f.write(f"❌ API调用错误: {result['error']}\n")
-                    f.write(f"原文: {result.get('text', '')}\n")
-                
-                # 检查是否有修正
-                elif result.get('has_errors', False):
-                    f.write("🔧 已修正\n")
-                    f.write(f"原文: {result.get('original_text', result.get('text', ''))}\n")
-                    f.write(f"修正: {result.get('corrected_text', '')}\n")
-                    f.write(f"置信度: {result.get('confidence', 0):.2f}\n")
-                    
-                    # 显示具体错误详情
-                    errors = result.get('errors', [])
-                    if errors:
-                        f.write("错误详情:\n")
-                        for j, error in enumerate(errors, 1):
-                            f.write(f"  {j}. {error.get('type', 'Unknown')}: ")
-                            f.write(f"'{error.get('original', '')}' → '{error.get('corrected', '')}'\n")
-                            if error.get('reason'):
-                                f.write(f"     原因: {error.get('reason')}\n")
-                
-                else:
-                    f.write("✅ 无需修正\n")
-                    f.write(f"文本: {result.get('text', '')}\n")
-                
-                f.write("\n" + "-" * 50 + "\n\n")
-        
-        return report_path
+        collected = None
+        if on_result is None:
+            collected = [None] * len(segments)
+            on_result = collected.__setitem__
+        
+        manifest = self.open_manifest(input_file)
+        changed = []
+        for i, segment in enumerate(segments):
+            result = manifest.lookup(segment) if manifest is not None else None
+            if result is None:
+                changed.append(i)
+                continue
+            manifest.record(segment, result)
+            on_result(i, result)
+        if manifest is not None:
+            print(f"增量处理: 复用 {len(segments) - len(changed)} 个段落, 新增或变化 {len(changed)} 个段落")
+        
+        if changed:
+            def on_changed_result(j: int, result: Dict):
+                if manifest is not None:
+                    manifest.record(segments[changed[j]], result)
+                on_result(changed[j], result)
+            self.glm_client.batch_detect_and_correct_segments([segments[i] for i in changed], on_changed_result)
+        if manifest is not None:
+            manifest.commit()
+        return collected
 
-    def _generate_corrected_file(self, results: List[Dict], input_file: str) -> str:
+    def correct_and_write(self, segments: List[Dict], input_file: str, only_correct: bool = False) -> tuple:
         """
-        生成修正后的对话文件 - 修复版本，保持原始格式
+        修正段落，同时流式写出检测报告（only_correct 时跳过）和修正文件，并打印统计摘要
+        处理出错时删除部分输出再抛出异常
+        返回：(检测报告路径或None, 修正文件路径)
         """
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = os.path.splitext(os.path.basename(input_file))[0]
-        corrected_path = os.path.join(Config.OUTPUT_DIR, f"{filename}_corrected_{timestamp}.txt")
-        
-        with open(corrected_path, 'w', encoding='utf-8') as f:
-            f.write(f"{filename} - 自动修正版 (批量处理优化)\n\n")
-            f.write(f"修正时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"原始文件: {input_file}\n")
-            f.write("=" * 50 + "\n\n")
-            
-            for result in results:
-                speaker = result.get('speaker', 'Unknown')
-                timestamp = result.get('timestamp', 'Unknown')
-                
-                # 使用修正后的文本，如果没有修正则使用原文
-                if 'error' in result:
-                    # API调用出错，使用原文并标记错误
-                    display_text = result.get('text', '【处理出错】')
-                    f.write(f"{speaker} {timestamp}\n")
-                    f.write(f"❌ {display_text}\n\n")
-                
-                elif result.get('has_errors', False) and result.get('corrected_text'):
-                    # 有修正，使用修正后的文本
-                    corrected_text = result.get('corrected_text', result.get('text', ''))
-                    # 如果修正文本包含多行，保持原有的换行格式
-                    if '\n' in corrected_text:
-                        f.write(f"{speaker} {timestamp}\n")
-                        f.write(f"{corrected_text}\n\n")
-                    else:
-                        f.write(f"{speaker} {timestamp}\n")
-                        f.write(f"{corrected_text}\n\n")
-                
-                else:
-                    # 无需修正，使用原文
-                    original_text = result.get('text', '')
-                    if original_text.strip():  # 只有非空文本才输出
-                        f.write(f"{speaker} {timestamp}\n")
-                        f.write(f"{original_text}\n\n")
-        
-        return corrected_path
+        writer = CorrectionOutputWriter(input_file, Config.OUTPUT_DIR, write_report=not only_correct)
+        try:
+            self.correct_segments(segments, input_file, writer.add)
+        except BaseException:
+            writer.discard()
+            raise
+        report_path, corrected_path = writer.close()
+        self._print_correction_summary(writer.tally)
+        return report_path, corrected_path
 
-    def _print_correction_summary(self, results: List[Dict]):
+    def load_valid_segments(self, input_file: str) -> List[Dict]:
+        """解析转录文件并过滤掉空文本段落"""
+        segments = self.text_processor.parse_transcription_file(input_file)
+        valid_segments = [seg for seg in segments if seg.get('text', '').strip()]
+        print(f"{input_file}: 解析得到 {len(segments)} 个文本段落, 有效段落数: {len(valid_segments)}")
+        return valid_segments
+
+    def write_outputs(self, results: List[Dict], input_file: str, only_correct: bool = False) -> tuple:
+        """
+        写出检测报告（only_correct 时跳过）和修正文件，并打印统计摘要
+        返回：(检测报告路径或None, 修正文件路径)
+        """
+        writer = CorrectionOutputWriter(input_file, Config.OUTPUT_DIR, write_report=not only_correct)
+        for i, result in enumerate(results):
+            writer.add(i, result)
+        report_path, corrected_path = writer.close()
+        self._print_correction_summary(writer.tally)
+        return report_path, corrected_path
+
+    def _print_correction_summary(self, tally: CorrectionTally):
         """
         打印修正统计摘要 - 包含优化效果
         """
-        total = len(results)
-        corrected = sum(1 for r in results if r.get('has_errors', False))
-        errors = sum(1 for r in results if 'error' in r)
-        unchanged = total - corrected - errors
-        
-        # 统计处理方式
-        batch_api_count = len([r for r in results if r.get('method') == 'batch_api'])
-        quick_fix_count = len([r for r in results if r.get('method') == 'quick_fix'])
-        pre_filter_count = len([r for r in results if r.get('method') == 'pre_filter'])
-        
         print("\n" + "=" * 50)
         print("📊 修正统计摘要")
         print("=" * 50)
-        print(f"总段落数: {total}")
-        print(f"已修正: {corrected} ({corrected/total*100:.1f}%)")
-        print(f"无需修正: {unchanged} ({unchanged/total*100:.1f}%)")
-        if errors > 0:
-            print(f"处理失败: {errors} ({errors/total*100:.1f}%)")
+        print(f"总段落数: {tally.total}")
+        print(f"已修正: {tally.corrected} ({tally.percent(tally.corrected):.1f}%)")
+        print(f"无需修正: {tally.unchanged} ({tally.percent(tally.unchanged):.1f}%)")
+        if tally.errors > 0:
+            print(f"处理失败: {tally.errors} ({tally.percent(tally.errors):.1f}%)")
         
         print(f"\n批量处理优化效果:")
-        print(f"批量API处理: {batch_api_count} ({batch_api_count/total*100:.1f}%)")
-        print(f"快速修正: {quick_fix_count} ({quick_fix_count/total*100:.1f}%)")
-        print(f"预过滤跳过: {pre_filter_count} ({pre_filter_count/total*100:.1f}%)")
+        for method, label in METHOD_LABELS:
+            print(f"{label}: {tally.methods[method]} ({tally.percent(tally.methods[method]):.1f}%)")
         print("=" * 50)
 
     def detect_and_correct_file_only_correct(self, input_file: str) -> str:
@@ -216,30 +168,19 @@ class ErrorDetector:
         print(f"开始处理文件: {input_file}")
         
         # 1. 解析转录文件
-        segments = self.text_processor.parse_transcription_file(input_file)
-        print(f"解析得到 {len(segments)} 个文本段落")
-        
-        # 过滤掉空文本段落
-        valid_segments = [seg for seg in segments if seg.get('text', '').strip()]
-        print(f"有效段落数: {len(valid_segments)}")
+        valid_segments = self.load_valid_segments(input_file)
         
-        # 2. 批量检测和自动修正
+        # 2. 批量检测和自动修正，结果边处理边写入修正文件
         print("开始错误检测和自动修正（仅生成修正文件）...")
         
         start_time = time.time()
-        results = self.glm_client.batch_detect_and_correct_segments(valid_segments)
+        _, corrected_path = self.correct_and_write(valid_segments, input_file, only_correct=True)
         end_time = time.time()
         
         processing_time = end_time - start_time
         print(f"批量处理完成，耗时: {processing_time:.1f}秒")
         
-        # 3. 生成修正版本文件
-        corrected_path = self._generate_corrected_file(results, input_file)
-        
-        # 4. 生成统计摘要
-        self._print_correction_summary(results)
-        
         print(f"处理完成！")
         print(f"📝 修正文件: {corrected_path}")
         
-        return corrected_path
\ No newline at end of file
+        return corrected_path
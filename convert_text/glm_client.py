@@ -1,12 +1,61 @@
+import hashlib
 import re
 import requests
 import json
+import threading
 import time
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+from api_metrics import APIMetrics
 from config import Config
+from correction_cache import CorrectionCache, open_correction_cache
+from quick_fix_engine import QuickFixEngine, load_rule_files
+from token_budget import PackedBatch, TokenBudgetPacker, estimate_tokens
+
+# 快速修复后的基本清理
+WHITESPACE_RE = re.compile(r'\s+')
+REPEATED_CHAR_RE = re.compile(r'(.)\1{3,}')
+
+class AdaptiveBackoff:
+    """
+    由429驱动的自适应退避，所有并发请求共享
+
+    收到429后把请求间隔翻倍（优先使用 Retry-After），并让所有线程等到冷却结束；
+    请求成功后逐步缩短间隔，直到恢复为0。
+    """
+
+    def __init__(self, initial_delay: float = 0.5, max_delay: float = 30.0, decay: float = 0.8):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.decay = decay
+        self.delay = 0.0
+        self.rate_limited_count = 0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """在发送请求前调用，处于冷却期时阻塞"""
+        while True:
+            with self._lock:
+                remaining = self._resume_at - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self.rate_limited_count += 1
+            self.delay = min(self.max_delay, max(self.initial_delay, self.delay * 2))
+            delay = max(self.delay, retry_after or 0.0)
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    def on_success(self):
+        with self._lock:
+            self.delay = self.delay * self.decay if self.delay * self.decay >= 0.05 else 0.0
+
 
 class GLMClient:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, quick_fix_dicts: List[str] = None, cache_path: str = None):
         self.api_key = api_key or Config.GLM_API_KEY
         self.base_url = Config.GLM_BASE_URL
         self.model = Config.GLM_MODEL
@@ -34,11 +83,46 @@ class GLMClient:
             '申玉飞': '沈玉飞', '孙玉飞': '沈玉飞', '申一飞': '沈玉飞'
         }
         
+        # 外部词典中的规则（人名、术语等）覆盖内置规则，所有规则编译为一个自动机
+        if quick_fix_dicts is None:
+            quick_fix_dicts = Config.QUICK_FIX_DICTS
+        self.quick_fixes.update(load_rule_files(quick_fix_dicts))
+        self.quick_fix_engine = QuickFixEngine(self.quick_fixes)
+        
         # 批量处理配置 - 优化token使用
-        self.batch_size = 25  # 每批处理的文本数量
-        self.max_tokens_per_request = 1200  # 每次请求的最大token数
+        # 每批装入多少文本由token预算决定（见 TokenBudgetPacker），batch_size 只是段落数上限
+        self.batch_size = 50  # 每批最多处理的文本数量
+        self.max_tokens_per_request = Config.MAX_COMPLETION_TOKENS  # 每次请求max_tokens的上限
+        self.packer = TokenBudgetPacker(
+            prompt_overhead=estimate_tokens(self._create_structured_batch_prompt([])),
+            request_budget=Config.REQUEST_TOKEN_BUDGET,
+            max_completion_tokens=self.max_tokens_per_request,
+            max_segments=self.batch_size
+        )
         self.api_retry_limit = 2  # API重试次数
-        
+        self.rate_limit_retry_limit = 6  # 遇到429时的最多重试次数
+        self.max_inflight_batches = Config.MAX_INFLIGHT_BATCHES  # 同时在途的批次数
+        
+        # 长连接会话，所有批次复用TCP/TLS连接
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(32, self.max_inflight_batches))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.backoff = AdaptiveBackoff()
+        self.metrics = APIMetrics()  # 每次请求的延迟、token用量、重试和限流
+        
+        # 纠错结果缓存：键包含模型和提示词版本，修改提示词后旧结果自动失效；cache_path='' 时不使用缓存
+        self.prompt_version = hashlib.sha256(self._create_structured_batch_prompt([]).encode('utf-8')).hexdigest()[:12]
+        self.cache = open_correction_cache(
+            Config.CORRECTION_CACHE_PATH if cache_path is None else cache_path, Config.CORRECTION_CACHE_MAX_ENTRIES
+        )
+        
+    def correction_fingerprint(self) -> str:
+        """模型、批量提示词和快速修复规则的指纹；任何一项变化都会使已保存的逐段修正结果失效"""
+        rules = json.dumps(sorted(self.quick_fixes.items()), ensure_ascii=False)
+        rules_version = hashlib.sha256(rules.encode('utf-8')).hexdigest()[:12]
+        return f"{self.model}:{self.prompt_version}:{rules_version}"
+    
     def test_connection(self) -> bool:
         """测试API连接"""
         print("测试API连接...")
@@ -54,8 +138,8 @@ class GLMClient:
             print(f"❌ API连接异常: {e}")
             return False
     
-    def _make_api_call(self, prompt: str, max_tokens: int = 300) -> Optional[str]:
-        """基础API调用方法 - 带错误恢复"""
+    def _make_api_call(self, prompt: str, max_tokens: int = 300, segments: int = 0) -> Optional[str]:
+        """基础API调用方法 - 带错误恢复；每次调用在 self.metrics 中记录一条（segments 为请求包含的段落数）"""
         headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {self.api_key}'
@@ -70,36 +154,66 @@ class GLMClient:
             "stream": False
         }
         
-        for attempt in range(self.api_retry_limit):
+        attempt = 0
+        rate_limited = 0
+        status = None
+        usage = None
+        latency = 0.0
+        content = None
+        call_start = time.time()
+        while attempt < self.api_retry_limit:
             try:
-                response = requests.post(
+                self.backoff.wait()
+                request_start = time.time()
+                response = self.session.post(
                     f'{self.base_url}chat/completions',
                     headers=headers,
                     json=payload,
                     timeout=30
                 )
+                latency = time.time() - request_start
+                status = response.status_code
                 
                 if response.status_code == 200:
+                    self.backoff.on_success()
                     response_json = response.json()
+                    usage = response_json.get('usage')
                     content = self._extract_content_safely(response_json)
                     if content:
-                        return content
+                        break
+                    attempt += 1
                 elif response.status_code == 429:
-                    time.sleep(2)  # 速率限制，等待后重试
+                    # 速率限制，由共享的退避状态决定等待时间，不计入普通重试次数
+                    rate_limited += 1
+                    if rate_limited > self.rate_limit_retry_limit:
+                        print("API持续限流，放弃本次请求")
+                        break
+                    self.backoff.on_rate_limited(self._parse_retry_after(response))
                     continue
                 else:
                     print(f"API错误状态码: {response.status_code}")
                     break
                     
             except Exception as e:
-                if attempt < self.api_retry_limit - 1:
+                attempt += 1
+                if attempt < self.api_retry_limit:
                     time.sleep(1)
                     continue
                 else:
                     print(f"API调用失败: {e}")
                     break
         
-        return None
+        retries = attempt if content else max(attempt - 1, 0)
+        self.metrics.record(status, segments, latency, time.time() - call_start, usage,
+                            retries, rate_limited, bool(content))
+        return content or None
+    
+    @staticmethod
+    def _parse_retry_after(response) -> Optional[float]:
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
     
     def _extract_content_safely(self, response_json: dict) -> str:
         """安全提取API响应内容 - 处理GLM-4.5的各种响应格式"""
@@ -142,23 +256,12 @@ class GLMClient:
         return ""
     
     def _apply_quick_fixes(self, text: str) -> tuple[str, list]:
-        """应用快速修复规则 - 避免API调用"""
-        corrected_text = text
-        errors = []
-        
-        for wrong, correct in self.quick_fixes.items():
-            if wrong in corrected_text:
-                corrected_text = corrected_text.replace(wrong, correct)
-                errors.append({
-                    'type': '快速修正',
-                    'original': wrong,
-                    'corrected': correct,
-                    'confidence': 0.95
-                })
+        """应用快速修复规则 - 避免API调用；所有规则一次扫描完成，错误详情中带有在原文中的位置"""
+        corrected_text, errors = self.quick_fix_engine.apply(text)
         
         # 基本清理
-        corrected_text = re.sub(r'\s+', ' ', corrected_text).strip()
-        corrected_text = re.sub(r'(.)\1{3,}', r'\1', corrected_text)  # 去重复字符
+        corrected_text = WHITESPACE_RE.sub(' ', corrected_text).strip()
+        corrected_text = REPEATED_CHAR_RE.sub(r'\1', corrected_text)  # 去重复字符
         
         return corrected_text, errors
     
@@ -222,7 +325,7 @@ class GLMClient:
         # 第三层：API处理
         try:
             prompt = self._create_optimized_prompt(original_text)
-            api_response = self._make_api_call(prompt, max_tokens=150)
+            api_response = self._make_api_call(prompt, max_tokens=150, segments=1)
             
             if api_response and api_response.strip() != original_text:
                 # 验证API响应的有效性
@@ -286,101 +389,255 @@ class GLMClient:
             'method': method
         }
     
-    def batch_detect_and_correct_segments(self, segments: List[Dict]) -> List[Dict]:
-        """批量处理文本段落 - 三层优化策略"""
+    def batch_detect_and_correct_segments(self, segments: List[Dict],
+                                          on_result: Callable[[int, Dict], None] = None) -> Optional[List[Dict]]:
+        """
+        批量处理文本段落 - 三层优化策略
+        给出 on_result 时，每个段落一有结果就调用 on_result(段落下标, 结果)（快速修复、预过滤和缓存命中的立即回调，
+        API结果在所在批次完成时回调，顺序不固定），回调在调用线程中执行；此时结果不在内存中保留，返回None。
+        """
         print(f"开始三层优化处理 {len(segments)} 个段落...")
+        results = None
+        if on_result is None:
+            results = [None] * len(segments)
+            on_result = results.__setitem__
+        counts = {'corrected': 0, 'api': 0}
         
-        results = []
-        api_batch_texts = []
+        def emit(i: int, result: Dict):
+            counts['corrected'] += bool(result.get('has_errors', False))
+            counts['api'] += result.get('method') == 'batch_api'
+            on_result(i, result)
+        
+        # 第一轮：快速修复和预过滤
+        _, api_batch_indices = self._triage_segments(segments, emit)
+        
+        # 第二轮：批量API处理（先查缓存，相同文本只请求一次）
+        if api_batch_indices:
+            print(f"  需要API处理: {len(api_batch_indices)} 个段落")
+            api_batch_texts = [segments[i].get('text', '').strip() for i in api_batch_indices]
+            
+            # 填充API处理结果
+            def fill(pos: int, api_result: Dict):
+                original_idx = api_batch_indices[pos]
+                emit(original_idx, self._merge_segment_result(segments[original_idx], api_result))
+            
+            self._cached_batch_api_process(api_batch_texts, fill)
+        
+        print(f"批量处理完成！总修正: {counts['corrected']}, API修正: {counts['api']}")
+        return results
+    
+    def _triage_segments(self, segments: List[Dict], on_result: Callable[[int, Dict], None] = None) -> tuple:
+        """
+        快速修复和预过滤；返回 (结果列表, 需要API处理的段落下标)，需要API的位置为None占位
+        给出 on_result 时本地处理的结果直接回调 on_result(段落下标, 结果)，不构建结果列表（返回None）
+        """
+        results = [] if on_result is None else None
         api_batch_indices = []
         
         # 统计计数器
         quick_fix_count = 0
         pre_filter_count = 0
         
-        # 第一轮：快速修复和预过滤
+        def add(i: int, result: Optional[Dict]):
+            if results is not None:
+                results.append(result)
+            elif result is not None:
+                on_result(i, result)
+        
         for i, segment in enumerate(segments):
             text = segment.get('text', '').strip()
             
             if not text:
-                result = segment.copy()
-                result.update(self._create_result(text, text, False, [], 'empty'))
-                results.append(result)
+                add(i, self._merge_segment_result(segment, self._create_result(text, text, False, [], 'empty')))
                 continue
             
             # 快速修复检查
             quick_corrected, quick_errors = self._apply_quick_fixes(text)
             if quick_errors:
-                result = segment.copy()
-                result.update(self._create_result(text, quick_corrected, True, quick_errors, 'quick_fix'))
-                results.append(result)
+                add(i, self._merge_segment_result(
+                    segment, self._create_result(text, quick_corrected, True, quick_errors, 'quick_fix')))
                 quick_fix_count += 1
                 continue
             
             # 预过滤检查
             if not self._needs_api_processing(text):
-                result = segment.copy()
-                result.update(self._create_result(text, text, False, [], 'pre_filter'))
-                results.append(result)
+                add(i, self._merge_segment_result(
+                    segment, self._create_result(text, text, False, [], 'pre_filter')))
                 pre_filter_count += 1
                 continue
             
             # 需要API处理的文本
-            api_batch_texts.append(text)
             api_batch_indices.append(i)
-            results.append(None)  # 占位符
+            add(i, None)  # 占位符
         
         print(f"  快速修正: {quick_fix_count}, 预过滤跳过: {pre_filter_count}")
-        
-        # 第二轮：批量API处理
-        if api_batch_texts:
-            print(f"  需要API处理: {len(api_batch_texts)} 个段落")
-            api_results = self._batch_api_process(api_batch_texts)
-            
-            # 填充API处理结果
-            for idx, (original_idx, api_result) in enumerate(zip(api_batch_indices, api_results)):
-                segment = segments[original_idx]
-                result = segment.copy()
-                result.update(api_result)
-                results[original_idx] = result
-        
-        # 统计最终结果
-        total_corrections = sum(1 for r in results if r and r.get('has_errors', False))
-        api_corrections = sum(1 for r in results if r and r.get('method') == 'batch_api')
-        
-        print(f"批量处理完成！总修正: {total_corrections}, API修正: {api_corrections}")
-        
+        return results, api_batch_indices
+    
+    @staticmethod
+    def _merge_segment_result(segment: Dict, result: Dict) -> Dict:
+        merged = segment.copy()
+        merged.update(result)
+        return merged
+    
+    def correct_segment_groups(self, groups: List[List[Dict]], on_group_done: Callable[[int, List[Dict]], None]):
+        """
+        跨文件全局批处理：多组段落（通常每组是一个文件）先各自做快速修复和预过滤，
+        需要API的段落汇总到一个全局队列，查缓存、去重后跨组按token预算装满批次并发请求。
+        某一组的所有段落都有结果后立即调用 on_group_done(组下标, 结果列表)，回调在调用线程中执行。
+        """
+        group_results = []
+        owners = []  # 全局队列中每个段落所属的 (组下标, 段落下标)
+        texts = []
+        for g, segments in enumerate(groups):
+            print(f"[{g + 1}/{len(groups)}] ", end='')
+            results, api_indices = self._triage_segments(segments)
+            group_results.append(results)
+            for i in api_indices:
+                owners.append((g, i))
+                texts.append(segments[i].get('text', '').strip())
+        
+        keys, cached, pending = self._lookup_cache(texts)
+        remaining = [0] * len(groups)
+        waiting = {}
+        for pos, (key, text) in enumerate(zip(keys, texts)):
+            g, i = owners[pos]
+            if key in cached:
+                group_results[g][i] = self._merge_segment_result(groups[g][i], self._result_from_cache(text, cached[key]))
+            else:
+                waiting.setdefault(key, []).append(pos)
+                remaining[g] += 1
+        print(f"全局队列: {len(texts)} 个段落，缓存命中 {len(texts) - sum(remaining)}，需要请求 {len(pending)} 个不同段落")
+        
+        for g in range(len(groups)):
+            if remaining[g] == 0:
+                on_group_done(g, group_results[g])
+        
+        pending_keys = list(pending.keys())
+        for indices, batch_results in self._iter_batch_results(list(pending.values())):
+            fresh = {pending_keys[i]: result for i, result in zip(indices, batch_results)}
+            self._store_fresh(fresh)
+            for key, result in fresh.items():
+                for pos in waiting[key]:
+                    g, i = owners[pos]
+                    group_results[g][i] = self._merge_segment_result(
+                        groups[g][i], self._result_for_duplicate(texts[pos], result))
+                    remaining[g] -= 1
+                    if remaining[g] == 0:
+                        on_group_done(g, group_results[g])
+    
+    def _lookup_cache(self, texts: List[str]) -> tuple:
+        """返回 (缓存键列表, 命中的 {键: 结果}, 未命中且去重后的 {键: 文本})"""
+        keys = [CorrectionCache.make_key(text, self.model, self.prompt_version) for text in texts]
+        cached = self.cache.get_many(keys) if self.cache is not None else {}
+        
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in pending:
+                pending[key] = text
+        return keys, cached, pending
+    
+    def _store_fresh(self, fresh: Dict[str, Dict]):
+        """把成功的API结果写回缓存（失败的和回复中缺失的不缓存，下次重试）"""
+        if self.cache is not None:
+            self.cache.put_many({
+                key: result for key, result in fresh.items()
+                if result['method'] in ('batch_api', 'batch_api_no_change')
+            })
+    
+    def _result_for_duplicate(self, text: str, result: Dict) -> Dict:
+        """同一次请求的结果用于规范化后相同但原文不同的重复段落"""
+        if result['original_text'] == text:
+            return dict(result)
+        duplicate = self._result_from_cache(text, result)
+        duplicate['method'] = result['method']
+        return duplicate
+    
+    def _cached_batch_api_process(self, texts: List[str],
+                                  on_result: Callable[[int, Dict], None] = None) -> Optional[List[Dict]]:
+        """
+        查询纠错缓存，只把未命中的文本（去重后）交给API，成功的结果写回缓存
+        给出 on_result 时，缓存命中的立即回调，其余在所在批次完成时回调 on_result(文本下标, 结果)，返回None；
+        否则返回结果列表
+        """
+        keys, cached, pending = self._lookup_cache(texts)
+        if cached:
+            print(f"  缓存命中: {sum(1 for key in keys if key in cached)}, 需要请求: {len(pending)} 个不同段落")
+        
+        results = None
+        if on_result is None:
+            results = [None] * len(texts)
+            on_result = results.__setitem__
+        waiting = {}
+        for pos, (key, text) in enumerate(zip(keys, texts)):
+            if key in cached:
+                on_result(pos, self._result_from_cache(text, cached[key]))
+            else:
+                waiting.setdefault(key, []).append(pos)
+        
+        pending_keys = list(pending.keys())
+        for indices, batch_results in self._iter_batch_results(list(pending.values())):
+            fresh = {pending_keys[i]: result for i, result in zip(indices, batch_results)}
+            self._store_fresh(fresh)
+            for key, result in fresh.items():
+                for pos in waiting[key]:
+                    on_result(pos, self._result_for_duplicate(texts[pos], result))
         return results
     
-    def _batch_api_process(self, texts: List[str]) -> List[Dict]:
-        """批量API处理 - 使用结构化响应减少token消耗"""
-        results = []
-        
-        # 分批处理以控制token消耗
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i:i + self.batch_size]
-            print(f"    处理批次 {i//self.batch_size + 1}, 段落数: {len(batch)}")
+    def _result_from_cache(self, text: str, cached: Dict) -> Dict:
+        """用缓存的修正结果生成当前段落的结果，方法标记为 cache_hit"""
+        corrected = cached.get('corrected_text', text) if cached.get('has_errors') else text
+        errors = [dict(error, original=text) if error.get('original') == cached.get('original_text') else error
+                  for error in cached.get('errors', [])]
+        return self._create_result(text, corrected, bool(cached.get('has_errors')), errors, 'cache_hit')
+    
+    def _iter_batch_results(self, texts: List[str]):
+        """按token预算打包并发请求，每完成一个批次产出 (批次内文本的下标列表, 结果列表)"""
+        if not texts:
+            return
+        batches = self.packer.pack(texts)
+        workers = max(1, min(self.max_inflight_batches, len(batches)))
+        efficiency = TokenBudgetPacker.efficiency(batches, self.packer.request_budget)
+        print(f"    共 {len(batches)} 个批次，平均每批 {len(texts)/len(batches):.1f} 段，"
+              f"token装填率 {efficiency*100:.1f}%，同时在途 {workers} 个")
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self._process_batch, number, packed, texts): packed
+                for number, packed in enumerate(batches, 1)
+            }
+            for future in as_completed(futures):
+                yield futures[future].indices, future.result()
+                print(f"    {self.metrics.progress_line()}")
+        
+        if self.backoff.rate_limited_count:
+            print(f"    触发限流 {self.backoff.rate_limited_count} 次，当前退避间隔 {self.backoff.delay:.1f}秒")
+    
+    def _process_batch(self, batch_number: int, packed: PackedBatch, texts: List[str],
+                       retry_missing: bool = True) -> List[Dict]:
+        """处理单个批次；失败时返回原文。回复中缺少的段落（截断或格式错误）重新请求一次"""
+        batch = [texts[i] for i in packed.indices]
+        print(f"    处理批次 {batch_number}, 段落数: {len(batch)}, max_tokens: {packed.max_tokens}")
+        try:
+            batch_prompt = self._create_structured_batch_prompt(batch)
+            api_response = self._make_api_call(batch_prompt, max_tokens=packed.max_tokens, segments=len(batch))
             
-            try:
-                batch_prompt = self._create_structured_batch_prompt(batch)
-                api_response = self._make_api_call(batch_prompt, max_tokens=self.max_tokens_per_request)
+            if api_response:
+                results = self._parse_structured_response(api_response, batch)
+                missing = [i for i, result in enumerate(results) if result['method'] == 'batch_api_missing']
+                if missing and retry_missing:
+                    print(f"    批次 {batch_number} 的回复缺少 {len(missing)} 个段落，重新请求")
+                    missing_texts = [batch[i] for i in missing]
+                    for retry_packed in self.packer.pack(missing_texts):
+                        retried = self._process_batch(batch_number, retry_packed, missing_texts, retry_missing=False)
+                        for j, result in zip(retry_packed.indices, retried):
+                            results[missing[j]] = result
+                return results
+            # API失败，使用原文
+            return [self._create_result(text, text, False, [], 'api_failed') for text in batch]
                 
-                if api_response:
-                    batch_results = self._parse_structured_response(api_response, batch)
-                    results.extend(batch_results)
-                else:
-                    # API失败，使用原文
-                    for text in batch:
-                        results.append(self._create_result(text, text, False, [], 'api_failed'))
-                        
-            except Exception as e:
-                print(f"    批次处理失败: {e}")
-                for text in batch:
-                    results.append(self._create_result(text, text, False, [], 'api_error'))
-            
-            time.sleep(0.2)  # 避免过快请求
-        
-        return results
+        except Exception as e:
+            print(f"    批次处理失败: {e}")
+            return [self._create_result(text, text, False, [], 'api_error') for text in batch]
     
     def _create_structured_batch_prompt(self, texts: List[str]) -> str:
         """创建结构化批量提示 - 严格指定输出格式"""
@@ -407,7 +664,11 @@ class GLMClient:
         
         # 生成结果
         for i, original_text in enumerate(original_texts, 1):
-            corrected_text = corrected_map.get(i, original_text)
+            if i not in corrected_map:
+                # 回复中没有这一行（输出被截断或格式错误），不能当作"无需修正"，不缓存，下次重试
+                results.append(self._create_result(original_text, original_text, False, [], 'batch_api_missing'))
+                continue
+            corrected_text = corrected_map[i]
             
             # 验证修正文本的有效性
             if corrected_text and corrected_text != original_text:
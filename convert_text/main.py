@@ -5,6 +5,7 @@ import glob
 import time
 import random
 from pathlib import Path
+from api_metrics import format_summary_lines
 from error_detector import ErrorDetector
 from config import Config
 
@@ -122,7 +123,56 @@ def process_single_file(detector: ErrorDetector, file_path: str, args) -> dict:
             'error': str(e)
         }
 
-def generate_batch_summary(results: list, output_dir: str) -> str:
+def process_files_globally(detector: ErrorDetector, files: list, args) -> list:
+    """
+    全局批处理模式：先解析所有文件，所有需要API的段落进入同一个队列，跨文件装满批次并发请求；
+    某个文件的段落全部完成后立即写出它的报告和修正文件。返回值格式与 process_single_file 相同。
+    """
+    last_done = [time.time()]  # 各文件的耗时记为与上一个完成的文件之间的间隔，总和即总耗时
+    results = [None] * len(files)
+    parsed = []  # (文件下标, 有效段落, 修正清单, 已复用的结果, 需要处理的段落下标)
+    
+    for idx, file_path in enumerate(files):
+        try:
+            segments = detector.load_valid_segments(file_path)
+            manifest = detector.open_manifest(file_path)
+            reused, changed = detector.split_segments(segments, manifest)
+            parsed.append((idx, segments, manifest, reused, changed))
+        except Exception as e:
+            results[idx] = {
+                'file': file_path, 'status': 'error', 'report_path': None,
+                'corrected_path': None, 'processing_time': 0, 'error': str(e)
+            }
+    
+    def on_file_done(group_idx: int, changed_results: list):
+        idx, segments, manifest, reused, changed = parsed[group_idx]
+        file_path = files[idx]
+        try:
+            segment_results = detector.merge_segment_results(segments, reused, changed, changed_results, manifest)
+            report_path, corrected_path = detector.write_outputs(segment_results, file_path, args.only_correct)
+            now = time.time()
+            results[idx] = {
+                'file': file_path,
+                'status': 'success',
+                'report_path': report_path,
+                'corrected_path': corrected_path,
+                'processing_time': now - last_done[0],
+                'error': None
+            }
+            last_done[0] = now
+            print(f"✅ {file_path} - 处理成功")
+        except Exception as e:
+            results[idx] = {
+                'file': file_path, 'status': 'error', 'report_path': None,
+                'corrected_path': None, 'processing_time': 0, 'error': str(e)
+            }
+    
+    detector.glm_client.correct_segment_groups(
+        [[segments[i] for i in changed] for _, segments, _, _, changed in parsed], on_file_done
+    )
+    return results
+
+def generate_batch_summary(results: list, output_dir: str, packing_stats: dict = None, api_stats: dict = None) -> str:
     """
     生成批量处理总结报告
     """
@@ -148,6 +198,20 @@ def generate_batch_summary(results: list, output_dir: str) -> str:
         f.write(f"总耗时: {total_time:.1f}秒\n")
         f.write(f"平均耗时: {total_time/total_files:.1f}秒/文件\n\n")
         
+        if packing_stats and packing_stats['batches']:
+            f.write("API批次打包:\n")
+            f.write(f"  批次数: {packing_stats['batches']}\n")
+            f.write(f"  API段落数: {packing_stats['segments']}\n")
+            f.write(f"  平均每批段落数: {packing_stats['avg_segments_per_batch']:.1f}\n")
+            f.write(f"  预估输入/输出token: {packing_stats['prompt_tokens']:,} / {packing_stats['completion_tokens']:,}\n")
+            f.write(f"  token装填率: {packing_stats['efficiency']*100:.1f}%\n\n")
+        
+        if api_stats and api_stats['requests']:
+            f.write("API遥测 (实测):\n")
+            for line in format_summary_lines(api_stats):
+                f.write(line + "\n")
+            f.write("\n")
+        
         f.write("=" * 70 + "\n")
         f.write("详细处理结果\n")
         f.write("=" * 70 + "\n\n")
@@ -191,16 +255,33 @@ def main():
     parser.add_argument('--api-mode', choices=['low', 'medium', 'high', 'maximum'], 
                        default='high', help='API使用模式 (默认: high)')
     
+    parser.add_argument('--quick-fix-dict', action='append', metavar='FILE',
+                       help='快速修复词典文件，可多次指定 (默认使用环境变量 QUICK_FIX_DICTS)')
+    
+    parser.add_argument('--inflight', type=int, metavar='N',
+                       help='每个文件同时在途的批量API请求数 (默认: Config.MAX_INFLIGHT_BATCHES)')
+    
+    parser.add_argument('--no-cache', action='store_true', help='不使用纠错结果缓存 (默认缓存于 CORRECTION_CACHE_PATH)')
+    
+    parser.add_argument('--no-incremental', action='store_true',
+                       help='忽略修正清单，重新处理文件中的所有段落')
+    parser.add_argument('--global-batching', action='store_true',
+                       help='全局批处理：所有文件的段落进入同一个API队列，跨文件装满批次 (多文件时推荐)')
+    
     args = parser.parse_args()
     
     try:
         # 初始化错误检测器
         api_key = args.api_key or Config.GLM_API_KEY
-        detector = ErrorDetector(api_key)
+        detector = ErrorDetector(
+            api_key, args.quick_fix_dict, '' if args.no_cache else None, incremental=not args.no_incremental
+        )
         
         # 配置高API使用模式
         print(f"\n🚀 配置API使用模式...")
         configure_high_api_usage(detector, args.api_mode)
+        if args.inflight:
+            detector.glm_client.max_inflight_batches = args.inflight
         
         # 测试连接
         if args.test_connection:
@@ -254,8 +335,16 @@ def main():
         
         results = []
         
+        # 全局批处理 (如果指定)：并发度由 --inflight 控制
+        if args.global_batching:
+            print(f"📄 全局批处理 {len(files)} 个文件，同时在途 {detector.glm_client.max_inflight_batches} 个批次...")
+            results = process_files_globally(detector, files, args)
+            for result in results:
+                if result['status'] != 'success':
+                    print(f"❌ {result['file']} - 处理失败: {result['error']}")
+        
         # 并行处理 (如果指定)
-        if args.parallel and args.parallel > 1:
+        elif args.parallel and args.parallel > 1:
             print(f"📄 使用 {args.parallel} 个线程并行处理...")
             from concurrent.futures import ThreadPoolExecutor, as_completed
             
@@ -311,9 +400,17 @@ def main():
         
         # 生成批量处理总结
         if len(files) > 1:
-            summary_path = generate_batch_summary(results, Config.OUTPUT_DIR)
+            summary_path = generate_batch_summary(results, Config.OUTPUT_DIR, detector.glm_client.packer.summary(),
+                                                  detector.glm_client.metrics.summary())
             print(f"\n📈 批量处理总结: {summary_path}")
         
+        # API遥测：导出逐请求数据，并累计到历史文件供成本预估使用
+        metrics = detector.glm_client.metrics
+        if metrics.requests:
+            metrics_json, metrics_csv = metrics.export(Config.OUTPUT_DIR)
+            metrics.update_history()
+            print(f"📈 API遥测: {metrics_json} / {metrics_csv}")
+        
         # 最终统计
         successful = len([r for r in results if r['status'] == 'success'])
         failed = len(results) - successful
@@ -331,6 +428,9 @@ def main():
         print(f"   处理失败: {failed}")
         print(f"   成功率: {successful/len(results)*100:.1f}%")
         print(f"   总耗时: {total_time:.1f}秒")
+        cache = detector.glm_client.cache
+        if cache is not None and (cache.hits or cache.misses):
+            print(f"   纠错缓存: 命中 {cache.hits}, 未命中 {cache.misses}")
         if successful > 0:
             print(f"   平均耗时: {total_time/successful:.1f}秒/文件")
         
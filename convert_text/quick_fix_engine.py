@@ -0,0 +1,158 @@
+import json
+import os
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+
+class QuickFixEngine:
+    """
+    快速修复规则的多模式匹配器（Aho-Corasick 自动机）
+
+    自动机在构造时编译一次，之后每段文本只需从左到右扫描一遍即可找出所有规则的命中，
+    耗时与文本长度成正比，与规则数量基本无关，可以放心加载上千条人名、术语规则。
+    重叠命中时采用最左最长匹配，替换互不重叠，且不会对替换结果再次匹配。
+    """
+
+    def __init__(self, rules: Dict[str, str] = None):
+        self.rules = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._length = [0]  # 以该状态结尾的规则长度，0 表示不是规则结尾
+        self._dict_link = [0]  # fail链上最近的规则结尾状态
+        if rules:
+            self.add_rules(rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add_rules(self, rules: Dict[str, str]):
+        """加入规则并重新编译自动机"""
+        for wrong, correct in rules.items():
+            if wrong and wrong != correct:
+                self.rules[wrong] = correct
+        self._build()
+
+    def _build(self):
+        goto, length = [{}], [0]
+        for wrong in self.rules:
+            state = 0
+            for char in wrong:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][char] = nxt
+                    goto.append({})
+                    length.append(0)
+                state = nxt
+            length[state] = len(wrong)
+
+        fail = [0] * len(goto)
+        dict_link = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in goto[state].items():
+                f = fail[state]
+                while f and char not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(char, 0) if state else 0
+                dict_link[nxt] = fail[nxt] if length[fail[nxt]] else dict_link[fail[nxt]]
+                queue.append(nxt)
+
+        self._goto, self._fail, self._length, self._dict_link = goto, fail, length, dict_link
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """返回 (起始位置, 结束位置, 命中的错误写法) 列表，按最左最长且互不重叠"""
+        if not self.rules:
+            return []
+        goto, fail, length, dict_link = self._goto, self._fail, self._length, self._dict_link
+
+        # 记录每个起始位置上最长的命中
+        longest_at = {}
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            s = state if length[state] else dict_link[state]
+            while s:
+                start = end - length[s]
+                if longest_at.get(start, 0) < length[s]:
+                    longest_at[start] = length[s]
+                s = dict_link[s]
+
+        matches = []
+        cursor = 0
+        for start in sorted(longest_at):
+            if start < cursor:
+                continue
+            end = start + longest_at[start]
+            matches.append((start, end, text[start:end]))
+            cursor = end
+        return matches
+
+    def apply(self, text: str) -> Tuple[str, List[Dict]]:
+        """一次扫描完成所有替换，返回 (修正后的文本, 每处命中的错误详情)"""
+        matches = self.find(text)
+        if not matches:
+            return text, []
+
+        pieces = []
+        errors = []
+        cursor = 0
+        for start, end, wrong in matches:
+            correct = self.rules[wrong]
+            pieces.append(text[cursor:start])
+            pieces.append(correct)
+            cursor = end
+            errors.append({
+                'type': '快速修正',
+                'original': wrong,
+                'corrected': correct,
+                'confidence': 0.95,
+                'start': start,
+                'end': end
+            })
+        pieces.append(text[cursor:])
+        return ''.join(pieces), errors
+
+
+def load_quick_fix_rules(path: str) -> Dict[str, str]:
+    """
+    从外部词典文件加载快速修复规则
+
+    支持 .json（{"错误写法": "正确写法"}）或纯文本：每行 "错误写法<Tab>正确写法"，
+    也可以用 "=>" 或 "," 分隔，# 开头的行为注释。
+    """
+    if path.lower().endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return {str(k): str(v) for k, v in data.items()}
+
+    rules = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            for sep in ('\t', '=>', ','):
+                if sep in line:
+                    wrong, correct = line.split(sep, 1)
+                    break
+            else:
+                raise ValueError(f"{path} 第{line_number}行格式错误: {line}")
+            wrong, correct = wrong.strip(), correct.strip()
+            if wrong:
+                rules[wrong] = correct
+    return rules
+
+
+def load_rule_files(paths: Iterable[str]) -> Dict[str, str]:
+    """按顺序加载多个词典文件，后加载的规则覆盖先加载的"""
+    rules = {}
+    for path in paths:
+        if path and os.path.exists(path):
+            rules.update(load_quick_fix_rules(path))
+        elif path:
+            print(f"⚠️  快速修复词典不存在: {path}")
+    return rules
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+增量修正和流式写出的离线测试（不调用API）
+
+验证修正清单只让新增或变化的段落重新处理、需要重试的结果（API失败、回复中缺失）不被复用，
+以及 CorrectionOutputWriter 乱序加入结果时仍按段落顺序写出、出错时不留下部分输出。
+GLMClient 的批量修正被替换为本地函数，记录每次送去修正的段落。
+可以直接运行，也可以用 pytest 运行。
+"""
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+# Config 要求设置API密钥；这里不会发出任何请求
+os.environ.setdefault('GLM_API_KEY', 'offline-test')
+
+from config import Config
+from correction_manifest import RETRY_METHODS
+from correction_writer import CorrectionOutputWriter
+from error_detector import ErrorDetector
+
+TIMESTAMP_RE = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+
+
+def make_segments(texts):
+    return [{'line_number': i + 1, 'timestamp': f"00:{i:02d}", 'speaker': f"发言人{i % 2 + 1}",
+             'text': text, 'original_line': f"发言人{i % 2 + 1} 00:{i:02d}"} for i, text in enumerate(texts)]
+
+
+def make_result(segment, method='batch_api'):
+    result = segment.copy()
+    corrected = segment['text'].replace('的', '得') if method == 'batch_api' else segment['text']
+    result.update({'original_text': segment['text'], 'corrected_text': corrected,
+                   'has_errors': corrected != segment['text'], 'confidence': 0.9, 'errors': [],
+                   'method': method})
+    return result
+
+
+class FakeBatchCorrection:
+    """代替 GLMClient.batch_detect_and_correct_segments：记录送来的段落，missing 中的文本按回复缺失处理"""
+
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.sent = []
+
+    def __call__(self, segments, on_result=None):
+        self.sent.append([segment['text'] for segment in segments])
+        results = [make_result(segment, 'batch_api_missing' if segment['text'] in self.missing else 'batch_api')
+                   for segment in segments]
+        if on_result is None:
+            return results
+        # 倒序回调，模拟批次乱序完成
+        for i in reversed(range(len(results))):
+            on_result(i, results[i])
+        return None
+
+
+def make_detector(output_dir, fake):
+    Config.OUTPUT_DIR = output_dir
+    Config.LOG_DIR = os.path.join(output_dir, 'logs')
+    detector = ErrorDetector(cache_path='')
+    detector.glm_client.batch_detect_and_correct_segments = fake
+    return detector
+
+
+def test_only_changed_segments_are_resent():
+    output_dir = tempfile.mkdtemp(prefix='incremental_')
+    try:
+        fake = FakeBatchCorrection()
+        detector = make_detector(output_dir, fake)
+        input_file = os.path.join(output_dir, 'chat-1.txt')
+        texts = ["我觉的可以", "好的", "在说一遍"]
+
+        first = detector.correct_segments(make_segments(texts), input_file)
+        assert fake.sent == [texts]
+        assert [r['text'] for r in first] == texts
+
+        second = detector.correct_segments(make_segments(texts), input_file)
+        assert len(fake.sent) == 1, "未变化的段落不应重新送去修正"
+        assert [r['corrected_text'] for r in second] == [r['corrected_text'] for r in first]
+
+        edited = ["我觉的可以", "好的的", "在说一遍"]
+        third = detector.correct_segments(make_segments(edited), input_file)
+        assert fake.sent[-1] == ["好的的"], f"只应重新修正改动的段落: {fake.sent[-1]}"
+        assert [r['text'] for r in third] == edited
+        assert third[1]['corrected_text'] == "好得得"
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def test_missing_results_are_retried():
+    assert 'batch_api_missing' in RETRY_METHODS
+    output_dir = tempfile.mkdtemp(prefix='incremental_')
+    try:
+        fake = FakeBatchCorrection(missing={"好的"})
+        detector = make_detector(output_dir, fake)
+        input_file = os.path.join(output_dir, 'chat-1.txt')
+        texts = ["我觉的可以", "好的", "在说一遍"]
+
+        first = detector.correct_segments(make_segments(texts), input_file)
+        assert first[1]['method'] == 'batch_api_missing'
+
+        fake.missing.clear()
+        second = detector.correct_segments(make_segments(texts), input_file)
+        assert fake.sent[-1] == ["好的"], f"回复中缺失的段落应在下次重新修正: {fake.sent[-1]}"
+        assert second[1]['method'] == 'batch_api'
+
+        detector.correct_segments(make_segments(texts), input_file)
+        assert len(fake.sent) == 2, "重试成功后应复用结果"
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def _write(output_dir, results, order):
+    writer = CorrectionOutputWriter('chat-1.txt', output_dir)
+    for i in order:
+        writer.add(i, results[i])
+    report_path, corrected_path = writer.close()
+    contents = []
+    for path in (corrected_path, report_path):
+        with open(path, 'r', encoding='utf-8') as f:
+            contents.append(TIMESTAMP_RE.sub('', f.read()))
+    return contents
+
+
+def test_writer_orders_out_of_order_results():
+    results = [make_result(segment) for segment in make_segments([f"第{i}段我觉的" for i in range(12)])]
+    in_order_dir = tempfile.mkdtemp(prefix='writer_')
+    shuffled_dir = tempfile.mkdtemp(prefix='writer_')
+    try:
+        expected = _write(in_order_dir, results, range(len(results)))
+        actual = _write(shuffled_dir, results, [5, 0, 11, 2, 1, 3, 4, 10, 9, 8, 7, 6])
+        assert actual == expected
+        corrected = expected[0]
+        positions = [corrected.index(f"第{i}段我觉得") for i in range(len(results))]
+        assert positions == sorted(positions)
+        assert sorted(os.listdir(shuffled_dir)) == sorted(os.listdir(in_order_dir))
+    finally:
+        shutil.rmtree(in_order_dir, ignore_errors=True)
+        shutil.rmtree(shuffled_dir, ignore_errors=True)
+
+
+def test_partial_outputs_are_removed_on_error():
+    output_dir = tempfile.mkdtemp(prefix='incremental_')
+    try:
+        writer = CorrectionOutputWriter('chat-1.txt', output_dir)
+        results = [make_result(segment) for segment in make_segments(["一", "二", "三"])]
+        writer.add(2, results[2])
+        writer.add(0, results[0])
+        writer.discard()
+        assert os.listdir(output_dir) == []
+
+        def failing(segments, on_result=None):
+            on_result(0, make_result(segments[0]))
+            raise RuntimeError("模拟处理中断")
+
+        detector = make_detector(output_dir, failing)
+        try:
+            detector.correct_and_write(make_segments(["一", "二"]), os.path.join(output_dir, 'chat-2.txt'))
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("correct_and_write 应该重新抛出异常")
+        leftovers = [name for name in os.listdir(output_dir) if name != 'logs']
+        assert leftovers == [], f"出错后不应留下部分输出: {leftovers}"
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def main():
+    tests = [
+        ("只重新修正变化的段落", test_only_changed_segments_are_resent),
+        ("回复缺失的段落下次重试", test_missing_results_are_retried),
+        ("乱序结果按段落顺序写出", test_writer_orders_out_of_order_results),
+        ("出错时删除部分输出", test_partial_outputs_are_removed_on_error),
+    ]
+    passed = 0
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            passed += 1
+            print(f"✅ {test_name}")
+        except AssertionError as e:
+            print(f"❌ {test_name}: {e or '断言失败'}")
+    print(f"\n📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
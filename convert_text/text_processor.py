@@ -1,51 +1,88 @@
 import re
-import jieba
-from typing import List, Dict
+from itertools import islice
+from typing import Dict, Iterator, List, Optional
+
+from transcript import SPEAKER_ID_LINE_RE, Transcript, iter_stripped_lines, load_transcript
+
+# 预编译的转录格式模式
+BRACKET_TIMESTAMP_RE = re.compile(r'\[\d{2}:\d{2}:\d{2}')
+HEADER_RE = re.compile(r'chat-\d+|\d{4}年|=+$|-+$|文件|转录|记录|$')
+
+# 传统单行格式
+RANGE_SPEAKER_RE = re.compile(r'\[(\d{2}:\d{2}:\d{2}-\d{2}:\d{2}:\d{2})\]\s*([^:]+):\s*(.+)')   # [00:01:23-00:01:45] 张三: 内容
+TIMESTAMP_TEXT_RE = re.compile(r'\[(\d{2}:\d{2}:\d{2})\]\s*(.+)')                             # [00:01:23] 内容
+SPEAKER_BRACKET_RE = re.compile(r'([^[]+)\[(\d{2}:\d{2}:\d{2})\]:\s*(.+)')                     # 张三 [00:01:23]: 内容
+SPEAKER_COLON_RE = re.compile(r'^(发言人\d+|[\u4e00-\u9fa5]{2,8})[:：]\s*(.+)')                  # 发言人1: 内容
+
+# 文本清理
+SENTENCE_SPLIT_RE = re.compile(r'[。！？\n]')
+WHITESPACE_RE = re.compile(r'\s+')
+FILLER_RE = re.compile(r'[嗯啊呃哎]{2,}')
+
+FORMAT_DETECT_LINES = 20
+
 
 class TextProcessor:
     def __init__(self):
-        # 初始化jieba分词
-        jieba.initialize()
+        # jieba 只在需要分词时才加载（见 jieba 属性）
+        self._jieba = None
+    
+    @property
+    def jieba(self):
+        """按需导入并初始化jieba分词"""
+        if self._jieba is None:
+            import jieba
+            jieba.initialize()
+            self._jieba = jieba
+        return self._jieba
     
     def parse_transcription_file(self, file_path: str) -> List[Dict]:
         """
         解析转录文件，自动识别格式并提取时间戳、发言人和文本
         """
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-        
-        # 检测文件格式
-        file_format = self._detect_format(content)
+        return list(self.iter_transcription_file(file_path))
+    
+    def iter_transcription_file(self, file_path: str) -> Iterator[Dict]:
+        """
+        流式解析转录文件：只读取开头若干行识别格式，然后单遍逐行产出段落。
+        "发言人X 时间戳" 格式通过 transcript.load_transcript 加载（列式模型，带二进制缓存，与 main 目录的
+        video.py、get_emo_sw.py 和分段音频分析共用）；
+        其他格式逐行解析，内存只与单个段落的大小有关
+        """
+        file_format = self._detect_format(line for _, line in islice(iter_stripped_lines(file_path), FORMAT_DETECT_LINES))
         print(f"🔍 检测到文件格式: {file_format}")
         
         if file_format == 'speaker_timestamp':
-            return self._parse_speaker_timestamp_format(content)
-        elif file_format == 'timestamp_speaker':
-            return self._parse_timestamp_speaker_format(content)
+            # 与 main 目录的脚本共用解析结果（带二进制缓存）
+            return self._iter_transcript_segments(load_transcript(file_path))
+        
+        lines = iter_stripped_lines(file_path)
+        if file_format == 'timestamp_speaker':
+            return self._parse_timestamp_speaker_format(lines)
         else:
-            return self._parse_mixed_format(content)
+            return self._parse_mixed_format(lines)
     
-    def _detect_format(self, content: str) -> str:
+    def _detect_format(self, lines) -> str:
         """
-        自动检测转录文件的格式
+        自动检测转录文件的格式（只检查前20行），lines 可以是全文字符串或已去除首尾空白的行
         """
-        lines = content.strip().split('\n')
+        if isinstance(lines, str):
+            lines = (line.strip() for line in lines.strip().split('\n')[:FORMAT_DETECT_LINES])
         
         # 统计不同格式的行数
         speaker_timestamp_count = 0
         timestamp_speaker_count = 0
         
-        for line in lines[:20]:  # 只检查前20行
-            line = line.strip()
+        for line in lines:
             if not line:
                 continue
                 
             # 检查 "发言人1 00:00" 格式
-            if re.match(r'^发言人\d+\s+\d{2}:\d{2}', line):
+            if SPEAKER_ID_LINE_RE.match(line):
                 speaker_timestamp_count += 1
             
             # 检查 "[00:01:23] 内容" 或 "[00:01:23-00:01:45] 发言人: 内容" 格式
-            if re.match(r'\[\d{2}:\d{2}:\d{2}', line):
+            if BRACKET_TIMESTAMP_RE.match(line):
                 timestamp_speaker_count += 1
         
         if speaker_timestamp_count > timestamp_speaker_count:
@@ -55,95 +92,45 @@ class TextProcessor:
         else:
             return 'mixed'
     
-    def _parse_speaker_timestamp_format(self, content: str) -> List[Dict]:
+    @staticmethod
+    def _content_lines(content):
+        if isinstance(content, str):
+            return ((i, line.strip()) for i, line in enumerate(content.strip().split('\n'), 1))
+        return content
+    
+    def _iter_transcript_segments(self, transcript: Transcript) -> Iterator[Dict]:
         """
-        解析 "发言人X 时间戳" 后跟内容的格式
+        "发言人X 时间戳" 后跟内容的格式：每条有内容的发言产出一个段落，多行内容以换行连接
         """
-        lines = content.strip().split('\n')
-        segments = []
-        i = 0
-        
-        while i < len(lines):
-            line = lines[i].strip()
-            
-            # 跳过空行和标题行
-            if not line or self._is_header_line(line):
-                i += 1
+        for i in range(len(transcript)):
+            text = transcript.segment_text(i)
+            if not text:
                 continue
-            
-            # 检查是否是说话人+时间戳行
-            pattern = r'^发言人(\d+)\s+(\d{2}:\d{2})'
-            match = re.match(pattern, line)
-            
-            if match:
-                speaker_id = match.group(1)
-                timestamp = match.group(2)
-                speaker = f"发言人{speaker_id}"
-                
-                # 收集该发言人的所有连续内容行
-                content_lines = []
-                j = i + 1
-                
-                while j < len(lines):
-                    next_line = lines[j].strip()
-                    
-                    # 如果是空行，跳过
-                    if not next_line:
-                        j += 1
-                        continue
-                    
-                    # 如果是下一个发言人，停止
-                    if re.match(r'^发言人\d+\s+\d{2}:\d{2}', next_line):
-                        break
-                    
-                    # 否则是内容行
-                    content_lines.append(next_line)
-                    j += 1
-                
-                # 合并所有内容行
-                if content_lines:
-                    full_text = '\n'.join(content_lines)
-                    segments.append({
-                        'line_number': i + 1,
-                        'timestamp': timestamp,
-                        'speaker': speaker,
-                        'text': full_text,
-                        'original_line': line
-                    })
-                
-                i = j  # 跳转到下一个发言人
-            else:
-                i += 1
-        
-        return segments
+            yield {
+                'line_number': transcript.line_numbers[i],
+                'timestamp': transcript.timestamp(i),
+                'speaker': transcript.speaker_label(i),
+                'text': text,
+                'original_line': transcript.speaker_line(i)
+            }
     
-    def _parse_timestamp_speaker_format(self, content: str) -> List[Dict]:
+    def _parse_timestamp_speaker_format(self, content) -> Iterator[Dict]:
         """
         解析传统的时间戳+发言人格式
         """
-        lines = content.strip().split('\n')
-        segments = []
-        
-        for line_num, line in enumerate(lines, 1):
-            line = line.strip()
+        for line_num, line in self._content_lines(content):
             if not line or self._is_header_line(line):
                 continue
             
             segment = self._parse_traditional_line(line, line_num)
             if segment:
-                segments.append(segment)
-        
-        return segments
+                yield segment
     
-    def _parse_mixed_format(self, content: str) -> List[Dict]:
+    def _parse_mixed_format(self, content) -> Iterator[Dict]:
         """
         解析混合格式或纯文本格式
         """
-        lines = content.strip().split('\n')
-        segments = []
-        
-        for line_num, line in enumerate(lines, 1):
-            line = line.strip()
+        for line_num, line in self._content_lines(content):
             if not line or self._is_header_line(line):
                 continue
             
@@ -160,17 +147,14 @@ class TextProcessor:
                     'original_line': line
                 }
             
-            segments.append(segment)
-        
-        return segments
+            yield segment
     
-    def _parse_traditional_line(self, line: str, line_num: int) -> Dict:
+    def _parse_traditional_line(self, line: str, line_num: int) -> Optional[Dict]:
         """
         解析传统格式的单行文本
         """
         # 格式1: [00:01:23-00:01:45] 张三: 这是一段对话内容
-        pattern1 = r'\[(\d{2}:\d{2}:\d{2}-\d{2}:\d{2}:\d{2})\]\s*([^:]+):\s*(.+)'
-        match1 = re.match(pattern1, line)
+        match1 = RANGE_SPEAKER_RE.match(line)
         if match1:
             return {
                 'line_number': line_num,
@@ -181,8 +165,7 @@ class TextProcessor:
             }
         
         # 格式2: [00:01:23] 这是一段对话内容
-        pattern2 = r'\[(\d{2}:\d{2}:\d{2})\]\s*(.+)'
-        match2 = re.match(pattern2, line)
+        match2 = TIMESTAMP_TEXT_RE.match(line)
         if match2:
             return {
                 'line_number': line_num,
@@ -193,8 +176,7 @@ class TextProcessor:
             }
         
         # 格式3: 张三 [00:01:23]: 这是一段对话内容
-        pattern3 = r'([^[]+)\[(\d{2}:\d{2}:\d{2})\]:\s*(.+)'
-        match3 = re.match(pattern3, line)
+        match3 = SPEAKER_BRACKET_RE.match(line)
         if match3:
             return {
                 'line_number': line_num,
@@ -205,8 +187,7 @@ class TextProcessor:
             }
         
         # 格式4: 发言人1: 内容
-        pattern4 = r'^(发言人\d+|[\u4e00-\u9fa5]{2,8})[:：]\s*(.+)'
-        match4 = re.match(pattern4, line)
+        match4 = SPEAKER_COLON_RE.match(line)
         if match4:
             return {
                 'line_number': line_num,
@@ -222,19 +203,7 @@ class TextProcessor:
         """
         判断是否是标题行或无关行
         """
-        header_patterns = [
-            r'^chat-\d+',
-            r'^\d{4}年',
-            r'^=+$',
-            r'^-+$',
-            r'^文件|^转录|^记录',
-            r'^$'
-        ]
-        
-        for pattern in header_patterns:
-            if re.match(pattern, line):
-                return True
-        return False
+        return HEADER_RE.match(line) is not None
     
     def segment_long_text(self, text: str, max_length: int = 200) -> List[str]:
         """
@@ -244,7 +213,7 @@ class TextProcessor:
             return [text]
         
         # 优先按句号分割
-        sentences = re.split(r'[。！？\n]', text)
+        sentences = SENTENCE_SPLIT_RE.split(text)
         segments = []
         current_segment = ""
         
@@ -280,12 +249,12 @@ class TextProcessor:
         清理文本，移除多余的空白和特殊字符
         """
         # 移除多余的空白
-        text = re.sub(r'\s+', ' ', text)
+        text = WHITESPACE_RE.sub(' ', text)
         
         # 移除行首行尾空白
         text = text.strip()
         
         # 移除一些常见的转录噪音
-        text = re.sub(r'[嗯啊呃哎]{2,}', '嗯', text)
+        text = FILLER_RE.sub('嗯', text)
         
         return text
\ No newline at end of file
@@ -0,0 +1,104 @@
+import math
+import re
+import threading
+from typing import Dict, List
+
+_CJK_RE = re.compile(r'[　-〿一-鿿＀-￯]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计token数：中日韩字符（含全角标点）按1个token计，其余字符按4个字符1个token计"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class PackedBatch:
+    """一次批量请求：包含的文本在原列表中的下标，以及估计的提示/输出token数"""
+
+    def __init__(self, indices: List[int], prompt_tokens: int, completion_tokens: int, max_tokens: int):
+        self.indices = indices
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.max_tokens = max_tokens
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class TokenBudgetPacker:
+    """
+    按token预算动态打包批量纠错请求
+
+    每段文本按 estimate_tokens 估计输入token，输出按输入的 completion_ratio 倍估计（"编号|文本" 原样返回）。
+    依次把文本装入当前批次，直到 提示+输出 超过 request_budget、输出超过 max_completion_tokens
+    或段落数达到 max_segments；每个请求的 max_tokens 按实际装入的内容设置，而不是固定值。
+    超过预算的单段文本单独成批。
+    """
+
+    LINE_OVERHEAD = 3  # "编号|" 和换行
+
+    def __init__(self, prompt_overhead: int, request_budget: int = 4000, max_completion_tokens: int = 2048,
+                 max_segments: int = 50, completion_ratio: float = 1.15, completion_margin: int = 64):
+        self.prompt_overhead = prompt_overhead
+        self.request_budget = request_budget
+        self.max_completion_tokens = max_completion_tokens
+        self.max_segments = max_segments
+        self.completion_ratio = completion_ratio
+        self.completion_margin = completion_margin
+
+        self._lock = threading.Lock()
+        self.stats = {'batches': 0, 'segments': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'budget_tokens': 0}
+
+    def _segment_cost(self, text: str) -> tuple:
+        prompt = estimate_tokens(text) + self.LINE_OVERHEAD
+        completion = math.ceil(prompt * self.completion_ratio)
+        return prompt, completion
+
+    def _max_tokens(self, completion: int) -> int:
+        return min(self.max_completion_tokens, completion + self.completion_margin)
+
+    def pack(self, texts: List[str]) -> List[PackedBatch]:
+        batches = []
+        indices, prompt, completion = [], self.prompt_overhead, 0
+
+        for i, text in enumerate(texts):
+            seg_prompt, seg_completion = self._segment_cost(text)
+            over_budget = (
+                prompt + seg_prompt + self._max_tokens(completion + seg_completion) > self.request_budget
+                or completion + seg_completion + self.completion_margin > self.max_completion_tokens
+                or len(indices) >= self.max_segments
+            )
+            if indices and over_budget:
+                batches.append(PackedBatch(indices, prompt, completion, self._max_tokens(completion)))
+                indices, prompt, completion = [], self.prompt_overhead, 0
+            indices.append(i)
+            prompt += seg_prompt
+            completion += seg_completion
+
+        if indices:
+            batches.append(PackedBatch(indices, prompt, completion, self._max_tokens(completion)))
+
+        with self._lock:
+            self.stats['batches'] += len(batches)
+            self.stats['segments'] += len(texts)
+            self.stats['prompt_tokens'] += sum(b.prompt_tokens for b in batches)
+            self.stats['completion_tokens'] += sum(b.completion_tokens for b in batches)
+            self.stats['budget_tokens'] += len(batches) * self.request_budget
+        return batches
+
+    @staticmethod
+    def efficiency(batches: List[PackedBatch], request_budget: int) -> float:
+        """装填率：估计使用的token数占 批次数×单次预算 的比例"""
+        if not batches:
+            return 0.0
+        used = sum(b.prompt_tokens + b.completion_tokens for b in batches)
+        return used / (len(batches) * request_budget)
+
+    def summary(self) -> Dict:
+        """累计的打包统计（跨多次 pack 调用）"""
+        with self._lock:
+            stats = dict(self.stats)
+        used = stats['prompt_tokens'] + stats['completion_tokens']
+        stats['efficiency'] = used / stats['budget_tokens'] if stats['budget_tokens'] else 0.0
+        stats['avg_segments_per_batch'] = stats['segments'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
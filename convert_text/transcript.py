@@ -0,0 +1,286 @@
+"""
+"说话人 时间戳" 格式转录文件的共享解析器和列式转录模型
+
+convert_text 的 TextProcessor、format_converter 以及 main 目录的 video.py、get_emo_sw.py、分段音频分析
+都通过 load_transcript 读取转录：第一次解析后在原文件旁写入二进制缓存（<文件名>.tsc），
+之后只要原文件的大小和修改时间不变，就直接加载缓存而不再解析文本。
+
+说话人行的两种写法：
+  - "发言人N 时间戳"：编号与时间之间的空白可有可无，编号按原样保留（包括前导0），行尾可以有其他内容
+  - 任意说话人标签 + 空白 + 时间戳结尾，例如 "张三 01:23"；只在文件中没有任何 "发言人N" 行时使用，
+    避免 "2024 年 03 月 05 日 14:30" 这类标题行或以时间结尾的内容行被当成说话人行
+时间戳为 mm:ss 或 hh:mm:ss（分钟/小时可以是一位数）。没有找到任何说话人行时打印警告。
+"""
+
+import os
+import re
+import struct
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_TIMESTAMP = r'(\d{1,2}:\d{2}(?::\d{2})?)'
+SPEAKER_ID_LINE_RE = re.compile(r'^发言人\s*(\d+)\s*' + _TIMESTAMP)
+SPEAKER_LABEL_LINE_RE = re.compile(r'^(\S.*?)\s+' + _TIMESTAMP + r'$')
+SPEAKER_ID_LABEL_RE = re.compile(r'^发言人\s*(\d+)$')
+
+SIDECAR_SUFFIX = '.tsc'
+_MAGIC = b'TSC2'
+# magic, 原文件大小, 原文件修改时间(ns), 段落数, 标题/标签表/内容/说话人行/时间戳的字节数
+_HEADER = struct.Struct('<4sqqi5q')
+
+
+def iter_stripped_lines(file_path: str) -> Iterator[Tuple[int, str]]:
+    """
+    逐行读取文件，产出 (行号, 去掉首尾空白的行)
+
+    行号从第一个非空行开始计为1（与对全文 strip() 后再按换行切分的结果一致），
+    内存占用与文件大小无关。
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        line_number = 0
+        for raw_line in file:
+            line = raw_line.strip()
+            if line_number == 0 and not line:
+                continue
+            line_number += 1
+            yield line_number, line
+
+
+def format_timestamp(seconds: int) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def timestamp_seconds(timestamp: str) -> int:
+    """mm:ss 或 hh:mm:ss -> 秒"""
+    seconds = 0
+    for part in timestamp.split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def match_speaker_line(line: str, allow_labels: bool = False) -> Optional[Tuple[str, str]]:
+    """说话人行返回 (说话人标签, 时间戳)，标签中的空白合并为一个空格；其他行返回None"""
+    match = SPEAKER_ID_LINE_RE.match(line)
+    if match:
+        return ' '.join(line[:match.start(2)].split()), match.group(2)
+    if allow_labels:
+        match = SPEAKER_LABEL_LINE_RE.match(line)
+        if match:
+            return ' '.join(match.group(1).split()), match.group(2)
+    return None
+
+
+class _StringColumn:
+    """变长字符串列：所有值拼接为一个字符串，第 i 个值为 text[offsets[i]:offsets[i + 1]]"""
+
+    def __init__(self, offsets: array = None, text: str = ''):
+        self.offsets = offsets if offsets is not None else array('q', [0])
+        self.text = text
+        self._pieces = []
+
+    def append(self, value: str):
+        self._pieces.append(value)
+        self.offsets.append(self.offsets[-1] + len(value))
+
+    def finish(self) -> '_StringColumn':
+        if self._pieces:
+            self.text += ''.join(self._pieces)
+            self._pieces = []
+        return self
+
+    def __getitem__(self, i: int) -> str:
+        return self.text[self.offsets[i]:self.offsets[i + 1]]
+
+
+class Transcript:
+    """
+    列式转录模型：每条发言占一行列数据
+
+    speakers: 说话人标签在 labels（去重后的标签表）中的下标；starts: 时间戳（秒）；
+    line_numbers: 说话人行的行号；speaker_lines / timestamps: 说话人行原文和其中的时间戳原文；
+    所有发言内容拼接在 text 中，第 i 条发言的内容为 text[offsets[i]:offsets[i + 1]]，
+    多行内容以换行分隔（保留原始行，过滤规则由调用方决定）；没有内容的发言人行也会保留。
+    header 为第一条发言之前的非空行（标题、日期等）。
+    """
+
+    def __init__(self, labels: List[str], speakers: array, starts: array, line_numbers: array,
+                 contents: _StringColumn, speaker_lines: _StringColumn, timestamps: _StringColumn,
+                 header: List[str]):
+        self.labels = labels
+        self.speakers = speakers
+        self.starts = starts
+        self.line_numbers = line_numbers
+        self._contents = contents
+        self._speaker_lines = speaker_lines
+        self._timestamps = timestamps
+        self.header = header
+
+    @property
+    def offsets(self) -> array:
+        return self._contents.offsets
+
+    @property
+    def text(self) -> str:
+        return self._contents.text
+
+    def __len__(self):
+        return len(self.speakers)
+
+    def segment_text(self, i: int) -> str:
+        return self._contents[i]
+
+    def segment_lines(self, i: int) -> List[str]:
+        text = self.segment_text(i)
+        return text.split('\n') if text else []
+
+    def speaker_label(self, i: int) -> str:
+        """说话人标签（与原文一致，例如 发言人01、张三）"""
+        return self.labels[self.speakers[i]]
+
+    def speaker_id(self, i: int) -> Optional[str]:
+        """"发言人N" 的编号原文（保留前导0），其他写法的说话人为None"""
+        match = SPEAKER_ID_LABEL_RE.match(self.speaker_label(i))
+        return match.group(1) if match else None
+
+    def timestamp(self, i: int) -> str:
+        """说话人行中的时间戳原文"""
+        return self._timestamps[i]
+
+    def speaker_line(self, i: int) -> str:
+        """说话人行原文（去掉首尾空白）"""
+        return self._speaker_lines[i]
+
+    def speaker_timestamps(self) -> Dict[str, List[str]]:
+        """{说话人: [时间戳, ...]}，按出现顺序"""
+        result = {}
+        for i in range(len(self)):
+            result.setdefault(self.speaker_label(i), []).append(self.timestamp(i))
+        return result
+
+    @classmethod
+    def parse(cls, file_path: str) -> 'Transcript':
+        """解析转录文件；没有 "发言人N" 行时再按任意 "标签 时间戳" 行解析一遍"""
+        transcript = cls._parse(file_path, allow_labels=False)
+        if not len(transcript):
+            transcript = cls._parse(file_path, allow_labels=True)
+        return transcript
+
+    @classmethod
+    def _parse(cls, file_path: str, allow_labels: bool) -> 'Transcript':
+        labels, label_index = [], {}
+        speakers, starts, line_numbers = array('i'), array('i'), array('i')
+        contents, speaker_lines, timestamps = _StringColumn(), _StringColumn(), _StringColumn()
+        header = []
+        current_lines = None
+
+        for line_number, line in iter_stripped_lines(file_path):
+            if not line:
+                continue
+            speaker_line = match_speaker_line(line, allow_labels)
+            if speaker_line is not None:
+                if current_lines is not None:
+                    contents.append('\n'.join(current_lines))
+                label, timestamp = speaker_line
+                if label not in label_index:
+                    label_index[label] = len(labels)
+                    labels.append(label)
+                speakers.append(label_index[label])
+                starts.append(timestamp_seconds(timestamp))
+                line_numbers.append(line_number)
+                speaker_lines.append(line)
+                timestamps.append(timestamp)
+                current_lines = []
+            elif current_lines is not None:
+                current_lines.append(line)
+            else:
+                header.append(line)
+        if current_lines is not None:
+            contents.append('\n'.join(current_lines))
+
+        return cls(labels, speakers, starts, line_numbers, contents.finish(), speaker_lines.finish(),
+                   timestamps.finish(), header)
+
+    def to_bytes(self, source_size: int, source_mtime_ns: int) -> bytes:
+        strings = ['\n'.join(self.header), '\n'.join(self.labels), self.text,
+                   self._speaker_lines.text, self._timestamps.text]
+        encoded = [s.encode('utf-8') for s in strings]
+        parts = [
+            _HEADER.pack(_MAGIC, source_size, source_mtime_ns, len(self), *(len(b) for b in encoded)),
+            self.speakers.tobytes(),
+            self.starts.tobytes(),
+            self.line_numbers.tobytes(),
+            self.offsets.tobytes(),
+            self._speaker_lines.offsets.tobytes(),
+            self._timestamps.offsets.tobytes(),
+        ]
+        return b''.join(parts + encoded)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, source_size: int, source_mtime_ns: int) -> Optional['Transcript']:
+        """解析缓存内容；格式或原文件信息不匹配时返回None"""
+        if len(data) < _HEADER.size:
+            return None
+        magic, size, mtime_ns, count, *lengths = _HEADER.unpack_from(data)
+        if magic != _MAGIC or size != source_size or mtime_ns != source_mtime_ns:
+            return None
+
+        pos = _HEADER.size
+        columns = []
+        for typecode, n in (('i', count), ('i', count), ('i', count), ('q', count + 1), ('q', count + 1),
+                            ('q', count + 1)):
+            column = array(typecode)
+            nbytes = column.itemsize * n
+            column.frombytes(data[pos:pos + nbytes])
+            pos += nbytes
+            columns.append(column)
+        strings = []
+        for length in lengths:
+            strings.append(data[pos:pos + length].decode('utf-8'))
+            pos += length
+        if pos != len(data):
+            return None
+
+        speakers, starts, line_numbers, offsets, line_offsets, timestamp_offsets = columns
+        header_text, labels_text, text, lines_text, timestamps_text = strings
+        return cls(labels_text.split('\n') if labels_text else [], speakers, starts, line_numbers,
+                   _StringColumn(offsets, text), _StringColumn(line_offsets, lines_text),
+                   _StringColumn(timestamp_offsets, timestamps_text),
+                   header_text.split('\n') if header_text else [])
+
+
+def sidecar_path(file_path: str) -> str:
+    return file_path + SIDECAR_SUFFIX
+
+
+def load_transcript(file_path: str, use_cache: bool = True) -> Transcript:
+    """
+    加载转录：优先读取有效的二进制缓存，否则解析文本并写入缓存（目录不可写时忽略）
+    没有任何说话人行时打印警告
+    """
+    stat = os.stat(file_path)
+    cache_path = sidecar_path(file_path)
+
+    transcript = None
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                transcript = Transcript.from_bytes(f.read(), stat.st_size, stat.st_mtime_ns)
+        except (OSError, ValueError, struct.error):
+            transcript = None
+
+    if transcript is None:
+        transcript = Transcript.parse(file_path)
+        if use_cache:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(transcript.to_bytes(stat.st_size, stat.st_mtime_ns))
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    if not len(transcript):
+        print(f"⚠️  {file_path} 中没有找到 \"说话人 时间戳\" 格式的行，转录格式可能不受支持")
+    return transcript
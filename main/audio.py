@@ -3,8 +3,6 @@ import torch
 import os
 import json
 from typing import Dict, List, Optional
-import re
-import librosa
 import numpy as np
 from io import BytesIO
 import glob
@@ -12,63 +10,15 @@ from tqdm import tqdm
 from datetime import datetime
 import argparse
 import traceback
+import threading
+import time
+from audio_decode import AudioPrefetcher, load_audio
+from audio_chunks import (MAX_CHUNK_SECONDS, chunk_note, duration_batches, load_turns, merge_chunk_results,
+                          plan_chunks)
+from audio_parser import parse_analysis, parse_json_analysis, response_template
 
-class AudioAnalyzer:
-    """音频分析器类"""
-    
-    def __init__(self, model_dir: Optional[str] = None, cache_dir: str = '/autodl-tmp/models'):
-        """
-        初始化音频分析器
-        
-        Args:
-            model_dir: 模型目录路径，如果为None则自动下载
-            cache_dir: 模型缓存目录
-        """
-        self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
-
-        # 下载或加载模型
-        if model_dir is None:
-            model_dir = snapshot_download('Qwen/Qwen2-Audio-7B-Instruct', cache_dir=cache_dir)
-        
-        self.processor = AutoProcessor.from_pretrained(
-            model_dir,
-            trust_remote_code=True
-        )
-        
-        self.model = Qwen2AudioForConditionalGeneration.from_pretrained(
-            model_dir,
-            device_map="auto",
-            trust_remote_code=True,
-            dtype=torch.bfloat16 if torch.cuda.is_available() else torch.float32,
-            low_cpu_mem_usage=True
-        ).eval()
-    
-    def analyze_full_audio(self, audio_path: str) -> Dict:
-        """
-        分析单个音频文件，返回按说话人区分的分析结果
-        
-        Args:
-            audio_path: 音频文件路径
-            
-        Returns:
-            包含分析结果的字典
-        """
-        if not os.path.exists(audio_path):
-            return {"error": f"音频文件 {audio_path} 不存在"}
-        
-        try:
-            # 加载音频文件
-            print(f"正在加载音频文件: {os.path.basename(audio_path)}...")
-            audio_data, sample_rate = librosa.load(
-                audio_path, 
-                sr=self.processor.feature_extractor.sampling_rate
-            )
-            
-            # 检查音频长度
-            duration = len(audio_data) / sample_rate
-            
-            # 构建详细的分析提示词
-            prompt_text = """请对这段音频进行全面深入的分析，要求如下：
+# 分析任务（整段分析和分段分析共用，两种输出格式共用）
+ANALYSIS_TASKS = """请对这段音频进行全面深入的分析，要求如下：
 
 特别注意的是，如果你不能理解我传递给你的音频，请说"无法理解音频内容"，而不是编造内容。
 
@@ -108,7 +58,9 @@ class AudioAnalyzer:
    - 说话人之间的互动模式
    - 话轮转换特点
 
-## 输出格式要求：
+"""
+# 文本格式的输出要求（默认）
+ANALYSIS_PROMPT = ANALYSIS_TASKS + """## 输出格式要求：
 请按以下结构化格式输出：
 
 【音频概览】
@@ -133,74 +85,420 @@ class AudioAnalyzer:
 - 互动特点：
 
 请确保分析详尽且按说话人清晰区分。请帮我分析这段音频。"""
+# JSON格式的输出要求（--output_format json），回复按 audio_parser.RESPONSE_SCHEMA 校验
+ANALYSIS_JSON_PROMPT = ANALYSIS_TASKS + f"""## 输出格式要求：
+请只输出一个JSON对象，不要输出其他内容。每位说话人在 speakers 中占一项，id 依次为"说话人1"、"说话人2"等，所有值都用字符串：
+{response_template()}
 
-            conversation = [
-                {"role": "user", "content": [
-                    {"type": "audio", "audio_data": audio_data},  
-                    {"type": "text", "text": prompt_text}
-                ]}
-            ]
+请确保分析详尽且按说话人清晰区分。请帮我分析这段音频。"""
+# JSON格式时在助手回复开头预填充的内容，引导模型直接输出JSON
+JSON_RESPONSE_PREFILL = "{"
+# 前缀缓存模式下放在音频之后的指令（分析要求整体放在音频之前，作为可复用的前缀）
+CLIP_INSTRUCTION = "请按上述要求分析这段音频。"
+
+
+class GPUMonitor:
+    """
+    后台线程定期采样GPU利用率（torch.cuda.utilization，需要pynvml）并记录显存峰值
+    没有GPU或没有pynvml时对应的统计为None
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read_utilization(self) -> Optional[float]:
+        try:
+            return float(torch.cuda.utilization())
+        except Exception:
+            return None
+
+    def start(self):
+        if not torch.cuda.is_available():
+            return
+        torch.cuda.reset_peak_memory_stats()
+        if self._read_utilization() is None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            value = self._read_utilization()
+            if value is not None:
+                self.samples.append(value)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def summary(self) -> Dict:
+        samples = list(self.samples)
+        return {
+            "gpu_util_mean": sum(samples) / len(samples) if samples else None,
+            "gpu_util_max": max(samples) if samples else None,
+            "peak_memory_gb": torch.cuda.max_memory_allocated() / 1024 ** 3 if torch.cuda.is_available() else None,
+        }
+
+    def status(self) -> str:
+        stats = self.summary()
+        parts = []
+        if stats["gpu_util_mean"] is not None:
+            parts.append(f"GPU利用率 {stats['gpu_util_mean']:.0f}%")
+        if stats["peak_memory_gb"] is not None:
+            parts.append(f"显存峰值 {stats['peak_memory_gb']:.1f}GB")
+        return ", ".join(parts) or "无GPU统计"
+
+
+class AudioAnalyzer:
+    """音频分析器类"""
+    
+    def __init__(self, model_dir: Optional[str] = None, cache_dir: str = '/autodl-tmp/models',
+                 decode_cache_dir: Optional[str] = './.cache/audio', decode_workers: int = 2, prefetch: int = 2,
+                 output_format: str = 'text'):
+        """
+        初始化音频分析器
+        
+        Args:
+            model_dir: 模型目录路径，如果为None则自动下载
+            cache_dir: 模型缓存目录
+            decode_cache_dir: 解码后波形（.npy）的缓存目录，为None或空时不缓存
+            decode_workers: 后台解码进程数
+            prefetch: 批量分析时提前解码的文件数
+            output_format: 模型回复格式，text（【章节】结构化文本）或 json（按schema输出JSON）
+        """
+        self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        self.decode_cache_dir = decode_cache_dir or None
+        self.decode_workers = decode_workers
+        self.prefetch = prefetch
+        if output_format not in ('text', 'json'):
+            raise ValueError(f"不支持的输出格式: {output_format}")
+        self.output_format = output_format
+        self.analysis_prompt = ANALYSIS_JSON_PROMPT if output_format == 'json' else ANALYSIS_PROMPT
+        # 提示词前缀KV缓存（见 _generate_with_prefix_cache），由 enable_prefix_cache 开启
+        self.use_prefix_cache = False
+        self._prefix_cache = None
+        self._prefix_ids = None
+        self._prefix_cache_warned = False
+        self.prefix_build_seconds = 0.0
+
+        # 下载或加载模型
+        if model_dir is None:
+            model_dir = snapshot_download('Qwen/Qwen2-Audio-7B-Instruct', cache_dir=cache_dir)
+        
+        self.processor = AutoProcessor.from_pretrained(
+            model_dir,
+            trust_remote_code=True
+        )
+        
+        self.model = Qwen2AudioForConditionalGeneration.from_pretrained(
+            model_dir,
+            device_map="auto",
+            trust_remote_code=True,
+            dtype=torch.bfloat16 if torch.cuda.is_available() else torch.float32,
+            low_cpu_mem_usage=True
+        ).eval()
+        # 批量生成时左填充，所有样本的生成部分从同一位置开始
+        self.processor.tokenizer.padding_side = "left"
 
-            # 准备音频数据列表
-            audios = []
-            for message in conversation:
-                if isinstance(message["content"], list):
-                    for ele in message["content"]:
-                        if ele["type"] == "audio":
-                            audios.append(ele["audio_data"]) 
+    def enable_prefix_cache(self, enabled: bool = True):
+        """
+        开启后分析提示词放在音频之前，其KV状态每个进程只计算一次，单段生成时通过 past_key_values 复用
+        （批量生成时各样本的填充位置不同，只使用相同的提示词结构，不复用缓存）
+        """
+        self.use_prefix_cache = enabled
+        self._prefix_cache = None
+        self._prefix_ids = None
+    
+    def analyze_full_audio(self, audio_path: str, audio_data: Optional[np.ndarray] = None) -> Dict:
+        """
+        分析单个音频文件，返回按说话人区分的分析结果
+        
+        Args:
+            audio_path: 音频文件路径
+            audio_data: 已解码的波形（模型采样率），为None时在此解码
             
-            # 准备文本输入
-            text_input = self.processor.apply_chat_template(
-                conversation, 
-                add_generation_prompt=True, 
-                tokenize=False
-            )
+        Returns:
+            包含分析结果的字典
+        """
+        if not os.path.exists(audio_path):
+            return {"error": f"音频文件 {audio_path} 不存在"}
+        
+        try:
+            # 加载音频文件
+            sample_rate = self.processor.feature_extractor.sampling_rate
+            if audio_data is None:
+                print(f"正在加载音频文件: {os.path.basename(audio_path)}...")
+                audio_data, sample_rate = self._load_audio(audio_path)
             
-            inputs = self.processor(
-                text=text_input,
-                audio=audios, 
-                return_tensors="pt",
-                sampling_rate=sample_rate,
-                padding=True
-            )
+            # 检查音频长度
+            duration = len(audio_data) / sample_rate
+            
+            response = self._generate_response(audio_data, sample_rate, "", max_new_tokens=4096)
+            
+            # 解析响应为结构化数据
+            return self._full_result(audio_path, duration, sample_rate, response)
             
-            inputs = inputs.to("cuda")
+        except Exception as e:
+            traceback.print_exc()
+            return {
+                "error": f"处理音频时出错: {str(e)}",
+                "raw_response": "",
+                "audio_info": {"file_path": audio_path}
+            }
+
+    def _generate_response(self, audio_data: np.ndarray, sample_rate: int, note: str,
+                           max_new_tokens: int) -> str:
+        """对一段音频调用一次模型，返回解码后的回复；note 为附加在分析提示词上的片段说明（可为空）"""
+        if self.use_prefix_cache:
+            response = self._generate_with_prefix_cache(audio_data, sample_rate, note, max_new_tokens)
+            if response is not None:
+                return response
+        return self._generate_responses([audio_data], sample_rate, [note], max_new_tokens)[0]
+
+    def _build_conversation(self, audio_data: np.ndarray, note: str) -> List[Dict]:
+        """
+        默认：音频在前，片段说明和分析提示词在后（与原来一致）
+        前缀缓存模式：分析提示词在音频之前，构成所有片段相同的前缀；片段说明和简短指令放在音频之后
+        """
+        if self.use_prefix_cache:
+            clip_text = f"\n{note}\n{CLIP_INSTRUCTION}" if note else f"\n{CLIP_INSTRUCTION}"
+            content = [
+                {"type": "text", "text": self.analysis_prompt + "\n"},
+                {"type": "audio", "audio_data": audio_data},
+                {"type": "text", "text": clip_text}
+            ]
+        else:
+            prompt_text = f"{note}\n\n{self.analysis_prompt}" if note else self.analysis_prompt
+            content = [
+                {"type": "audio", "audio_data": audio_data},  
+                {"type": "text", "text": prompt_text}
+            ]
+        return [{"role": "user", "content": content}]
+
+    def _processor_inputs(self, audios: List[np.ndarray], sample_rate: int, notes: List[str]):
+        # 准备文本输入
+        text_inputs = [
+            self.processor.apply_chat_template(
+                self._build_conversation(audio_data, note), add_generation_prompt=True, tokenize=False
+            )
+            for audio_data, note in zip(audios, notes)
+        ]
+        if self.output_format == 'json':
+            text_inputs = [text + JSON_RESPONSE_PREFILL for text in text_inputs]
+        
+        inputs = self.processor(
+            text=text_inputs,
+            audio=list(audios), 
+            return_tensors="pt",
+            sampling_rate=sample_rate,
+            padding=True
+        )
+        return inputs.to(self.model.device)
+
+    def _generation_kwargs(self, max_new_tokens: int) -> Dict:
+        return dict(
+            max_new_tokens=max_new_tokens,
+            temperature=0.3,
+            top_p=0.9,
+            do_sample=True,
+            pad_token_id=self.processor.tokenizer.eos_token_id,
+            eos_token_id=self.processor.tokenizer.eos_token_id,
+            repetition_penalty=1.05
+        )
+
+    def _generate_responses(self, audios: List[np.ndarray], sample_rate: int, notes: List[str],
+                            max_new_tokens: int) -> List[str]:
+        """把多段音频（每段配一个片段说明）填充成一批一起生成，按样本分别解码"""
+        inputs = self._processor_inputs(audios, sample_rate, notes)
+
+        with torch.no_grad():
+            generated_ids = self.model.generate(**inputs, **self._generation_kwargs(max_new_tokens))
+        
+        # 解码生成的文本（左填充，输入部分长度相同）
+        generated_ids = [
+            output_ids[len(input_ids):]
+            for input_ids, output_ids in zip(inputs.input_ids, generated_ids)
+        ]
+        
+        return self.processor.batch_decode(
+            generated_ids, 
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=False
+        )
 
+    def _build_prefix_cache(self, prefix_ids):
+        """对静态前缀做一次预填充，保存其KV状态"""
+        from transformers import DynamicCache
+        start = time.time()
+        cache = DynamicCache()
+        with torch.no_grad():
+            self.model(input_ids=prefix_ids, attention_mask=torch.ones_like(prefix_ids),
+                       past_key_values=cache, use_cache=True)
+        self._prefix_ids = prefix_ids[0].clone()
+        self._prefix_cache = cache
+        self.prefix_build_seconds = time.time() - start
+        print(f"已缓存提示词前缀的KV状态: {prefix_ids.shape[1]} 个token, 耗时 {self.prefix_build_seconds:.2f}秒")
+
+    def _generate_with_prefix_cache(self, audio_data: np.ndarray, sample_rate: int, note: str,
+                                    max_new_tokens: int) -> Optional[str]:
+        """
+        复用静态前缀的KV状态生成：只预填充音频及之后的token，然后从缓存继续生成
+        
+        前缀为音频起始标记（<|audio_bos|>）之前的全部token，第一次调用时计算并保存，之后每次调用只校验
+        token是否一致；用完后把缓存裁剪回前缀长度供下一段复用。
+        音频特征在手动预填充时并入缓存，generate 只需要处理最后一个token。
+        要求处理器把音频占位符展开为与特征等长的token（较新版本的 transformers），否则返回None，回退到普通生成。
+        """
+        inputs = self._processor_inputs([audio_data], sample_rate, [note])
+        input_ids = inputs.input_ids
+        audio_bos_id = self.processor.tokenizer.convert_tokens_to_ids("<|audio_bos|>")
+        audio_positions = (input_ids[0] == audio_bos_id).nonzero()
+        expanded = int((input_ids[0] == self.model.config.audio_token_index).sum()) > 1
+        if len(audio_positions) == 0 or not expanded:
+            if not self._prefix_cache_warned:
+                print("⚠️  当前 transformers 版本的处理器未展开音频占位符，无法使用前缀缓存，改用普通生成")
+                self._prefix_cache_warned = True
+            self.use_prefix_cache = False
+            return None
+        
+        prefix_len = int(audio_positions[0])
+        if self._prefix_cache is None or not torch.equal(self._prefix_ids, input_ids[0, :prefix_len]):
+            self._build_prefix_cache(input_ids[:, :prefix_len])
+        
+        cache = self._prefix_cache
+        total_len = input_ids.shape[1]
+        try:
             with torch.no_grad():
+                # 预填充 前缀之后 到 倒数第二个token（含音频特征），最后一个token交给 generate
+                self.model(
+                    input_ids=input_ids[:, prefix_len:total_len - 1],
+                    input_features=inputs.input_features,
+                    feature_attention_mask=inputs.feature_attention_mask,
+                    attention_mask=inputs.attention_mask[:, :total_len - 1],
+                    past_key_values=cache,
+                    cache_position=torch.arange(prefix_len, total_len - 1, device=input_ids.device),
+                    use_cache=True
+                )
                 generated_ids = self.model.generate(
-                    **inputs,
-                    max_new_tokens=4096,
-                    temperature=0.3,
-                    top_p=0.9,
-                    do_sample=True,
-                    pad_token_id=self.processor.tokenizer.eos_token_id,
-                    eos_token_id=self.processor.tokenizer.eos_token_id,
-                    repetition_penalty=1.05
+                    input_ids=input_ids,
+                    attention_mask=inputs.attention_mask,
+                    past_key_values=cache,
+                    **self._generation_kwargs(max_new_tokens)
                 )
+        finally:
+            cache.crop(prefix_len)
+        
+        return self.processor.batch_decode(
+            generated_ids[:, total_len:],
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=False
+        )[0]
+
+    def _full_result(self, audio_path: str, duration: float, sample_rate: int, response: str) -> Dict:
+        """整段分析的回复 -> 结构化结果"""
+        parsed_result = self._parse_response(response)
+        parsed_result["raw_response"] = response
+        parsed_result["audio_info"] = {
+            "duration": duration,
+            "sample_rate": sample_rate,
+            "file_path": audio_path
+        }
+        return parsed_result
+
+    def _chunk_result(self, response: str) -> Dict:
+        parsed = self._parse_response(response)
+        parsed["raw_response"] = response
+        return parsed
+
+    def _long_result(self, audio_path: str, duration: float, sample_rate: int,
+                     chunk_results: List[tuple], split_by: str) -> Dict:
+        """合并各片段的结果，附上每段的范围和原始回复"""
+        result = merge_chunk_results(chunk_results, duration)
+        result["chunks"] = [
+            {"range": chunk.label(), "start": chunk.start, "end": chunk.end,
+             "speakers": sorted({label for label, _ in chunk.turns}), "raw_response": parsed.get("raw_response", "")}
+            for chunk, parsed in chunk_results
+        ]
+        result["raw_response"] = "\n\n".join(
+            f"[片段 {chunk.label()}]\n{parsed.get('raw_response', '')}" for chunk, parsed in chunk_results
+        )
+        result["audio_info"] = {
+            "duration": duration,
+            "sample_rate": sample_rate,
+            "file_path": audio_path,
+            "chunks": len(chunk_results),
+            "split_by": split_by
+        }
+        return result
+
+    def _plan_long_audio(self, audio_data: np.ndarray, sample_rate: int, transcript_path: Optional[str],
+                         chunk_seconds: float) -> tuple:
+        """返回 (片段列表, 切分依据)"""
+        duration = len(audio_data) / sample_rate
+        turns = []
+        if transcript_path and os.path.exists(transcript_path):
+            turns = load_turns(transcript_path)
+        chunks = plan_chunks(duration, chunk_seconds, turns, audio_data, sample_rate)
+        split_by = "转录轮次" if turns else "静音"
+        print(f"音频时长 {duration:.1f}秒，按{split_by}切分为 {len(chunks)} 段")
+        return chunks, split_by
+
+    def _load_audio(self, audio_path: str) -> tuple:
+        """加载音频为模型采样率的单声道波形（见 audio_decode，有缓存时内存映射），返回 (波形, 采样率)"""
+        sample_rate = self.processor.feature_extractor.sampling_rate
+        return load_audio(audio_path, self.decode_cache_dir, sample_rate), sample_rate
+
+    def _prefetch_audio(self, audio_paths: List[str]) -> AudioPrefetcher:
+        """后台进程中按顺序提前解码，迭代产出 (路径, 波形或None, 错误信息或None)"""
+        return AudioPrefetcher(audio_paths, self.decode_cache_dir, self.processor.feature_extractor.sampling_rate,
+                               workers=self.decode_workers, prefetch=self.prefetch)
+
+    def analyze_long_audio(self, audio_path: str, transcript_path: Optional[str] = None,
+                           chunk_seconds: float = MAX_CHUNK_SECONDS, max_new_tokens: int = 1024,
+                           audio_data: Optional[np.ndarray] = None) -> Dict:
+        """
+        分段分析长音频：按转录的发言人轮次（没有转录时按静音）切成不超过 chunk_seconds 的片段，
+        逐段调用模型（每次输入不超过30秒、输出不超过 max_new_tokens），再合并为与整段分析相同的结构
+        
+        Args:
+            audio_path: 音频文件路径
+            transcript_path: 对应的 "发言人N mm:ss" 格式转录文件，可选
+            chunk_seconds: 每段的最大时长（秒），不超过30
+            max_new_tokens: 每段生成的最大token数
+            audio_data: 已解码的波形（模型采样率），为None时在此解码
             
-            # 解码生成的文本
-            generated_ids = [
-                output_ids[len(input_ids):]
-                for input_ids, output_ids in zip(inputs.input_ids, generated_ids)
-            ]
-            
-            response = self.processor.batch_decode(
-                generated_ids, 
-                skip_special_tokens=True,
-                clean_up_tokenization_spaces=False
-            )[0]
-            
+        Returns:
+            包含分析结果的字典，额外包含每段的范围和原始回复（chunks）
+        """
+        if not os.path.exists(audio_path):
+            return {"error": f"音频文件 {audio_path} 不存在"}
+        
+        try:
+            sample_rate = self.processor.feature_extractor.sampling_rate
+            if audio_data is None:
+                print(f"正在加载音频文件: {os.path.basename(audio_path)}...")
+                audio_data, sample_rate = self._load_audio(audio_path)
+            duration = len(audio_data) / sample_rate
+            chunks, split_by = self._plan_long_audio(audio_data, sample_rate, transcript_path, chunk_seconds)
             
-            # 解析响应为结构化数据
-            parsed_result = self._parse_response(response)
-            parsed_result["raw_response"] = response
-            parsed_result["audio_info"] = {
-                "duration": duration,
-                "sample_rate": sample_rate,
-                "file_path": audio_path
-            }
+            chunk_results = []
+            for chunk in tqdm(chunks, desc="分析片段", leave=False):
+                try:
+                    response = self._generate_response(
+                        audio_data[chunk.samples(sample_rate)], sample_rate,
+                        chunk_note(chunk, len(chunks)), max_new_tokens
+                    )
+                    parsed = self._chunk_result(response)
+                except Exception as e:
+                    traceback.print_exc()
+                    parsed = {"error": f"处理片段 {chunk.label()} 时出错: {str(e)}", "raw_response": ""}
+                chunk_results.append((chunk, parsed))
             
-            return parsed_result
+            return self._long_result(audio_path, duration, sample_rate, chunk_results, split_by)
             
         except Exception as e:
             traceback.print_exc()
@@ -210,154 +508,254 @@ class AudioAnalyzer:
                 "audio_info": {"file_path": audio_path}
             }
 
-    def batch_analyze(self, audio_paths: List[str], output_dir: str = None) -> List[Dict]:
+    def batch_analyze(self, audio_paths: List[str], output_dir: str = None, segmented: bool = False,
+                      transcript_dir: Optional[str] = None, chunk_seconds: float = MAX_CHUNK_SECONDS,
+                      max_new_tokens: int = 1024, batch_size: int = 1) -> List[Dict]:
         """
         批量分析多个音频文件
         
         Args:
             audio_paths: 音频文件路径列表
             output_dir: 结果输出目录，如果为None则不保存文件
+            segmented: 是否使用分段模式（analyze_long_audio）
+            transcript_dir: 分段模式下查找同名 .txt 转录的目录，默认与音频同目录
+            chunk_seconds: 分段模式下每段的最大时长（秒）
+            max_new_tokens: 分段模式下每段生成的最大token数
+            batch_size: 每次 generate 同时处理的片段数，大于1时使用批量生成
             
         Returns:
             包含所有分析结果的列表
         """
-        results = []
-        
         # 创建输出目录
         if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
-        # 使用进度条显示处理进度
-        for audio_path in tqdm(audio_paths, desc="处理音频文件"):
+        if batch_size > 1:
+            results, throughput = self._batch_generate_analyze(
+                audio_paths, output_dir, segmented, transcript_dir, chunk_seconds, max_new_tokens, batch_size
+            )
+            self._save_summary(audio_paths, results, output_dir, throughput)
+            return results
+        
+        results = []
+        
+        # 使用进度条显示处理进度；后续文件在后台进程中解码，与当前文件的模型推理重叠
+        for audio_path, audio_data, decode_error in tqdm(self._prefetch_audio(audio_paths), total=len(audio_paths),
+                                                         desc="处理音频文件"):
             print(f"\n{'='*60}")
             print(f"正在处理: {os.path.basename(audio_path)}")
             print(f"{'='*60}")
             
             # 分析单个音频文件
-            result = self.analyze_full_audio(audio_path)
+            if decode_error and not os.path.exists(audio_path):
+                result = {"error": f"音频文件 {audio_path} 不存在"}
+            elif decode_error:
+                result = {"error": decode_error, "raw_response": "", "audio_info": {"file_path": audio_path}}
+            elif segmented:
+                result = self.analyze_long_audio(
+                    audio_path, find_transcript(audio_path, transcript_dir), chunk_seconds, max_new_tokens, audio_data
+                )
+            else:
+                result = self.analyze_full_audio(audio_path, audio_data)
             results.append(result)
             
             # 保存结果
-            if output_dir:
-                base_name = os.path.splitext(os.path.basename(audio_path))[0]
-                
-                # 保存文本报告
-                txt_path = os.path.join(output_dir, f"{base_name}_analysis.txt")
-                formatted_output = self.format_output(result)
-                with open(txt_path, 'w', encoding='utf-8') as f:
-                    f.write(formatted_output)
-                print(f"✅ 文本报告已保存到: {txt_path}")
-                
-                # 保存JSON数据
-                json_path = os.path.join(output_dir, f"{base_name}_analysis.json")
-                json_data = {k: v for k, v in result.items() if k != "raw_response"}
-                with open(json_path, 'w', encoding='utf-8') as f:
-                    json.dump(json_data, f, ensure_ascii=False, indent=2)
-                print(f"✅ JSON数据已保存到: {json_path}")
-        
-        # 保存汇总报告
-        if output_dir and len(results) > 1:
-            summary_path = os.path.join(output_dir, "batch_analysis_summary.txt")
-            with open(summary_path, 'w', encoding='utf-8') as f:
-                f.write("="*60)
-                f.write("\n批量音频分析汇总报告\n")
-                f.write("="*60)
-                f.write(f"\n处理时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                f.write(f"\n处理文件总数: {len(audio_paths)}")
-                f.write(f"\n成功分析: {len([r for r in results if 'error' not in r])}")
-                f.write(f"\n分析失败: {len([r for r in results if 'error' in r])}")
-                f.write("\n\n文件列表:\n")
-                for i, (path, result) in enumerate(zip(audio_paths, results), 1):
-                    status = "✅ 成功" if 'error' not in result else "❌ 失败"
-                    f.write(f"{i}. {os.path.basename(path)} - {status}\n")
-            print(f"✅ 汇总报告已保存到: {summary_path}")
+            self._save_result(result, audio_path, output_dir)
         
+        self._save_summary(audio_paths, results, output_dir)
         return results
 
-    def _parse_response(self, response: str) -> Dict:
+    def _batch_generate_analyze(self, audio_paths: List[str], output_dir: Optional[str], segmented: bool,
+                                transcript_dir: Optional[str], chunk_seconds: float, max_new_tokens: int,
+                                batch_size: int, lookahead: int = 4) -> tuple:
         """
-        解析模型响应，提取结构化信息
+        批量生成：把待分析的片段（整段模式下每个文件一段，分段模式下为各文件的片段）凑成批次一起生成
         
-        Args:
-            response: 模型的原始响应文本
-            
-        Returns:
-            解析后的结构化数据
+        依次加载文件并把片段放入待处理队列，攒够 batch_size × lookahead 个片段后按时长分组、逐批生成，
+        时长相近的片段放在同一批以减少填充；某个文件的片段全部完成后立即合并并写出结果，随后释放它的音频。
+        返回 (结果列表, 吞吐统计)
         """
-        result = {
-            "overview": {},
-            "speakers": [],
-            "interaction": {},
-            "raw_text": response
-        }
+        results = [None] * len(audio_paths)
+        files = {}  # 文件下标 -> 尚未完成的文件状态
+        pending = []  # (文件下标, 片段或None, 音频, 片段说明)
+        tokens = max_new_tokens if segmented else 4096
+        monitor = GPUMonitor()
+        clips_done = 0
+        start_time = time.time()
+        
+        def finish_file(idx: int):
+            state = files.pop(idx)
+            if segmented:
+                chunk_results = sorted(state["chunk_results"], key=lambda item: item[0].index)
+                result = self._long_result(state["path"], state["duration"], state["sample_rate"],
+                                           chunk_results, state["split_by"])
+            else:
+                result = state["result"]
+            results[idx] = result
+            self._save_result(result, state["path"], output_dir)
+        
+        def record(job: tuple, response: Optional[str], error: Optional[str]):
+            idx, chunk, _, _ = job
+            state = files[idx]
+            if chunk is None:
+                if error is None:
+                    state["result"] = self._full_result(state["path"], state["duration"], state["sample_rate"], response)
+                else:
+                    state["result"] = {"error": error, "raw_response": "", "audio_info": {"file_path": state["path"]}}
+            else:
+                parsed = self._chunk_result(response) if error is None else {"error": error, "raw_response": ""}
+                state["chunk_results"].append((chunk, parsed))
+            state["remaining"] -= 1
+            if state["remaining"] == 0:
+                finish_file(idx)
+        
+        def run_batch(jobs: List[tuple]):
+            durations = [len(job[2]) / sample_rate for job in jobs]
+            print(f"批量生成 {len(jobs)} 个片段，时长 {min(durations):.1f}-{max(durations):.1f}秒")
+            try:
+                responses = self._generate_responses([job[2] for job in jobs], sample_rate,
+                                                     [job[3] for job in jobs], tokens)
+                for job, response in zip(jobs, responses):
+                    record(job, response, None)
+            except Exception as e:
+                if len(jobs) == 1:
+                    traceback.print_exc()
+                    record(jobs[0], None, f"处理音频时出错: {str(e)}")
+                    return
+                # 整批失败（通常是显存不足）时逐个重试
+                print(f"⚠️  批量生成失败 ({e})，逐个重试")
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                for job in jobs:
+                    run_batch([job])
+        
+        def drain():
+            nonlocal clips_done, pending
+            jobs, pending = pending, []
+            for batch in duration_batches([len(job[2]) for job in jobs], batch_size):
+                run_batch([jobs[i] for i in batch])
+                clips_done += len(batch)
+                elapsed = time.time() - start_time
+                print(f"📈 已完成 {clips_done} 个片段, {clips_done / elapsed * 60:.1f} 片段/分钟, {monitor.status()}")
         
+        sample_rate = self.processor.feature_extractor.sampling_rate
+        monitor.start()
         try:
-            if "无法理解音频内容" in response:
-                result["error"] = "模型无法理解音频内容，可能是音频质量问题或格式不支持"
-                return result
-            
-            overview_match = re.search(r'【音频概览】(.*?)(?=【|$)', response, re.DOTALL)
-            if overview_match:
-                overview_text = overview_match.group(1)
-                result["overview"] = self._extract_key_values(overview_text)
-            
-            # 提取每个说话人的信息
-            speaker_pattern = r'\[说话人(\d+)\](.*?)(?=\[说话人|\【|$)'
-            speaker_matches = re.finditer(speaker_pattern, response, re.DOTALL)
-            
-            for match in speaker_matches:
-                speaker_id = match.group(1)
-                speaker_text = match.group(2)
+            decoded = tqdm(self._prefetch_audio(audio_paths), total=len(audio_paths), desc="加载音频文件")
+            for idx, (audio_path, audio_data, decode_error) in enumerate(decoded):
+                if decode_error:
+                    if not os.path.exists(audio_path):
+                        results[idx] = {"error": f"音频文件 {audio_path} 不存在"}
+                    else:
+                        results[idx] = {"error": decode_error, "raw_response": "", "audio_info": {"file_path": audio_path}}
+                    self._save_result(results[idx], audio_path, output_dir)
+                    continue
+                try:
+                    duration = len(audio_data) / sample_rate
+                    state = {"path": audio_path, "duration": duration, "sample_rate": sample_rate}
+                    if segmented:
+                        chunks, split_by = self._plan_long_audio(
+                            audio_data, sample_rate, find_transcript(audio_path, transcript_dir), chunk_seconds
+                        )
+                        state.update(split_by=split_by, chunk_results=[], remaining=len(chunks))
+                        for chunk in chunks:
+                            pending.append((idx, chunk, audio_data[chunk.samples(sample_rate)],
+                                            chunk_note(chunk, len(chunks))))
+                    else:
+                        # 特征提取器只使用前30秒，截断后再分组，避免按原始时长分组失真
+                        state["remaining"] = 1
+                        pending.append((idx, None, audio_data[:int(MAX_CHUNK_SECONDS * sample_rate)], ""))
+                    files[idx] = state
+                    if state["remaining"] == 0:
+                        finish_file(idx)
+                except Exception as e:
+                    traceback.print_exc()
+                    results[idx] = {"error": f"处理音频时出错: {str(e)}", "raw_response": "",
+                                    "audio_info": {"file_path": audio_path}}
+                    self._save_result(results[idx], audio_path, output_dir)
+                    continue
                 
-                speaker_info = {
-                    "id": f"说话人{speaker_id}",
-                    "features": self._extract_speaker_features(speaker_text)
-                }
-                result["speakers"].append(speaker_info)
-            
-            interaction_match = re.search(r'【交互特征】(.*?)(?=【|$)', response, re.DOTALL)
-            if interaction_match:
-                interaction_text = interaction_match.group(1)
-                result["interaction"] = self._extract_key_values(interaction_text)
-            
-        except Exception as e:
-            print(f"解析响应时出错: {e}")
-            result["parse_error"] = str(e)
+                if len(pending) >= batch_size * lookahead:
+                    drain()
+            drain()
+        finally:
+            monitor.stop()
         
-        return result
-    
-    def _extract_key_values(self, text: str) -> Dict:
-        """提取键值对信息"""
-        result = {}
-        lines = text.strip().split('\n')
-        for line in lines:
-            if '：' in line or ':' in line:
-                parts = re.split('[：:]', line, 1)
-                if len(parts) == 2:
-                    key = parts[0].strip().replace('-', '').strip()
-                    value = parts[1].strip()
-                    if key and value:
-                        result[key] = value
-        return result
-    
-    def _extract_speaker_features(self, text: str) -> Dict:
-        """提取说话人特征"""
-        features = {}
-        patterns = {
-            "声音特征": r'声音特征[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)',
-            "语速": r'语速[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)',
-            "语调": r'语调[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)',
-            "音高": r'音高[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)',
-            "情绪": r'(?:主要)?情绪[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)',
-            "内容": r'转录内容[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)'
+        elapsed = time.time() - start_time
+        throughput = {
+            "batch_size": batch_size,
+            "clips": clips_done,
+            "files": len(audio_paths),
+            "elapsed": elapsed,
+            "clips_per_minute": clips_done / elapsed * 60 if elapsed else 0.0,
+            "files_per_minute": len(audio_paths) / elapsed * 60 if elapsed else 0.0,
         }
+        throughput.update(monitor.summary())
+        print(f"批量生成完成: {clips_done} 个片段, {throughput['clips_per_minute']:.1f} 片段/分钟, "
+              f"{throughput['files_per_minute']:.2f} 文件/分钟, {monitor.status()}")
+        return results, throughput
+
+    def _save_result(self, result: Dict, audio_path: str, output_dir: Optional[str]):
+        """保存单个文件的文本报告和JSON数据（output_dir 为None时不保存）"""
+        if not output_dir:
+            return
+        base_name = os.path.splitext(os.path.basename(audio_path))[0]
         
-        for key, pattern  in patterns.items():
-            match = re.search(pattern, text, re.DOTALL)
-            if match:
-                    features[key] = match.group(1).strip()
+        # 保存文本报告
+        txt_path = os.path.join(output_dir, f"{base_name}_analysis.txt")
+        formatted_output = self.format_output(result)
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.write(formatted_output)
+        print(f"✅ 文本报告已保存到: {txt_path}")
         
-            return features
+        # 保存JSON数据
+        json_path = os.path.join(output_dir, f"{base_name}_analysis.json")
+        json_data = {k: v for k, v in result.items() if k != "raw_response"}
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(json_data, f, ensure_ascii=False, indent=2)
+        print(f"✅ JSON数据已保存到: {json_path}")
+
+    def _save_summary(self, audio_paths: List[str], results: List[Dict], output_dir: Optional[str],
+                      throughput: Optional[Dict] = None):
+        """保存汇总报告（多个文件时）；批量生成模式下附上吞吐和GPU统计"""
+        if not output_dir or len(results) <= 1:
+            return
+        summary_path = os.path.join(output_dir, "batch_analysis_summary.txt")
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            f.write("="*60)
+            f.write("\n批量音频分析汇总报告\n")
+            f.write("="*60)
+            f.write(f"\n处理时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            f.write(f"\n处理文件总数: {len(audio_paths)}")
+            f.write(f"\n成功分析: {len([r for r in results if 'error' not in r])}")
+            f.write(f"\n分析失败: {len([r for r in results if 'error' in r])}")
+            if throughput:
+                f.write(f"\n\n批量生成 (batch_size={throughput['batch_size']}):")
+                f.write(f"\n片段数: {throughput['clips']}, 总耗时: {throughput['elapsed']:.1f}秒")
+                f.write(f"\n吞吐: {throughput['clips_per_minute']:.1f} 片段/分钟, {throughput['files_per_minute']:.2f} 文件/分钟")
+                if throughput.get("gpu_util_mean") is not None:
+                    f.write(f"\nGPU利用率: 平均 {throughput['gpu_util_mean']:.0f}%, 最高 {throughput['gpu_util_max']:.0f}%")
+                if throughput.get("peak_memory_gb") is not None:
+                    f.write(f"\n显存峰值: {throughput['peak_memory_gb']:.1f} GB")
+            f.write("\n\n文件列表:\n")
+            for i, (path, result) in enumerate(zip(audio_paths, results), 1):
+                status = "✅ 成功" if 'error' not in result else "❌ 失败"
+                f.write(f"{i}. {os.path.basename(path)} - {status}\n")
+        print(f"✅ 汇总报告已保存到: {summary_path}")
+
+    def _parse_response(self, response: str) -> Dict:
+        """
+        解析模型响应，提取结构化信息（见 audio_parser）
+        
+        Args:
+            response: 模型的原始响应文本
+            
+        Returns:
+            解析后的结构化数据
+        """
+        if self.output_format == 'json':
+            return parse_json_analysis(response)
+        return parse_analysis(response)
     
     def format_output(self, analysis_result: Dict) -> str:
         """
@@ -384,6 +782,8 @@ class AudioAnalyzer:
             output.append(f"  文件路径: {info.get('file_path', 'N/A')}")
             output.append(f"  音频时长: {info.get('duration', 0):.2f}秒")
             output.append(f"  采样率: {info.get('sample_rate', 0)}Hz")
+            if info.get("chunks"):
+                output.append(f"  分段分析: {info['chunks']} 段（按{info.get('split_by', '')}切分）")
         
         # 输出概览
         if analysis_result.get("overview"):
@@ -410,17 +810,40 @@ class AudioAnalyzer:
             for key, value in analysis_result["interaction"].items():
                 output.append(f"  {key}: {value}")
         
+        # 输出分段分析中失败的片段
+        if analysis_result.get("failed_chunks"):
+            output.append("\n【分析失败的片段】")
+            for failed in analysis_result["failed_chunks"]:
+                output.append(f"  {failed['range']}: {failed['error']}")
+        
         output.append("\n" + "="*60)
         
         return "\n".join(output)
 
 
+def find_transcript(audio_path: str, transcript_dir: Optional[str] = None) -> Optional[str]:
+    """查找与音频同名的 .txt 转录文件（默认在音频所在目录），找不到时返回None"""
+    base_name = os.path.splitext(os.path.basename(audio_path))[0]
+    transcript_path = os.path.join(transcript_dir or os.path.dirname(audio_path), f"{base_name}.txt")
+    return transcript_path if os.path.exists(transcript_path) else None
+
+
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(description='音频分析工具')
     parser.add_argument('--audio_path', type=str, required=True, help='音频文件路径或包含音频文件的目录')
     parser.add_argument('--model_dir', type=str, default='', help='模型目录路径，如果为空则自动下载')
     parser.add_argument('--output_dir', type=str, default='./audio_analysis_results', help='结果输出目录，默认为./audio_analysis_results')
+    parser.add_argument('--segmented', action='store_true', help='分段模式：按转录轮次或静音切成不超过30秒的片段逐段分析后合并（长录音推荐）')
+    parser.add_argument('--transcript_dir', type=str, default=None, help='分段模式下同名 .txt 转录所在目录，默认与音频同目录')
+    parser.add_argument('--chunk_seconds', type=float, default=MAX_CHUNK_SECONDS, help='分段模式下每段的最大时长（秒），默认30')
+    parser.add_argument('--max_new_tokens', type=int, default=1024, help='分段模式下每段生成的最大token数，默认1024')
+    parser.add_argument('--decode_cache_dir', type=str, default='./.cache/audio', help='解码后波形(.npy)的缓存目录，设为空字符串则不缓存')
+    parser.add_argument('--decode_workers', type=int, default=2, help='后台解码进程数，默认2')
+    parser.add_argument('--prefetch', type=int, default=2, help='提前解码的文件数，默认2')
+    parser.add_argument('--prefix_cache', action='store_true', help='把分析提示词放在音频之前并复用其KV缓存，减少每段的预填充时间（批大小为1时生效）')
+    parser.add_argument('--output_format', type=str, default='text', choices=['text', 'json'], help='模型回复格式：text为结构化文本（默认），json为按schema输出并校验的JSON')
+    parser.add_argument('--batch_size', type=int, default=1, help='每次生成同时处理的片段数，大于1时按时长分组批量生成，默认1')
     
     args = parser.parse_args()
     
@@ -429,10 +852,14 @@ def main():
     
     # 初始化分析器
     try:
-        analyzer = AudioAnalyzer(model_dir=args.model_dir)
+        analyzer = AudioAnalyzer(model_dir=args.model_dir, decode_cache_dir=args.decode_cache_dir,
+                                 decode_workers=args.decode_workers, prefetch=args.prefetch,
+                                 output_format=args.output_format)
     except Exception as e:
         print(f"❌ 初始化分析器失败: {e}")
         return
+    if args.prefix_cache:
+        analyzer.enable_prefix_cache()
     
     # 收集要处理的音频文件
     audio_files = []
@@ -467,7 +894,10 @@ def main():
         return
     print("-" * 60)
     
-    results = analyzer.batch_analyze(audio_files, args.output_dir)
+    results = analyzer.batch_analyze(
+        audio_files, args.output_dir, segmented=args.segmented, transcript_dir=args.transcript_dir,
+        chunk_seconds=args.chunk_seconds, max_new_tokens=args.max_new_tokens, batch_size=args.batch_size
+    )
     
     # 输出汇总信息
     print("\n" + "="*60)
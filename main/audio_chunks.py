@@ -0,0 +1,209 @@
+"""
+长音频分段：把整段会议录音切成不超过固定时长的片段，逐段交给 Qwen2-Audio 分析后再合并
+
+Qwen2-Audio 的 Whisper 特征提取器只处理前30秒，超出部分会被直接截断，所以长录音必须分段。
+切分点优先选在转录的发言人轮次开始处（同一段内的发言人与转录一致，合并时可以按发言人对齐），
+没有转录或单个轮次超过时长上限时，在上限之前的一段窗口里选能量最低（最安静）的位置切分。
+"""
+
+import bisect
+import os
+import sys
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 转录解析与 convert_text 共用（列式转录，带二进制缓存 <文件名>.txt.tsc）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "convert_text"))
+from transcript import format_timestamp, load_transcript
+
+MAX_CHUNK_SECONDS = 30.0  # Whisper 特征提取器的输入上限
+
+
+class AudioChunk:
+    """一个分析片段：[start, end) 秒，以及片段内转录的发言人轮次 [(发言人标签, 开始秒数)]"""
+
+    def __init__(self, index: int, start: float, end: float, turns: List[Tuple[str, float]] = None):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.turns = turns or []
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def label(self) -> str:
+        return f"{format_timestamp(int(self.start))}-{format_timestamp(int(self.end))}"
+
+    def samples(self, sample_rate: int) -> slice:
+        return slice(int(round(self.start * sample_rate)), int(round(self.end * sample_rate)))
+
+
+def load_turns(transcript_path: str) -> List[Tuple[str, float]]:
+    """从 "说话人 时间戳" 格式的转录中读取 [(发言人标签, 开始秒数)]，按时间排序"""
+    transcript = load_transcript(transcript_path)
+    turns = [(transcript.speaker_label(i), float(transcript.starts[i])) for i in range(len(transcript))]
+    return sorted(turns, key=lambda turn: turn[1])
+
+
+def frame_energy_db(audio: np.ndarray, sample_rate: int, frame_seconds: float = 0.05) -> np.ndarray:
+    """逐帧RMS能量（dB，相对整段最大值）"""
+    frame = max(1, int(sample_rate * frame_seconds))
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return np.zeros(0)
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10) / max(rms.max(), 1e-10))
+
+
+def quietest_point(energy_db: np.ndarray, frame_seconds: float, start: float, end: float) -> float:
+    """[start, end] 秒内能量最低的帧的中心；有多帧并列最低时取最靠后的，让片段尽量长"""
+    lo = int(start / frame_seconds)
+    hi = min(int(end / frame_seconds), len(energy_db))
+    if hi <= lo:
+        return end
+    window = energy_db[lo:hi]
+    last_min = len(window) - 1 - int(np.argmin(window[::-1]))
+    return (lo + last_min + 0.5) * frame_seconds
+
+
+def plan_chunks(duration: float, chunk_seconds: float = MAX_CHUNK_SECONDS, turns: List[Tuple[str, float]] = None,
+                audio: Optional[np.ndarray] = None, sample_rate: int = 16000, min_chunk_seconds: float = 5.0,
+                silence_search_seconds: float = 8.0) -> List[AudioChunk]:
+    """
+    规划分段：每段不超过 chunk_seconds
+
+    有转录轮次时，在不超过上限的前提下把尽量多的连续轮次放进一段，切分点为下一轮的开始时间；
+    否则（或单个轮次过长）在上限前 silence_search_seconds 秒内找最安静的位置切分，没有音频时按上限硬切。
+    短于 min_chunk_seconds 的候选切分点会被跳过，避免产生过碎的片段。
+    """
+    chunk_seconds = min(chunk_seconds, MAX_CHUNK_SECONDS)
+    turns = turns or []
+    boundaries = [t for _, t in turns if 0 < t < duration]
+
+    frame_seconds = 0.05
+    energy_db = frame_energy_db(audio, sample_rate, frame_seconds) if audio is not None else None
+
+    chunks = []
+    start = 0.0
+    while duration - start > 1e-6:
+        limit = start + chunk_seconds
+        if limit >= duration:
+            end = duration
+        else:
+            candidates = [t for t in boundaries if start + min_chunk_seconds <= t <= limit]
+            if candidates:
+                end = candidates[-1]
+            elif energy_db is not None:
+                end = quietest_point(energy_db, frame_seconds, max(start + min_chunk_seconds,
+                                                                   limit - silence_search_seconds), limit)
+            else:
+                end = limit
+        chunks.append(AudioChunk(len(chunks), start, end))
+        start = end
+
+    # 把转录轮次分配到所在片段（跨越切分点的轮次算在开始所在的片段）
+    chunk_starts = [chunk.start for chunk in chunks]
+    for label, turn_start in turns:
+        i = bisect.bisect_right(chunk_starts, turn_start) - 1
+        if i >= 0:
+            chunks[i].turns.append((label, turn_start))
+    return chunks
+
+
+def chunk_note(chunk: AudioChunk, total_chunks: int) -> str:
+    """片段说明：位置，以及有转录轮次时要求沿用转录中的发言人编号，便于跨片段合并"""
+    lines = [f"这是一段长录音的第 {chunk.index + 1}/{total_chunks} 个片段（{chunk.label()}）。"]
+    if chunk.turns:
+        order = "、".join(f"{label}（{format_timestamp(int(t))}）" for label, t in chunk.turns)
+        lines.append(f"根据转录，本片段中依次发言的是：{order}。")
+        lines.append("请用与转录相同的编号标识说话人，例如发言人1记为[说话人1]。")
+    return "\n".join(lines)
+
+
+def _join_distinct(values: List[str], sep: str = "；") -> str:
+    return sep.join(dict.fromkeys(v for v in values if v))
+
+
+def merge_chunk_results(chunk_results: List[Tuple[AudioChunk, Dict]], duration: float) -> Dict:
+    """
+    把各片段的解析结果合并为与整段分析相同的 overview/speakers/interaction 结构
+
+    只有带转录轮次的片段要求模型沿用转录编号，这些片段中同一说话人编号的特征按时间顺序去重后以"；"连接，
+    转录内容按时间顺序拼接；没有转录轮次的片段（按静音切分）中的编号只在片段内有效，
+    这些说话人不跨片段合并，编号记为 "片段N-说话人M" 并标记 chunk_local。
+    概览中的总时长用实际值；说话人数量在全部片段都能对齐时为合并后的人数，否则只能给出下限
+    （对齐的人数与单个片段内人数中的较大者）。其余键取各片段中最常见的值。
+    每个说话人另外记录出现的片段（chunks），失败的片段记录在 failed_chunks 中。
+    """
+    overview_values = {}
+    interaction_values = {}
+    speakers = {}
+    chunk_local = []
+    max_chunk_speakers = 0
+    failed = []
+
+    for chunk, result in chunk_results:
+        if "error" in result:
+            failed.append({"chunk": chunk.index, "range": chunk.label(), "error": result["error"]})
+            continue
+        for key, value in result.get("overview", {}).items():
+            overview_values.setdefault(key, []).append(value)
+        for key, value in result.get("interaction", {}).items():
+            interaction_values.setdefault(key, []).append(value)
+        # 没有转录轮次的片段：说话人只在本片段内合并
+        chunk_speakers = speakers if chunk.turns else {}
+        chunk_ids = set()
+        for speaker in result.get("speakers", []):
+            speaker_id = speaker["id"] if chunk.turns else f"片段{chunk.index + 1}-{speaker['id']}"
+            merged = chunk_speakers.setdefault(speaker["id"], {"id": speaker_id, "values": {}, "chunks": []})
+            if speaker["id"] not in chunk_ids:
+                chunk_ids.add(speaker["id"])
+                merged["chunks"].append(chunk.label())
+            for key, value in speaker.get("features", {}).items():
+                merged["values"].setdefault(key, []).append(value)
+        max_chunk_speakers = max(max_chunk_speakers, len(chunk_ids))
+        if not chunk.turns:
+            chunk_local.extend(chunk_speakers.values())
+
+    overview = {key: Counter(values).most_common(1)[0][0] for key, values in overview_values.items()}
+    overview["总时长估计"] = f"{duration:.1f}秒（分 {len(chunk_results)} 段分析）"
+    if chunk_local:
+        overview["说话人数量"] = f"至少{max(len(speakers), max_chunk_speakers)}（部分片段无转录，说话人无法跨片段对齐）"
+    else:
+        overview["说话人数量"] = str(len(speakers))
+
+    merged_speakers = []
+    aligned = sorted(speakers.values(), key=lambda s: (len(s["id"]), s["id"]))
+    for speaker in aligned + chunk_local:
+        features = {}
+        for key, values in speaker["values"].items():
+            features[key] = "\n".join(values) if key == "内容" else _join_distinct(values)
+        merged_speakers.append({"id": speaker["id"], "features": features, "chunks": speaker["chunks"]})
+    for speaker in merged_speakers[len(aligned):]:
+        speaker["chunk_local"] = True
+
+    result = {
+        "overview": overview,
+        "speakers": merged_speakers,
+        "interaction": {key: _join_distinct(values) for key, values in interaction_values.items()},
+        "raw_text": "",
+    }
+    if failed:
+        result["failed_chunks"] = failed
+    if failed and len(failed) == len(chunk_results):
+        result["error"] = f"全部 {len(failed)} 个片段分析失败: {failed[0]['error']}"
+    return result
+
+
+def duration_batches(durations: List[float], batch_size: int) -> List[List[int]]:
+    """
+    按时长分组：下标按时长排序后每 batch_size 个一组，同一批内的片段时长相近，填充浪费最少
+    组按最长时长从长到短排列，显存占用最大的批次最先运行，OOM会尽早暴露
+    """
+    order = sorted(range(len(durations)), key=lambda i: durations[i])
+    batches = [order[i:i + batch_size] for i in range(0, len(order), max(1, batch_size))]
+    return sorted(batches, key=lambda batch: -durations[batch[-1]])
@@ -0,0 +1,201 @@
+"""
+音频解码与重采样：后台进程流式解码为 16kHz 单声道 float32，并缓存为可内存映射的 .npy
+
+解码后端依次尝试：
+  - ffmpeg（需要在 PATH 中）：子进程解码并用 libswresample 重采样，按块从管道读出，内存占用与时长无关
+  - soundfile：按块读取并混成单声道，采样率不同时整段用 scipy 多相滤波重采样
+  - librosa：最后的兜底（与原来的 librosa.load 相同）
+解码结果边读边写入 <cache_dir>/<文件名>_<哈希>.npy，哈希包含原文件路径、大小、修改时间和采样率，
+原文件不变时再次分析直接 np.load(mmap_mode='r')，不再解码。
+AudioPrefetcher 在进程池中提前解码后续文件（有界队列），与主线程的模型推理重叠。
+"""
+
+import hashlib
+import multiprocessing
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from math import gcd
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+TARGET_SAMPLE_RATE = 16000
+BLOCK_SECONDS = 10.0
+
+
+def _ffmpeg_blocks(path: str, sample_rate: int, block_samples: int) -> Iterator[np.ndarray]:
+    command = ['ffmpeg', '-nostdin', '-v', 'error', '-i', path, '-f', 'f32le', '-ac', '1', '-ar', str(sample_rate), '-']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        block_bytes = block_samples * 4
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            usable = len(data) - len(data) % 4
+            yield np.frombuffer(data[:usable], dtype=np.float32)
+        stderr = process.stderr.read().decode('utf-8', errors='replace')
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg 解码失败: {stderr.strip()}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def _resample(audio: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    if orig_sr == target_sr:
+        return audio
+    from scipy.signal import resample_poly
+    divisor = gcd(orig_sr, target_sr)
+    return resample_poly(audio, target_sr // divisor, orig_sr // divisor).astype(np.float32)
+
+
+def _soundfile_blocks(path: str, sample_rate: int, block_samples: int) -> Iterator[np.ndarray]:
+    import soundfile as sf
+    with sf.SoundFile(path) as f:
+        orig_sr = f.samplerate
+        if orig_sr == sample_rate:
+            for block in f.blocks(blocksize=block_samples, dtype='float32', always_2d=True):
+                yield block.mean(axis=1, dtype=np.float32)
+            return
+        audio = f.read(dtype='float32', always_2d=True).mean(axis=1, dtype=np.float32)
+    audio = _resample(audio, orig_sr, sample_rate)
+    for start in range(0, len(audio), block_samples):
+        yield audio[start:start + block_samples]
+
+
+def _librosa_blocks(path: str, sample_rate: int, block_samples: int) -> Iterator[np.ndarray]:
+    import librosa
+    audio, _ = librosa.load(path, sr=sample_rate)
+    audio = audio.astype(np.float32, copy=False)
+    for start in range(0, len(audio), block_samples):
+        yield audio[start:start + block_samples]
+
+
+def iter_decoded_blocks(path: str, sample_rate: int = TARGET_SAMPLE_RATE,
+                        block_seconds: float = BLOCK_SECONDS) -> Iterator[np.ndarray]:
+    """按块产出 sample_rate 单声道 float32 波形"""
+    block_samples = max(1, int(sample_rate * block_seconds))
+    if shutil.which('ffmpeg'):
+        yield from _ffmpeg_blocks(path, sample_rate, block_samples)
+        return
+    try:
+        import soundfile  # noqa: F401
+    except ImportError:
+        yield from _librosa_blocks(path, sample_rate, block_samples)
+        return
+    # libsndfile 不支持的格式（如部分 mp3、m4a）在打开或读第一块时抛出 soundfile.LibsndfileError（RuntimeError 的子类），
+    # 此时还没有产出任何数据，改用 librosa；已经产出数据之后的错误照常抛出
+    blocks = _soundfile_blocks(path, sample_rate, block_samples)
+    try:
+        first = next(blocks, None)
+    except RuntimeError:
+        yield from _librosa_blocks(path, sample_rate, block_samples)
+        return
+    if first is not None:
+        yield first
+        yield from blocks
+
+
+def cache_path(path: str, cache_dir: str, sample_rate: int = TARGET_SAMPLE_RATE) -> str:
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{sample_rate}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{name}_{digest}.npy")
+
+
+def _write_npy_header(f, length: int) -> int:
+    npy_format.write_array_header_1_0(f, {'descr': '<f4', 'fortran_order': False, 'shape': (length,)})
+    return f.tell()
+
+
+def decode_to_cache(path: str, cache_dir: str, sample_rate: int = TARGET_SAMPLE_RATE) -> str:
+    """
+    解码并写入 .npy 缓存（已存在时直接返回），返回缓存路径
+
+    先写一个长度为0的头，解码块依次追加，最后回到文件开头写入真实长度；
+    numpy 的 .npy 头部为形状增长预留了空间，两次写出的头部长度相同。
+    """
+    target = cache_path(path, cache_dir, sample_rate)
+    if os.path.exists(target):
+        return target
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            header_size = _write_npy_header(f, 0)
+            length = 0
+            for block in iter_decoded_blocks(path, sample_rate):
+                f.write(np.ascontiguousarray(block, dtype='<f4').tobytes())
+                length += len(block)
+            f.seek(0)
+            if _write_npy_header(f, length) != header_size:
+                raise RuntimeError(f"无法写入解码缓存头部: {target}")
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target
+
+
+def decode_audio(path: str, sample_rate: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    """不使用缓存，解码为完整的 float32 数组"""
+    blocks = list(iter_decoded_blocks(path, sample_rate))
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+
+
+def _decode_job(path: str, cache_dir: Optional[str], sample_rate: int):
+    """进程池任务：有缓存目录时返回缓存路径（主进程内存映射），否则返回数组"""
+    if cache_dir:
+        return decode_to_cache(path, cache_dir, sample_rate)
+    return decode_audio(path, sample_rate)
+
+
+def _as_waveform(decoded) -> np.ndarray:
+    if isinstance(decoded, str):
+        return np.load(decoded, mmap_mode='r')
+    return decoded
+
+
+def load_audio(path: str, cache_dir: Optional[str] = None, sample_rate: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    """在当前进程中解码（有缓存时直接内存映射）"""
+    return _as_waveform(_decode_job(path, cache_dir, sample_rate))
+
+
+class AudioPrefetcher:
+    """
+    在后台进程池中按顺序提前解码音频：处理当前文件时最多提前解码其后的 prefetch 个文件（有界队列）
+
+    迭代产出 (路径, 波形或None, 错误信息或None)，顺序与输入一致。主线程处理当前文件（模型推理）时，
+    后续文件已在其他进程中解码；有缓存目录时进程间只传递缓存路径，波形通过内存映射读取。
+    """
+
+    def __init__(self, paths: List[str], cache_dir: Optional[str] = None, sample_rate: int = TARGET_SAMPLE_RATE,
+                 workers: int = 2, prefetch: int = 2):
+        self.paths = list(paths)
+        self.cache_dir = cache_dir
+        self.sample_rate = sample_rate
+        self.workers = max(1, workers)
+        self.prefetch = max(1, prefetch)
+
+    def __iter__(self) -> Iterator[Tuple[str, Optional[np.ndarray], Optional[str]]]:
+        # spawn：主进程已加载模型并初始化CUDA，fork 出的子进程会继承这些状态
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = []
+            submitted = 0
+            for i, path in enumerate(self.paths):
+                while submitted < len(self.paths) and submitted <= i + self.prefetch:
+                    futures.append(executor.submit(_decode_job, self.paths[submitted], self.cache_dir, self.sample_rate))
+                    submitted += 1
+                future = futures[i]
+                futures[i] = None
+                try:
+                    waveform, error = _as_waveform(future.result()), None
+                except Exception as e:
+                    waveform, error = None, f"解码音频失败: {e}"
+                yield path, waveform, error
@@ -0,0 +1,231 @@
+"""
+Qwen2-Audio 分析回复的解析，结果统一为 overview / speakers / interaction 结构
+
+文本格式：用一个预编译的正则找出【章节】和[说话人N]标记，一次遍历，标记之间的文本按所在状态
+（概览、某个说话人、交互特征）用预编译的按行正则填入结果，不再对每个说话人、每个特征分别搜索。
+JSON格式：模型按 RESPONSE_SCHEMA 直接输出JSON，校验通过后转换为相同的结构；
+JSON无法解析或不符合格式时回退到文本解析，并在 parse_error 中记录原因。
+"""
+
+import json
+import re
+from typing import Dict, List
+
+UNINTELLIGIBLE_MARK = "无法理解音频内容"
+UNINTELLIGIBLE_ERROR = "模型无法理解音频内容，可能是音频质量问题或格式不支持"
+
+MARKER_RE = re.compile(r'【([^】\n]*)】|\[说话人(\d+)\]')
+KEY_VALUE_RE = re.compile(r'^([^：:\n]*)[：:](.*)', re.MULTILINE)
+CODE_FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL)
+SPEAKER_ID_RE = re.compile(r'(\d+)')
+
+# 章节标题 -> 结果中的键
+SECTIONS = {"音频概览": "overview", "交互特征": "interaction"}
+# 说话人特征：(回复中键的结尾, 结果中的特征名)，按此顺序输出；"主要情绪"和"情绪"都归为情绪
+FEATURE_KEYS = (
+    ("声音特征", "声音特征"),
+    ("语速", "语速"),
+    ("语调", "语调"),
+    ("音高", "音高"),
+    ("情绪", "情绪"),
+    ("转录内容", "内容"),
+)
+_FEATURE_NAMES = dict(FEATURE_KEYS)
+# 一行的键以特征名结尾（冒号之前），值从冒号之后开始，后续既不以 -/• 开头、也不含冒号的行是续行
+FEATURE_RE = re.compile(
+    r'^[^：:\n]*?(' + '|'.join(suffix for suffix, _ in FEATURE_KEYS) + r')[ \t*]*[：:]'
+    r'(.*(?:\n(?![-•])[^：:\n]*)*)',
+    re.MULTILINE
+)
+# JSON中说话人的字段 -> 结果中的特征名
+JSON_FEATURE_KEYS = (
+    ("声音特征", "声音特征"),
+    ("语速", "语速"),
+    ("语调", "语调"),
+    ("音高", "音高"),
+    ("主要情绪", "情绪"),
+    ("转录内容", "内容"),
+)
+
+_TEXT = {"type": "string"}
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "required": ["overview", "speakers", "interaction"],
+    "properties": {
+        "overview": {
+            "type": "object",
+            "properties": {"总时长估计": _TEXT, "说话人数量": {"type": ["string", "integer"]}, "音频质量": _TEXT},
+        },
+        "speakers": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["id"],
+                "properties": dict({"id": _TEXT}, **{key: _TEXT for key, _ in JSON_FEATURE_KEYS}),
+            },
+        },
+        "interaction": {
+            "type": "object",
+            "properties": {"话轮模式": _TEXT, "互动特点": _TEXT},
+        },
+    },
+}
+
+_JSON_TYPES = {"object": dict, "array": list, "string": str, "integer": int, "number": (int, float)}
+
+
+def _clean_key(key: str) -> str:
+    return key.replace('-', '').replace('*', '').strip(' \t•')
+
+
+def _empty_result(response: str) -> Dict:
+    return {"overview": {}, "speakers": [], "interaction": {}, "raw_text": response}
+
+
+def _fill_key_values(values: Dict, text: str):
+    """章节内每行 "键：值"（值为空的行跳过，同名键后出现的覆盖先出现的）"""
+    for match in KEY_VALUE_RE.finditer(text):
+        key, value = _clean_key(match.group(1)), match.group(2).strip()
+        if key and value:
+            values[key] = value
+
+
+def _fill_features(features: Dict, text: str):
+    """说话人块内的特征，同一特征只取第一次出现，按 FEATURE_KEYS 的顺序输出"""
+    found = {}
+    for match in FEATURE_RE.finditer(text):
+        name = _FEATURE_NAMES[match.group(1)]
+        if name not in found:
+            found[name] = match.group(2).strip()
+    for _, name in FEATURE_KEYS:
+        if name in found:
+            features[name] = found[name]
+
+
+def parse_analysis(response: str) -> Dict:
+    """解析【音频概览】/【说话人分析】[说话人N]/【交互特征】格式的回复"""
+    result = _empty_result(response)
+    if UNINTELLIGIBLE_MARK in response:
+        result["error"] = UNINTELLIGIBLE_ERROR
+        return result
+
+    filled_sections = set()
+    fill, target = None, None
+    position = 0
+    for match in MARKER_RE.finditer(response):
+        if fill is not None:
+            fill(target, response[position:match.start()])
+        section, speaker_id = match.groups()
+        if speaker_id is not None:
+            target = {}
+            result["speakers"].append({"id": f"说话人{speaker_id}", "features": target})
+            fill = _fill_features
+        else:
+            # 概览和交互特征只取第一次出现的章节
+            key = SECTIONS.get(section.strip())
+            if key is not None and key not in filled_sections:
+                filled_sections.add(key)
+                fill, target = _fill_key_values, result[key]
+            else:
+                fill, target = None, None
+        position = match.end()
+    if fill is not None:
+        fill(target, response[position:])
+    return result
+
+
+def validate_response(data, schema: Dict = RESPONSE_SCHEMA, path: str = "$") -> List[str]:
+    """按 JSON Schema 的 type/required/properties/items 子集校验，返回错误列表（为空表示通过）"""
+    types = schema.get("type")
+    if types is not None:
+        names = [types] if isinstance(types, str) else types
+        if isinstance(data, bool) or not any(isinstance(data, _JSON_TYPES[name]) for name in names):
+            return [f"{path} 应为 {'/'.join(names)}"]
+
+    errors = []
+    if isinstance(data, dict):
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path} 缺少 {key}")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in data and data[key] is not None:
+                errors.extend(validate_response(data[key], subschema, f"{path}.{key}"))
+    elif isinstance(data, list) and "items" in schema:
+        for i, item in enumerate(data):
+            errors.extend(validate_response(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def response_template() -> str:
+    """由 RESPONSE_SCHEMA 生成提示词中的JSON示例"""
+    properties = RESPONSE_SCHEMA["properties"]
+    speaker = {key: "" for key in properties["speakers"]["items"]["properties"]}
+    speaker["id"] = "说话人1"
+    template = {
+        "overview": {key: "" for key in properties["overview"]["properties"]},
+        "speakers": [speaker],
+        "interaction": {key: "" for key in properties["interaction"]["properties"]},
+    }
+    return json.dumps(template, ensure_ascii=False, indent=2)
+
+
+def _json_text(response: str) -> str:
+    """
+    取出回复中的JSON：去掉代码块标记；生成时以 "{" 预填充，回复本身可能缺少开头的 "{"
+    """
+    text = response.strip()
+    fenced = CODE_FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    if text.startswith('"'):
+        text = '{' + text
+    elif not text.startswith('{') and '{' in text:
+        text = text[text.index('{'):]
+    end = text.rfind('}')
+    return text[:end + 1] if end >= 0 else text
+
+
+def _string_values(values: Dict) -> Dict:
+    result = {}
+    for key, value in values.items():
+        value = "" if value is None else str(value).strip()
+        if value:
+            result[key] = value
+    return result
+
+
+def _speaker_id(value, position: int) -> str:
+    match = SPEAKER_ID_RE.search(str(value or ""))
+    return f"说话人{match.group(1) if match else position}"
+
+
+def _from_json(data: Dict, response: str) -> Dict:
+    result = _empty_result(response)
+    result["overview"] = _string_values(data["overview"] or {})
+    result["interaction"] = _string_values(data["interaction"] or {})
+    for position, speaker in enumerate(data["speakers"] or [], 1):
+        values = _string_values({name: speaker.get(key) for key, name in JSON_FEATURE_KEYS})
+        result["speakers"].append({"id": _speaker_id(speaker.get("id"), position), "features": values})
+    return result
+
+
+def parse_json_analysis(response: str) -> Dict:
+    """解析按 RESPONSE_SCHEMA 输出的JSON回复；不合格时回退到文本解析并记录 parse_error"""
+    if UNINTELLIGIBLE_MARK in response:
+        result = _empty_result(response)
+        result["error"] = UNINTELLIGIBLE_ERROR
+        return result
+
+    try:
+        data = json.loads(_json_text(response))
+    except ValueError as e:
+        problem = f"JSON解析失败: {e}"
+    else:
+        errors = validate_response(data)
+        if not errors:
+            return _from_json(data, response)
+        problem = "JSON不符合格式要求: " + "; ".join(errors[:3])
+
+    result = parse_analysis(response)
+    result["parse_error"] = problem
+    return result
@@ -0,0 +1,159 @@
+"""
+音频分析回复解析器的基准测试
+
+从已保存的分析结果（<文件名>_analysis.json 中的 raw_text 及分段结果 chunks[].raw_response）
+或 --raw_dir 下的原始回复 .txt 中读取模型回复，比较：
+  - 旧解析器：每个章节、每个说话人、每个特征分别运行正则（按原意逐个特征匹配）
+  - 一次遍历解析器：audio_parser.parse_analysis
+  - JSON解析 + schema校验：audio_parser.parse_json_analysis，输入为同一内容按 RESPONSE_SCHEMA 写成的JSON
+报告每条回复的平均解析耗时，以及一次遍历解析器与旧解析器结果一致的比例。
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import time
+from typing import Dict, List
+
+from audio_parser import JSON_FEATURE_KEYS, parse_analysis, parse_json_analysis
+
+
+def legacy_parse_response(response: str) -> Dict:
+    """旧版 AudioAnalyzer._parse_response（修正了特征提取在第一个特征后就返回的问题）"""
+    result = {"overview": {}, "speakers": [], "interaction": {}, "raw_text": response}
+    if "无法理解音频内容" in response:
+        result["error"] = "模型无法理解音频内容，可能是音频质量问题或格式不支持"
+        return result
+
+    overview_match = re.search(r'【音频概览】(.*?)(?=【|$)', response, re.DOTALL)
+    if overview_match:
+        result["overview"] = legacy_extract_key_values(overview_match.group(1))
+
+    for match in re.finditer(r'\[说话人(\d+)\](.*?)(?=\[说话人|\【|$)', response, re.DOTALL):
+        result["speakers"].append({
+            "id": f"说话人{match.group(1)}",
+            "features": legacy_extract_speaker_features(match.group(2))
+        })
+
+    interaction_match = re.search(r'【交互特征】(.*?)(?=【|$)', response, re.DOTALL)
+    if interaction_match:
+        result["interaction"] = legacy_extract_key_values(interaction_match.group(1))
+    return result
+
+
+def legacy_extract_key_values(text: str) -> Dict:
+    result = {}
+    for line in text.strip().split('\n'):
+        if '：' in line or ':' in line:
+            parts = re.split('[：:]', line, 1)
+            if len(parts) == 2:
+                key = parts[0].strip().replace('-', '').strip()
+                value = parts[1].strip()
+                if key and value:
+                    result[key] = value
+    return result
+
+
+def legacy_extract_speaker_features(text: str) -> Dict:
+    features = {}
+    patterns = {
+        "声音特征": r'声音特征[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)',
+        "语速": r'语速[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)',
+        "语调": r'语调[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)',
+        "音高": r'音高[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)',
+        "情绪": r'(?:主要)?情绪[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)',
+        "内容": r'转录内容[：:](.*?)(?=\n[-•]|\n[^\n]*[：:]|$)'
+    }
+    for key, pattern in patterns.items():
+        match = re.search(pattern, text, re.DOTALL)
+        if match:
+            features[key] = match.group(1).strip()
+    return features
+
+
+def load_responses(results_dir: str, raw_dir: str = None) -> List[str]:
+    """读取已保存的原始回复"""
+    responses = []
+    if results_dir:
+        for path in sorted(glob.glob(os.path.join(results_dir, '*_analysis.json'))):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("raw_text"):
+                responses.append(data["raw_text"])
+            for chunk in data.get("chunks", []):
+                if chunk.get("raw_response"):
+                    responses.append(chunk["raw_response"])
+    if raw_dir:
+        for path in sorted(glob.glob(os.path.join(raw_dir, '*.txt'))):
+            with open(path, 'r', encoding='utf-8') as f:
+                responses.append(f.read())
+    return responses
+
+
+def to_json_response(parsed: Dict) -> str:
+    """把解析结果写成 JSON 格式的回复（去掉预填充的开头 "{"，与实际生成的回复一致）"""
+    data = {
+        "overview": parsed["overview"],
+        "speakers": [
+            dict({"id": speaker["id"]},
+                 **{key: speaker["features"][name] for key, name in JSON_FEATURE_KEYS if name in speaker["features"]})
+            for speaker in parsed["speakers"]
+        ],
+        "interaction": parsed["interaction"],
+    }
+    return json.dumps(data, ensure_ascii=False, indent=2)[1:]
+
+
+def _structure(result: Dict) -> tuple:
+    return (result.get("overview"), result.get("speakers"), result.get("interaction"), result.get("error"))
+
+
+def time_parser(parse, responses: List[str], repeats: int) -> float:
+    """每条回复的平均解析耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for response in responses:
+            parse(response)
+    return (time.perf_counter() - start) / (repeats * len(responses)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='音频分析回复解析器的基准测试')
+    parser.add_argument('--results_dir', type=str, default='./audio_analysis_results', help='audio.py 的结果目录（读取 *_analysis.json）')
+    parser.add_argument('--raw_dir', type=str, default=None, help='原始回复 .txt 所在目录（可选）')
+    parser.add_argument('--repeats', type=int, default=200, help='重复解析的轮数，默认200')
+    args = parser.parse_args()
+
+    responses = load_responses(args.results_dir, args.raw_dir)
+    if not responses:
+        print(f"❌ 没有找到已保存的回复: {args.results_dir} {args.raw_dir or ''}")
+        return
+
+    parsed = [parse_analysis(response) for response in responses]
+    agree = sum(_structure(new) == _structure(legacy_parse_response(response))
+                for new, response in zip(parsed, responses))
+    json_responses = [to_json_response(result) for result in parsed if "error" not in result]
+    json_results = [parse_json_analysis(response) for response in json_responses]
+    json_agree = sum(_structure(result) == _structure(new) and "parse_error" not in result
+                     for result, new in zip(json_results, (p for p in parsed if "error" not in p)))
+
+    legacy_us = time_parser(legacy_parse_response, responses, args.repeats)
+    one_pass_us = time_parser(parse_analysis, responses, args.repeats)
+    json_us = time_parser(parse_json_analysis, json_responses, args.repeats) if json_responses else 0.0
+
+    print("=" * 60)
+    print(f"回复数: {len(responses)}，平均长度 {sum(map(len, responses)) / len(responses):.0f} 字符，重复 {args.repeats} 轮")
+    print("=" * 60)
+    print(f"旧解析器（逐特征正则）: {legacy_us:8.1f} 微秒/条")
+    print(f"一次遍历解析器:         {one_pass_us:8.1f} 微秒/条  ({legacy_us / one_pass_us:.1f}x)")
+    if json_responses:
+        print(f"JSON解析+schema校验:    {json_us:8.1f} 微秒/条  ({legacy_us / json_us:.1f}x)")
+    print(f"\n一次遍历解析器与旧解析器结果一致: {agree}/{len(responses)}")
+    if json_responses:
+        print(f"JSON回复解析结果与文本解析一致: {json_agree}/{len(json_responses)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+提示词前缀KV缓存的首token延迟（TTFT）基准测试
+
+对每个音频文件的前30秒分别测量：
+  - 原始结构：音频在前、分析提示词在后，无缓存
+  - 前缀结构：分析提示词在前、音频在后，每段单遍预填充整个输入，不使用前缀KV（只改变结构的影响）
+  - 前缀结构 + KV缓存：提示词前缀只预填充一次，之后每段只预填充音频及之后的token
+每次只生成1个token，测得的时间即为预填充 + 第一个解码步。
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import time
+
+import torch
+
+from audio import AudioAnalyzer
+from audio_chunks import MAX_CHUNK_SECONDS
+
+AUDIO_EXTENSIONS = ('*.wav', '*.mp3', '*.flac', '*.m4a', '*.ogg')
+
+
+def _synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def time_to_first_token(analyzer: AudioAnalyzer, audio_data, sample_rate: int, reuse_cache: bool = True) -> float:
+    """
+    生成1个token的耗时（秒）
+    reuse_cache 为False时直接调用 _generate_responses：按当前结构（use_prefix_cache 决定）对整段输入做一次预填充，
+    不经过前缀KV缓存
+    """
+    _synchronize()
+    start = time.perf_counter()
+    if reuse_cache:
+        analyzer._generate_response(audio_data, sample_rate, "", max_new_tokens=1)
+    else:
+        analyzer._generate_responses([audio_data], sample_rate, [""], max_new_tokens=1)
+    _synchronize()
+    return time.perf_counter() - start
+
+
+def token_counts(analyzer: AudioAnalyzer, audio_data, sample_rate: int):
+    """前缀结构下 (前缀token数, 前缀之后的token数)"""
+    input_ids = analyzer._processor_inputs([audio_data], sample_rate, [""]).input_ids[0]
+    audio_bos_id = analyzer.processor.tokenizer.convert_tokens_to_ids("<|audio_bos|>")
+    prefix_len = int((input_ids == audio_bos_id).nonzero()[0])
+    return prefix_len, len(input_ids) - prefix_len
+
+
+def run_mode(analyzer: AudioAnalyzer, clips, sample_rate: int, layout: str, reuse_cache: bool):
+    """
+    layout 为 original 或 prefix；reuse_cache 时先用第一段预热（计算前缀KV），再逐段计时
+    不复用缓存时每段都是一次完整的单遍预填充：前缀结构的对话与缓存模式完全相同，只是不使用前缀KV
+    """
+    analyzer.enable_prefix_cache(layout == 'prefix')
+    if reuse_cache:
+        time_to_first_token(analyzer, clips[0], sample_rate)
+
+    return [time_to_first_token(analyzer, audio_data, sample_rate, reuse_cache) for audio_data in clips]
+
+
+def format_timings(name: str, timings) -> str:
+    ms = [t * 1000 for t in timings]
+    return f"{name:<20} 平均 {statistics.mean(ms):8.1f} ms | 中位数 {statistics.median(ms):8.1f} ms | 片段数 {len(ms)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='提示词前缀KV缓存的首token延迟基准测试')
+    parser.add_argument('--audio_path', type=str, required=True, help='音频文件路径或包含音频文件的目录')
+    parser.add_argument('--model_dir', type=str, default='', help='模型目录路径，如果为空则自动下载')
+    parser.add_argument('--max_files', type=int, default=10, help='最多测试的文件数，默认10')
+    parser.add_argument('--repeats', type=int, default=1, help='每种模式重复测量的轮数，默认1')
+    parser.add_argument('--decode_cache_dir', type=str, default='./.cache/audio', help='解码后波形(.npy)的缓存目录')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.audio_path):
+        audio_files = sorted(f for ext in AUDIO_EXTENSIONS for f in glob.glob(os.path.join(args.audio_path, ext)))
+    else:
+        audio_files = [args.audio_path]
+    audio_files = audio_files[:args.max_files]
+    if not audio_files:
+        print(f"❌ 没有找到音频文件: {args.audio_path}")
+        return
+
+    analyzer = AudioAnalyzer(model_dir=args.model_dir, decode_cache_dir=args.decode_cache_dir)
+    sample_rate = analyzer.processor.feature_extractor.sampling_rate
+    clips = [analyzer._load_audio(path)[0][:int(MAX_CHUNK_SECONDS * sample_rate)] for path in audio_files]
+    print(f"测试文件数: {len(clips)}（每个文件取前 {MAX_CHUNK_SECONDS:.0f} 秒）")
+
+    # 预热：加载CUDA内核，避免第一次调用的开销计入第一种模式
+    analyzer.enable_prefix_cache(False)
+    time_to_first_token(analyzer, clips[0], sample_rate)
+
+    modes = [
+        ('原始结构', 'original', False),
+        ('前缀结构(无缓存)', 'prefix', False),
+        ('前缀结构+KV缓存', 'prefix', True),
+    ]
+    results = {name: [] for name, _, _ in modes}
+    for _ in range(args.repeats):
+        for name, layout, reuse_cache in modes:
+            results[name].extend(run_mode(analyzer, clips, sample_rate, layout, reuse_cache))
+        if not analyzer.use_prefix_cache:
+            print("⚠️  前缀缓存不可用（见上方提示），前缀结构的结果等同于原始结构")
+
+    print("\n" + "=" * 60)
+    print("首token延迟 (TTFT)")
+    print("=" * 60)
+    for name, _, _ in modes:
+        print(format_timings(name, results[name]))
+    if analyzer.use_prefix_cache:
+        prefix_len, suffix_len = token_counts(analyzer, clips[0], sample_rate)
+        print(f"\n前缀token数: {prefix_len}，每段需预填充的token数（音频及之后）: {suffix_len}")
+        print(f"前缀KV一次性计算耗时: {analyzer.prefix_build_seconds * 1000:.1f} ms")
+        baseline = statistics.mean(results['原始结构'])
+        cached = statistics.mean(results['前缀结构+KV缓存'])
+        print(f"缓存模式相对原始结构: {(1 - cached / baseline) * 100:.1f}% 的TTFT降低")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import re
+
+_CJK_RE = re.compile(r"[　-〿一-鿿＀-￯]")
+
+
+def estimate_tokens(text):
+    """粗略估计token数：中日韩字符按1个token计，其余字符按4个字符1个token计"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _shorten(text, max_chars):
+    text = re.sub(r"\s+", " ", str(text)).strip()
+    return text if len(text) <= max_chars else text[: max_chars - 1] + "…"
+
+
+class CompactEventContext:
+    """
+    事件池的紧凑摘要，用作每个窗口提示词中的历史事件。
+
+    每个事件只保留编号、完整事件名称和最近几次情绪（state + 截断后的reason），不包含句子原文。
+    合并窗口结果时增量更新，渲染时优先保留最近更新的事件，总长度不超过 token_budget，
+    因此无论对话多长，窗口提示词的大小基本不变。
+    """
+
+    HEADER = "（摘要格式：[事件编号] 事件名称 | 最近情绪。延续已有事件时请使用完全相同的事件名称）"
+
+    def __init__(self, token_budget=1500, max_emotions_per_event=2, max_reason_chars=30):
+        self.token_budget = token_budget
+        self.max_emotions_per_event = max_emotions_per_event
+        self.max_reason_chars = max_reason_chars
+        self._entries = {}  # (holder, event_name) -> [event_id, line, tokens, last_update]
+        self._clock = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, holder, event_name, emotions):
+        """记录某个事件的最新状态（新建或合并后调用）"""
+        self._clock += 1
+        key = (str(holder), event_name)
+        entry = self._entries.get(key)
+        event_id = entry[0] if entry else f"E{len(self._entries) + 1}"
+
+        recent = []
+        for emotion in list(emotions)[-self.max_emotions_per_event :]:
+            if not isinstance(emotion, dict):
+                continue
+            state = emotion.get("state", "")
+            reason = _shorten(emotion.get("reason", ""), self.max_reason_chars)
+            recent.append(f"{state}({reason})" if reason else str(state))
+        line = f"[{event_id}] {event_name}"
+        if recent:
+            line += " | " + "; ".join(recent)
+        self._entries[key] = [event_id, line, estimate_tokens(line), self._clock]
+
+    def render(self):
+        """按说话人分组渲染摘要，超出预算时丢弃最久未更新的事件"""
+        if not self._entries:
+            return "{}"
+
+        selected = []
+        holders = set()
+        # 预留标题行和“未列出”提示行
+        used = estimate_tokens(self.HEADER) + 12
+        for key, (_, line, tokens, _) in sorted(self._entries.items(), key=lambda kv: -kv[1][3]):
+            cost = tokens + 1 + (0 if key[0] in holders else estimate_tokens(f"说话人{key[0]}:") + 1)
+            if used + cost > self.token_budget:
+                continue
+            selected.append(key)
+            holders.add(key[0])
+            used += cost
+
+        omitted = len(self._entries) - len(selected)
+        by_holder = {}
+        for holder, event_name in selected:
+            by_holder.setdefault(holder, []).append(self._entries[(holder, event_name)])
+
+        lines = [self.HEADER]
+        for holder in sorted(by_holder, key=str):
+            lines.append(f"说话人{holder}:")
+            for event_id, line, _, _ in sorted(by_holder[holder], key=lambda e: int(e[0][1:])):
+                lines.append(f"  {line}")
+        if omitted:
+            lines.append(f"（另有{omitted}个较早的事件未列出）")
+        return "\n".join(lines)
+
+
+def normalize_event_name(name):
+    """事件名规范化（去掉空白、统一大小写），作为合并事件的索引键"""
+    return re.sub(r"\s+", "", str(name)).casefold()
+
+
+class EventPool:
+    """
+    按 说话人 -> 规范化事件名 -> 事件 索引的事件池。
+
+    合并新事件是一次字典查找，句子编号保存在集合中；句子原文只在 to_dict 输出时才生成。
+    如果提供了 context（CompactEventContext），每次合并后同步更新摘要。
+    """
+
+    def __init__(self, context=None):
+        self.holders = {}
+        self.context = context
+
+    def events(self, holder):
+        return self.holders.setdefault(str(holder), {})
+
+    def iter_events(self):
+        for holder, events in self.holders.items():
+            for event in events.values():
+                yield holder, event
+
+    def merge_event(self, holder, new_event, offset=0):
+        """合并一个窗口内的事件；sentence_ids 会从窗口内编号转换为全局编号（原地写回 new_event）"""
+        new_event["sentence_ids"] = [offset + idx for idx in new_event.get("sentence_ids", [])]
+        events = self.events(holder)
+        key = normalize_event_name(new_event["event"])
+        event = events.get(key)
+        if event is None:
+            event = {k: v for k, v in new_event.items() if k not in ("emotions", "sentence_ids", "sentences")}
+            event["emotions"] = []
+            event["sentence_ids"] = set()
+            events[key] = event
+        event["emotions"].extend(new_event["emotions"])
+        event["sentence_ids"].update(new_event["sentence_ids"])
+        if self.context is not None:
+            self.context.update(holder, event["event"], event["emotions"])
+        return event
+
+    def to_dict(self, dialogues, include_sentence_ids=True):
+        """输出为原本的 {说话人: {"events": [...]}} 结构，并在此时才生成句子原文"""
+        output = {}
+        for holder, events in self.holders.items():
+            holder_events = []
+            for event in events.values():
+                sentence_ids = sorted(event["sentence_ids"])
+                item = {k: v for k, v in event.items() if k != "sentence_ids"}
+                if include_sentence_ids:
+                    item["sentence_ids"] = sentence_ids
+                item["sentences"] = [
+                    dialogues[idx]["input_sentence"] for idx in sentence_ids if 0 <= idx < len(dialogues)
+                ]
+                holder_events.append(item)
+            output[holder] = {"events": holder_events}
+        return output
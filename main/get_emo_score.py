@@ -4,101 +4,89 @@ import json
 import os
 import re
 
-from openai import OpenAI
+import numpy as np
 from tqdm import tqdm
 
-from utils import call_embedding, cosine_similarity, load_json, load_yaml_config
+from judge import LLMJudge
+from utils import (
+    MATCH_MODES,
+    assign_matches,
+    call_embedding,
+    cosine_similarity_matrix,
+    load_json,
+    load_yaml_config,
+    set_embedding_cache,
+)
 
 
-async def judge_similarity_with_llm(text_a, text_b, judge_config):
-    """
-    Use the LLM specified in judge_config to determine if text_a and text_b are similar, and return 0 or 1.
+def as_emotion_list(pred_emotions):
+    """Predictions sometimes store a single emotion dict instead of a list."""
+    if type(pred_emotions) is dict:
+        pred_emotions = [pred_emotions]
+    return [e for e in pred_emotions if e]
 
-    Note: If the LLM does not return a number or provides additional explanations, it will be rated 0 points.
-    Therefore, a LLM with stronger instruction-following capabilities and a larger weight should be used.
-    In this work, we used the [GLM-4-Plus](https://arxiv.org/abs/2406.12793).
 
-    Changing the LLM may affect the actual score evaluation, and a certain range of error is considered normal.
+class EmbeddingIndex:
     """
-    messages = [
-        {
-            "role": "system",
-            "content": """
-你是一个负责对比两个文本的评测器。
-我会给你两个文本A和B，你需要判断它们语义是否相似，或者在描述一个相似的态度和事件。
-如果语义基本一致或高度近似(意思相或者目标相同)，请输出1，否则输出0。只需要输出一个数字0或1，不要输出其他解释。
-
-### 注意
-- 输出只有一个数字，没有其他内容。
-- 如果两个句子相似，则输出数字 1，否则输出数字 0。
-
-### 输入示例
-
-文本A: 我爱吃苹果
-文本B: 我觉得苹果很好吃
-请判断是否相似(0或1):
-
-### 输出示例
-
-1
-
-""",
-        },
-        {
-            "role": "user",
-            "content": f"文本A: {text_a}\n文本B: {text_b}\n请判断是否相似(0或1):",
-        },
-    ]
-    client = OpenAI(api_key=judge_config["api_key"], base_url=judge_config["base_url"])
-
-    response = await asyncio.to_thread(
-        client.chat.completions.create, model=judge_config["model"], messages=messages, temperature=0.0
-    )
-    content = response.choices[0].message.content.strip()
-    val = int(content)
-    return 1 if val == 1 else 0
+    Normalized embedding matrix over every unique event / reason string of one evaluation file.
 
+    All strings are embedded once up front (in 64-item chunks, see `call_embedding`), so matching reduces to
+    cosine-similarity matrix products instead of per-GT-item embedding calls.
+    """
 
-async def match_event(gt_event_text, pred_events, embed_config, judge_config, event_threshold=0.3):
+    def __init__(self, texts, embed_config):
+        self.texts = list(dict.fromkeys(texts))
+        self.rows = {text: i for i, text in enumerate(self.texts)}
+        if self.texts:
+            self.matrix = np.stack(call_embedding(self.texts, **embed_config))
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @classmethod
+    def from_chain(cls, gt_data, pred_data, embed_config):
+        texts = []
+        for data in (gt_data, pred_data):
+            for person_info in data.values():
+                for ev in person_info.get("events", []):
+                    texts.append(ev.get("event", ""))
+                    texts.extend(e.get("reason", "") for e in as_emotion_list(ev.get("emotions", [])))
+        return cls(texts, embed_config)
+
+    def similarity(self, texts_a, texts_b):
+        """Return the len(texts_a) x len(texts_b) cosine-similarity matrix."""
+        if not texts_a or not texts_b:
+            return np.zeros((len(texts_a), len(texts_b)), dtype=np.float32)
+        a = self.matrix[[self.rows[t] for t in texts_a]]
+        b = self.matrix[[self.rows[t] for t in texts_b]]
+        return cosine_similarity_matrix(a, b)
+
+
+async def match_event(gt_event_text, pred_event, similarity, judge, event_threshold=0.3):
     """
-    Calculate and match event similarity, and return the most similar event along with its similarity score.
-    1. Determine the number of events and split the weight based on the quantity.
-    2. Use embedding and LLM models to match the most similar event.
+    Score the prediction event assigned to a GT event (see `assign_matches`) and return it with its similarity scores.
+    1. The assignment on the GT x pred embedding similarity matrix picks the candidate event.
+    2. Use the LLM model to judge the candidate.
     Return two scores: embedding score and LLM score.
 
     Note: The default value of event_threshold=0.3 makes it easy to compare two events with some similarity. In this work, this is done to allow answers from the large model to enter the event pool for matching, as the events generated by the large model often have some differences compared to the ground truth (GT).
     This could lead to potential drawbacks, as it might not fully filter out irrelevant events, which often causes the LLM’s scores to be higher than expected.
     """
-    if not pred_events:
+    if pred_event is None:
         return None, 0.0, 0.0
 
-    texts_to_embed = [gt_event_text] + [pe["event"] for pe in pred_events]
-    embs = call_embedding(texts_to_embed, **embed_config)
-    gt_emb = embs[0]
-    pred_embs = embs[1:]
-
-    best_sim = 0.0
-    best_event = None
-    for i, pred_ev in enumerate(pred_events):
-        sim = cosine_similarity(gt_emb, pred_embs[i])
-        if sim > best_sim:
-            best_sim = sim
-            best_event = pred_ev
-
-    llm_sim = 0
-    if best_event is not None:
-        llm_sim = await judge_similarity_with_llm(gt_event_text, best_event["event"], judge_config)
+    best_sim = float(similarity)
+    llm_sim = await judge.judge(gt_event_text, pred_event["event"])
 
     if best_sim < event_threshold and llm_sim < event_threshold:
         return None, 0.0, 0.0
     else:
-        return best_event, best_sim, llm_sim
+        return pred_event, best_sim, llm_sim
 
 
-async def match_emotion(gt_emotion, pred_emotions, embed_config, judge_config):
+async def match_emotion(gt_emotion, pred_emotions, similarities, judge):
     """
     Match sentiment, evaluate state, reason, and source_id.
-    1. Use embedding model to calculate the similarity of reason.
+    1. Use the precomputed embedding similarities of the reasons (aligned with pred_emotions).
     2. Use LLM model to determine reason similarity and return two scores.
     """
     gt_state = gt_emotion["state"]
@@ -117,40 +105,21 @@ async def match_emotion(gt_emotion, pred_emotions, embed_config, judge_config):
         "reason_embed_score": 0,
         "reason_llm_score": 0,
     }
-    if type(pred_emotions) is dict:
-        pred_emotions = [pred_emotions]
-    if len(pred_emotions) == 1 and pred_emotions[0] == {}:
+    if not pred_emotions:
         return emo_res, 0
 
     matched_idx = None
 
-    max_length = 64
-    texts_to_embed = [gt_reason] + [e["reason"] for e in pred_emotions]
-
-    def chunk_texts(texts, max_length):
-        return [texts[i : i + max_length] for i in range(0, len(texts), max_length)]
-
-    chunked_texts = chunk_texts(texts_to_embed, max_length)
-    embeddings = []
-
-    # FIXME: ZhipuAI Embedding-3 API Only supports 64 groups of text, so we need to split the text into chunks.
-    for chunk in chunked_texts:
-        embs = call_embedding(chunk, **embed_config)
-        embeddings.extend(embs)  # Append the embeddings from each chunk
-    gt_emb = embeddings[0]
-    pred_embs = embeddings[1:]
-
     best_sim = 0.0
     best_pair = None
-    for i, pred_emo in enumerate(pred_emotions):
-        sim = cosine_similarity(gt_emb, pred_embs[i])
-        if sim > best_sim:
-            best_sim = sim
-            best_pair = (i, pred_emo)
+    best_idx = int(np.argmax(similarities))
+    if similarities[best_idx] > best_sim:
+        best_sim = float(similarities[best_idx])
+        best_pair = (best_idx, pred_emotions[best_idx])
 
     if best_pair:
         matched_idx, best_pred_emo = best_pair
-        llm_reason_sim = await judge_similarity_with_llm(gt_reason, best_pred_emo["reason"], judge_config)
+        llm_reason_sim = await judge.judge(gt_reason, best_pred_emo["reason"])
 
         # FIXME: llm_reason only has two cases, 0 and 1. This can be optimized in the future by adding embedding computation.
         if llm_reason_sim > 0:
@@ -177,7 +146,48 @@ async def match_emotion(gt_emotion, pred_emotions, embed_config, judge_config):
     return emo_res, matched_idx
 
 
-async def evaluate_chain(gt_data, pred_data, embed_config, judge_config, event_threshold=0.7):
+async def evaluate_event(gt_ev, pred_event, similarity, embedding_index, judge, event_threshold):
+    """Match one GT event and all of its emotions; the emotion matches run concurrently."""
+    gt_event_text = gt_ev["event"]
+    best_pred_event, event_sim, llm_sim = await match_event(
+        gt_event_text, pred_event, similarity, judge, event_threshold
+    )
+
+    emo_matches = []
+    if best_pred_event:
+        gt_emotions = gt_ev.get("emotions", [])
+        pred_emotions = as_emotion_list(best_pred_event.get("emotions", []))
+        reason_sims = embedding_index.similarity(
+            [gt_em["reason"] for gt_em in gt_emotions], [e.get("reason", "") for e in pred_emotions]
+        )
+        emo_results = await asyncio.gather(
+            *(
+                match_emotion(gt_em, pred_emotions, reason_sims[em_idx], judge)
+                for em_idx, gt_em in enumerate(gt_emotions)
+            )
+        )
+        emo_matches = [emo_res for emo_res, _ in emo_results]
+
+    return {
+        "gt_event": gt_event_text,
+        "pred_event_matched": best_pred_event["event"] if best_pred_event else None,
+        "event_similarity": event_sim,
+        "event_score": event_sim if best_pred_event else 0,
+        "llm_event_score": llm_sim if best_pred_event else 0,
+        "emotions": emo_matches,
+    }
+
+
+async def evaluate_chain(
+    gt_data, pred_data, embed_config, judge, event_threshold=0.7, match_mode="independent"
+):
+    """
+    Evaluate one prediction file against its GT.
+
+    Every (role, event, emotion) match of the file is scheduled at once; the number of judge requests in
+    flight is bounded by the judge's own concurrency limit. Scores are accumulated afterwards in GT order,
+    so results do not depend on completion order.
+    """
     details = {}
     total_state_score = 0.0
     total_source_id_score = 0.0
@@ -185,16 +195,39 @@ async def evaluate_chain(gt_data, pred_data, embed_config, judge_config, event_t
     total_reason_mbed_score = 0.0
     total_possible_score = 0.0
 
+    embedding_index = EmbeddingIndex.from_chain(gt_data, pred_data, embed_config)
+
     gt_roles = list(gt_data.keys())
+    role_tasks = []
     for role in gt_roles:
-        gt_person_info = gt_data[role]
-        pred_person_info = pred_data.get(role, {"events": []})
-        gt_events = gt_person_info.get("events", [])
-        pred_events = pred_person_info.get("events", [])
+        gt_events = gt_data[role].get("events", [])
+        pred_events = pred_data.get(role, {"events": []}).get("events", [])
 
-        num_gt_events = len(gt_events)
+        event_sims = embedding_index.similarity(
+            [gt_ev["event"] for gt_ev in gt_events], [pe.get("event", "") for pe in pred_events]
+        )
+        min_similarity = event_threshold if match_mode == "greedy" else 0.0
+        assignment = assign_matches(event_sims, mode=match_mode, min_similarity=min_similarity)
+
+        role_tasks.append(
+            asyncio.gather(
+                *(
+                    evaluate_event(
+                        gt_ev,
+                        pred_events[assignment[gt_idx]] if assignment[gt_idx] >= 0 else None,
+                        event_sims[gt_idx, assignment[gt_idx]] if assignment[gt_idx] >= 0 else 0.0,
+                        embedding_index,
+                        judge,
+                        event_threshold,
+                    )
+                    for gt_idx, gt_ev in enumerate(gt_events)
+                )
+            )
+        )
+    role_results = await asyncio.gather(*role_tasks)
 
-        event_details = []
+    for role, event_details in zip(gt_roles, role_results):
+        num_gt_events = len(event_details)
 
         total_role_state_score = 0.0
         total_role_source_id_score = 0.0
@@ -204,44 +237,18 @@ async def evaluate_chain(gt_data, pred_data, embed_config, judge_config, event_t
 
         total_role_possible_score = 0.0
 
-        for gt_ev in gt_events:
-            gt_event_text = gt_ev["event"]
-            best_pred_event, event_sim, llm_sim = await match_event(
-                gt_event_text, pred_events, embed_config, judge_config, event_threshold
-            )
-
-            event_score = event_sim if best_pred_event else 0
-            llm_event_score = llm_sim if best_pred_event else 0
-
-            emo_matches = []
-            num_emotions = len(gt_ev.get("emotions", []))
-
-            if best_pred_event:
-                for gt_em in gt_ev.get("emotions", []):
-                    emo_res, _ = await match_emotion(
-                        gt_em, best_pred_event.get("emotions", []), embed_config, judge_config
-                    )
-                    emo_matches.append(emo_res)
-
-                    total_role_state_score += emo_res["state_score"] / num_emotions / num_gt_events
-                    total_role_source_id_score += emo_res["source_id_score"] / num_emotions / num_gt_events
-                    total_role_reason_llm_score += emo_res["reason_llm_score"] / num_emotions / num_gt_events
-                    total_role_reason_embed_score += emo_res["reason_embed_score"] / num_emotions / num_gt_events
-
-            event_details.append(
-                {
-                    "gt_event": gt_event_text,
-                    "pred_event_matched": best_pred_event["event"] if best_pred_event else None,
-                    "event_similarity": event_sim,
-                    "event_score": event_score,
-                    "llm_event_score": llm_event_score,
-                    "emotions": emo_matches,
-                }
-            )
+        for event_detail in event_details:
+            emo_matches = event_detail["emotions"]
+            num_emotions = len(emo_matches)
+            for emo_res in emo_matches:
+                total_role_state_score += emo_res["state_score"] / num_emotions / num_gt_events
+                total_role_source_id_score += emo_res["source_id_score"] / num_emotions / num_gt_events
+                total_role_reason_llm_score += emo_res["reason_llm_score"] / num_emotions / num_gt_events
+                total_role_reason_embed_score += emo_res["reason_embed_score"] / num_emotions / num_gt_events
 
             total_role_possible_score += 1 / num_gt_events
 
-        details[role] = {"events": event_details}
+        details[role] = {"events": list(event_details)}
 
         total_state_score += total_role_state_score
         total_source_id_score += total_role_source_id_score
@@ -279,6 +286,89 @@ async def evaluate_chain(gt_data, pred_data, embed_config, judge_config, event_t
     }
 
 
+SCORE_KEYS = (
+    "total_state_score_percentage",
+    "total_source_id_score_percentage",
+    "total_reason_llm_score_percentage",
+    "total_reason_embed_score_percentage",
+)
+
+
+class ResultsLedger:
+    """
+    Append-only JSONL record of finished evaluation files, flushed as each file completes.
+
+    The ledger, not the in-memory run, is the source of truth for summary.json, so an interrupted
+    evaluation resumes with correct totals.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, record):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def __iter__(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut off by an interrupted write; that file is simply evaluated again.
+                    continue
+
+
+class ScoreAggregator:
+    """Running per-metric sums over ledger records; a re-evaluated file replaces its earlier record."""
+
+    def __init__(self):
+        self.sums = dict.fromkeys(SCORE_KEYS, 0.0)
+        self.scores = {}
+
+    @classmethod
+    def from_ledger(cls, ledger):
+        aggregator = cls()
+        for record in ledger:
+            aggregator.add(record)
+        return aggregator
+
+    def add(self, record):
+        idx = str(record["idx"])
+        previous = self.scores.get(idx)
+        if previous is not None:
+            for key, value in zip(SCORE_KEYS, previous):
+                self.sums[key] -= value
+        values = tuple(record[key] for key in SCORE_KEYS)
+        for key, value in zip(SCORE_KEYS, values):
+            self.sums[key] += value
+        self.scores[idx] = values
+
+    def __contains__(self, idx):
+        return str(idx) in self.scores
+
+    def __len__(self):
+        return len(self.scores)
+
+    def summary(self):
+        count = len(self.scores)
+        return {
+            "average_score": {key: round(self.sums[key] / count, 2) if count else 0.0 for key in SCORE_KEYS},
+            "details": [
+                {"data_set": f"data_{idx}", **dict(zip(SCORE_KEYS, self.scores[idx]))}
+                for idx in sorted(self.scores, key=int)
+            ],
+        }
+
+
+def make_ledger_record(idx, pred_file_path, total_score):
+    return {"idx": idx, "pred_file": os.path.basename(pred_file_path), **{key: total_score[key] for key in SCORE_KEYS}}
+
+
 async def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--gt_dir", type=str, required=True, help="GT folder (contains emo_event_x.json)")
@@ -295,11 +385,59 @@ async def main():
     parser.add_argument("--llm_model", type=str, default="zhipu", help="LLM model name (corresponds to config.yaml)")
     parser.add_argument("--batch", type=int, default=4, help="Maximum number of concurrent processes")
     parser.add_argument("--event_threshold", type=float, default=0.3, help="Event matching threshold")
+    parser.add_argument(
+        "--match_mode",
+        type=str,
+        default="independent",
+        choices=MATCH_MODES,
+        help="Event assignment: independent argmax per GT event (original), one-to-one greedy above "
+        "--event_threshold, or one-to-one hungarian",
+    )
+    parser.add_argument(
+        "--embedding_cache",
+        type=str,
+        default=".cache/embeddings.sqlite",
+        help="On-disk embedding cache shared across runs (empty string disables caching)",
+    )
+    parser.add_argument(
+        "--judge_cache",
+        type=str,
+        default=".cache/judge_verdicts.sqlite",
+        help="On-disk LLM judge verdict cache (empty string disables caching)",
+    )
+    parser.add_argument(
+        "--judge_pack_size", type=int, default=1, help="Number of text pairs packed into one judge prompt"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Maximum number of judge requests in flight across all files and matches",
+    )
+    parser.add_argument(
+        "--judge_rps", type=float, default=0, help="Judge requests per second (token bucket, 0 means unlimited)"
+    )
     args = parser.parse_args()
 
     os.makedirs(args.output_dir, exist_ok=True)
+    embedding_cache = set_embedding_cache(args.embedding_cache or None)
     embed_config = load_yaml_config(args.config_path, args.embedding_model, config_type="embed_config")
     judge_config = load_yaml_config(args.config_path, args.llm_model, config_type="llm_config")
+    judge = LLMJudge(
+        judge_config,
+        cache_path=args.judge_cache or None,
+        pack_size=args.judge_pack_size,
+        requests_per_second=args.judge_rps or None,
+        max_concurrency=args.concurrency,
+    )
+
+    ledger = ResultsLedger(os.path.join(args.output_dir, "results.jsonl"))
+    aggregator = ScoreAggregator.from_ledger(ledger)
+    summary_path = os.path.join(args.output_dir, "summary.json")
+
+    def write_summary():
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(aggregator.summary(), f, ensure_ascii=False, indent=2)
 
     file_pairs = []
     for f in os.listdir(args.input_dir):
@@ -309,85 +447,53 @@ async def main():
             pred_file_path = os.path.join(args.input_dir, f)
             gt_file_path = os.path.join(args.gt_dir, f"chat_{idx}.json")
             out_file_path = os.path.join(args.output_dir, f"evaluation_{idx}.json")
-            if not os.path.exists(gt_file_path) or os.path.exists(out_file_path):
+            if not os.path.exists(gt_file_path):
                 print(f"[WARN] Skipping {f}")
                 continue
-            file_pairs.append((gt_file_path, pred_file_path, out_file_path))
+            if os.path.exists(out_file_path):
+                if idx not in aggregator:
+                    # Evaluated by a run that predates the ledger: backfill it so the summary stays complete.
+                    record = make_ledger_record(idx, pred_file_path, load_json(out_file_path)["total_score"])
+                    ledger.append(record)
+                    aggregator.add(record)
+                print(f"[INFO] Skipping {f} (already evaluated)")
+                continue
+            file_pairs.append((idx, gt_file_path, pred_file_path, out_file_path))
 
-    file_pairs.sort(key=lambda x: int(re.search(r"emotions_(\d+)", x[1]).group(1)))
+    file_pairs.sort(key=lambda x: int(x[0]))
     sem = asyncio.Semaphore(args.batch)
-    all_state_percentages = []
-    all_source_id_percentages = []
-    all_reason_llm_percentages = []
-    all_reason_embed_percentages = []
 
-    async def sem_wrapper(g_fp, p_fp, o_fp, pbar):
+    async def sem_wrapper(idx, g_fp, p_fp, o_fp, pbar):
         async with sem:
             result = await evaluate_chain(
                 load_json(g_fp),
                 load_json(p_fp),
                 embed_config,
-                judge_config,
+                judge,
                 event_threshold=args.event_threshold,
+                match_mode=args.match_mode,
             )
             with open(o_fp, "w", encoding="utf-8") as f:
                 json.dump(result, f, ensure_ascii=False, indent=2)
 
-            total_score = result["total_score"]
-            all_state_percentages.append(total_score["total_state_score_percentage"])
-            all_source_id_percentages.append(total_score["total_source_id_score_percentage"])
-            all_reason_llm_percentages.append(total_score["total_reason_llm_score_percentage"])
-            all_reason_embed_percentages.append(total_score["total_reason_embed_score_percentage"])
+            record = make_ledger_record(idx, p_fp, result["total_score"])
+            ledger.append(record)
+            aggregator.add(record)
 
             pbar.update(1)
-            return result
-
-    with tqdm(total=len(file_pairs), desc="Evaluating") as pbar:
-        tasks = [asyncio.create_task(sem_wrapper(g, p, o, pbar)) for g, p, o in file_pairs]
-        await asyncio.gather(*tasks)
-
-    average_state_percentage = (
-        round(sum(all_state_percentages) / len(all_state_percentages), 2) if all_state_percentages else 0.0
-    )
-    average_source_id_percentage = (
-        round(sum(all_source_id_percentages) / len(all_source_id_percentages), 2) if all_source_id_percentages else 0.0
-    )
-    average_reason_llm_percentage = (
-        round(sum(all_reason_llm_percentages) / len(all_reason_llm_percentages), 2)
-        if all_reason_llm_percentages
-        else 0.0
-    )
-    average_reason_embed_percentage = (
-        round(sum(all_reason_embed_percentages) / len(all_reason_embed_percentages), 2)
-        if all_reason_embed_percentages
-        else 0.0
-    )
-
-    summary = {
-        "average_score": {
-            "total_state_score_percentage": average_state_percentage,
-            "total_source_id_score_percentage": average_source_id_percentage,
-            "total_reason_llm_score_percentage": average_reason_llm_percentage,
-            "total_reason_embed_score_percentage": average_reason_embed_percentage,
-        },
-        "details": [],
-    }
-
-    for idx in range(len(all_state_percentages)):
-        summary["details"].append(
-            {
-                "data_set": f"data_{idx + 1}",
-                "total_state_score_percentage": all_state_percentages[idx],
-                "total_source_id_score_percentage": all_source_id_percentages[idx],
-                "total_reason_llm_score_percentage": all_reason_llm_percentages[idx],
-                "total_reason_embed_score_percentage": all_reason_embed_percentages[idx],
-            }
-        )
-
-    with open(os.path.join(args.output_dir, "summary.json"), "w", encoding="utf-8") as f:
-        json.dump(summary, f, ensure_ascii=False, indent=2)
 
-    print("[INFO] Summary has been saved to summary.json.")
+    try:
+        with tqdm(total=len(file_pairs), desc="Evaluating") as pbar:
+            tasks = [asyncio.create_task(sem_wrapper(i, g, p, o, pbar)) for i, g, p, o in file_pairs]
+            await asyncio.gather(*tasks)
+    finally:
+        write_summary()
+
+    print(f"[INFO] Summary over {len(aggregator)} files has been saved to summary.json.")
+    if embedding_cache is not None:
+        print(f"[INFO] Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses.")
+    print(f"[INFO] Judge: {judge.api_calls} API calls, {judge.cache_hits} cache hits, "
+          f"{judge.unparsable} unparsable replies (rated 0, not cached).")
 
 
 if __name__ == "__main__":
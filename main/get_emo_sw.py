@@ -1,92 +1,28 @@
-import copy
 import os
+import sys
 import json
 import argparse
 import re
-from collections import defaultdict
+import time
 
 from mpmath import floor
 from tqdm import tqdm
 import concurrent.futures
-from utils import call_large_model, parse_json_response, load_yaml_config, merge_similar_emotions_with_llm
-
-
-def extract_speaker_timestamps(txt_file_path):
-    """
-    从txt文件中提取说话人和时间戳
-    格式：
-        说话人 timestamp
-        说话内容
-        说话人 timestamp
-        说话内容
-        ...
-
-    返回: 字典 {speaker: [timestamp1, timestamp2, ...]}
-    """
-    speaker_timestamps = defaultdict(list)
-    try:
-        with open(txt_file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        for i in range(0, len(lines), 2):
-            if i+1 >= len(lines):
-                break
-            line = lines[i].strip()
-            parts = line.split()
-            if len(parts) < 2:
-                continue
-            timestamp = parts[-1]
-            speaker = ' '.join(parts[:-1])
-            speaker_timestamps[speaker].append(timestamp)
-    except Exception as e:
-        print(f"Error reading {txt_file_path}: {e}")
-        return {}
-    return speaker_timestamps
-
-
-def format_chat_history_for_llm(chat_data):
-    formatted_chat = []
-
-    for idx, item in enumerate(chat_data):
-        holder = item.get("holder", "")
-        sentence = item.get("input_sentence", "")
-        tuples = item.get("final_model_response", [])
-        formatted_tuples = []
-        try:
-            for t in tuples:
-                formatted_tuples.append(
-                    f'{{"target": "{t["target"]}", "aspect": "{t["aspect"]}", '
-                    f'"opinion": "{t["opinion"]}", "sentiment": "{t["sentiment"]}", "rationale": "{t["rationale"]}"}}'
-                )
-            tuples_str = "[\n  " + ",\n  ".join(formatted_tuples) + "\n]" if formatted_tuples else "[]"
-        except:
-            tuples_str = "[]"
-        if holder and sentence:
-            formatted_chat.append(f'({idx}) "{holder}": "{sentence}"\n五元组: {tuples_str}')
-
-    return "[\n" + ",\n".join(formatted_chat) + "\n]"
-
-
-def segment_events_by_topic_with_sliding_window(dialogues, api_key, base_url, model_name, window_size=10, step_size=8, speaker_timestamps=None,other_text=None):
-    total_sentences = len(dialogues)
-    print(f"共计{total_sentences}个句子，切分成{floor(total_sentences // step_size) + 1}个窗口进行滑动")
-    event_pool = defaultdict(lambda: {"events": []})
-    step_results = []
-    for start in range(0, total_sentences, step_size):
-        print(f"now start at {start} with {step_size}, all is {total_sentences}")
-        window_data = dialogues[start : start + window_size]
-        formatted_chat = format_chat_history_for_llm(window_data)
-
-        event_pool_copy = copy.deepcopy(event_pool)
-        for holder_data in event_pool_copy.values():
-            for event in holder_data["events"]:
-                event.pop("sentence_ids", None)
-
-        history_formatted = json.dumps(event_pool_copy, ensure_ascii=False, indent=2)
-        
-        # 格式化说话人和时间戳信息
-        speaker_timestamps_json = json.dumps(speaker_timestamps, ensure_ascii=False, indent=2) if speaker_timestamps else "{}"
-        
-        system_prompt = """
+from event_pool import CompactEventContext, EventPool
+from utils import (
+    call_embedding,
+    call_large_model,
+    load_yaml_config,
+    merge_similar_emotions_with_llm,
+    parse_json_response,
+    set_embedding_cache,
+)
+
+# 转录解析与 convert_text 共用（列式转录，带二进制缓存 <文件名>.txt.tsc）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "convert_text"))
+from transcript import load_transcript
+
+SYSTEM_PROMPT = """
 你是一名高级情绪事件分析助手。你的任务是：
 1. **分析对话数据**，识别出 **关键情绪事件**（event）。
 2. **合并相似事件**，避免重复创建多个 event。
@@ -254,7 +190,63 @@ def segment_events_by_topic_with_sliding_window(dialogues, api_key, base_url, mo
 请直接返回 JSON，不能有多余解释。
 """.strip()
 
-        user_prompt = f"""
+
+def extract_speaker_timestamps(txt_file_path):
+    """
+    从txt文件中提取说话人和时间戳（使用与 convert_text 共用的列式转录，说话人标签按原样保留）
+    格式：
+        说话人 timestamp
+        说话内容（可以有多行或为空）
+        ...
+
+    返回: 字典 {speaker: [timestamp1, timestamp2, ...]}
+    """
+    try:
+        return load_transcript(txt_file_path).speaker_timestamps()
+    except Exception as e:
+        print(f"Error reading {txt_file_path}: {e}")
+        return {}
+
+
+def format_chat_history_for_llm(chat_data):
+    formatted_chat = []
+
+    for idx, item in enumerate(chat_data):
+        holder = item.get("holder", "")
+        sentence = item.get("input_sentence", "")
+        tuples = item.get("final_model_response", [])
+        formatted_tuples = []
+        try:
+            for t in tuples:
+                formatted_tuples.append(
+                    f'{{"target": "{t["target"]}", "aspect": "{t["aspect"]}", '
+                    f'"opinion": "{t["opinion"]}", "sentiment": "{t["sentiment"]}", "rationale": "{t["rationale"]}"}}'
+                )
+            tuples_str = "[\n  " + ",\n  ".join(formatted_tuples) + "\n]" if formatted_tuples else "[]"
+        except:
+            tuples_str = "[]"
+        if holder and sentence:
+            formatted_chat.append(f'({idx}) "{holder}": "{sentence}"\n五元组: {tuples_str}')
+
+    return "[\n" + ",\n".join(formatted_chat) + "\n]"
+
+
+def render_event_pool(event_pool, dialogues):
+    """将事件池完整序列化为提示词中的历史事件（不包含sentence_ids）"""
+    return json.dumps(event_pool.to_dict(dialogues, include_sentence_ids=False), ensure_ascii=False, indent=2)
+
+
+def summarize_speaker_timestamps(speaker_timestamps):
+    """每个说话人只保留发言次数和首末时间戳，长度与对话长度无关"""
+    summary = {}
+    for speaker, timestamps in (speaker_timestamps or {}).items():
+        if timestamps:
+            summary[speaker] = f"{len(timestamps)}次发言, {timestamps[0]}-{timestamps[-1]}"
+    return json.dumps(summary, ensure_ascii=False, indent=2) if summary else "{}"
+
+
+def build_user_prompt(history_formatted, formatted_chat, speaker_timestamps_json, other_text):
+    return f"""
 [之前已经检测到的事件]
 {history_formatted}
 [相关历史记录]
@@ -265,49 +257,236 @@ def segment_events_by_topic_with_sliding_window(dialogues, api_key, base_url, mo
 {other_text}
 - **请按照格式输出 JSON**，不要遗漏任何关键字段，source_id 一定要在emotions中输出，这个字段不能省略。
         """
-        parsed_response = None
-        for _ in range(3):
-            response = call_large_model(
-                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
-                api_key=api_key,
-                base_url=base_url,
-                model=model_name,
-            )
-            parsed_response = parse_json_response(response)
-            if parsed_response and parsed_response != {}:
-                break
-        if not parsed_response:
-            parsed_response = {}
-        for holder, holder_data in parsed_response.items():
-            if holder not in event_pool:
-                event_pool[holder] = {"events": []}
-            try:
-                for new_event in holder_data["events"]:
-                    new_event["sentence_ids"] = [start + idx for idx in new_event.get("sentence_ids", [])]
-                    existing_event = next(
-                        (e for e in event_pool[holder]["events"] if e["event"] == new_event["event"]), None
-                    )
-                    if existing_event:
-                        existing_event["emotions"].extend(new_event["emotions"])
-                        existing_event["sentence_ids"].extend(new_event["sentence_ids"])
-                    else:
-                        event_pool[holder]["events"].append(new_event)
-            except Exception as e:
-                print(f"Error processing {holder} at {start} with {step_size}")
-        print("enter in event_pool\n=======================\n")
-        for holder_data in event_pool.values():
-            for event in holder_data["events"]:
-                event["sentence_ids"] = list(set(event["sentence_ids"]))
-                event["sentences"] = [
-                    dialogues[idx]["input_sentence"] for idx in event["sentence_ids"] if idx < len(dialogues)
-                ]
-        step_results.append({"step": start // step_size + 1, "events": parsed_response})
-    for holder, holder_data in event_pool.items():
-        for event in holder_data["events"]:
-            optimized_emotions = merge_similar_emotions_with_llm(event["emotions"], api_key, base_url, model_name)
-            event["emotions"] = optimized_emotions
-
-    return event_pool, step_results
+
+
+def call_window_llm(user_prompt, api_key, base_url, model_name):
+    """调用大模型分析一个窗口，最多重试3次，返回解析后的dict"""
+    parsed_response = None
+    for _ in range(3):
+        response = call_large_model(
+            messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": user_prompt}],
+            api_key=api_key,
+            base_url=base_url,
+            model=model_name,
+        )
+        parsed_response = parse_json_response(response)
+        if parsed_response and parsed_response != {}:
+            break
+    if not parsed_response or not isinstance(parsed_response, dict):
+        parsed_response = {}
+    return parsed_response
+
+
+def merge_window_result(event_pool, parsed_response, start, step_size):
+    """将一个窗口的结果合并进事件池（sentence_ids 从窗口内编号转换为全局编号）"""
+    for holder, holder_data in parsed_response.items():
+        event_pool.events(holder)
+        try:
+            for new_event in holder_data["events"]:
+                event_pool.merge_event(holder, new_event, offset=start)
+        except Exception as e:
+            print(f"Error processing {holder} at {start} with {step_size}")
+    print("enter in event_pool\n=======================\n")
+
+
+def segment_events_by_topic_with_sliding_window(
+    dialogues,
+    api_key,
+    base_url,
+    model_name,
+    window_size=10,
+    step_size=8,
+    speaker_timestamps=None,
+    other_text=None,
+    pipeline_depth=1,
+    staleness=0,
+    context_tokens=1500,
+    embed_config=None,
+    merge_workers=8,
+):
+    """
+    滑动窗口切分事件。
+
+    context_tokens: 历史事件摘要的token预算（见 CompactEventContext）；为0时使用原本的完整JSON事件池，
+    此时提示词会随对话长度线性增长。
+
+    embed_config: 合并相似情绪时使用的嵌入模型配置（见 merge_similar_emotions_with_llm）；
+    为None时不使用嵌入，去掉完全相同的情绪后其余同状态、同来源的情绪交给大模型合并。merge_workers 为并发合并的线程数。
+
+    pipeline_depth: 同时在途的窗口请求数 K
+    staleness: 窗口 i 看到的是合并完前 i-staleness 个窗口后的事件池（即最多缺少最近 staleness 个窗口的结果）
+    staleness=0 时与原本的完全串行模式相同；pipeline_depth 超过 staleness+1 没有额外收益。
+    结果总是按窗口顺序合并，同样的参数得到的提示词是确定的。
+    """
+    total_sentences = len(dialogues)
+    print(f"共计{total_sentences}个句子，切分成{floor(total_sentences // step_size) + 1}个窗口进行滑动")
+    step_results = []
+    starts = list(range(0, total_sentences, step_size))
+    pipeline_depth = max(1, min(pipeline_depth, staleness + 1))
+    if context_tokens > 0:
+        event_pool = EventPool(context=CompactEventContext(token_budget=context_tokens))
+        render_history = event_pool.context.render
+        speaker_timestamps_json = summarize_speaker_timestamps(speaker_timestamps)
+    else:
+        event_pool = EventPool()
+        render_history = lambda: render_event_pool(event_pool, dialogues)
+        speaker_timestamps_json = (
+            json.dumps(speaker_timestamps, ensure_ascii=False, indent=2) if speaker_timestamps else "{}"
+        )
+
+    # snapshots[k]: 合并完前 k 个窗口后的历史事件
+    snapshots = {0: render_history()}
+
+    def submit(executor, window_idx):
+        start = starts[window_idx]
+        print(f"now start at {start} with {step_size}, all is {total_sentences}")
+        formatted_chat = format_chat_history_for_llm(dialogues[start : start + window_size])
+        history_formatted = snapshots[max(0, window_idx - staleness)]
+        user_prompt = build_user_prompt(history_formatted, formatted_chat, speaker_timestamps_json, other_text)
+        return executor.submit(call_window_llm, user_prompt, api_key, base_url, model_name)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=pipeline_depth) as executor:
+        in_flight = {}
+        next_window = 0
+        for window_idx, start in enumerate(starts):
+            # 窗口 j 需要前 j-staleness 个窗口已经合并
+            while (
+                next_window < len(starts)
+                and len(in_flight) < pipeline_depth
+                and next_window - staleness <= window_idx
+            ):
+                in_flight[next_window] = submit(executor, next_window)
+                next_window += 1
+
+            parsed_response = in_flight.pop(window_idx).result()
+            merge_window_result(event_pool, parsed_response, start, step_size)
+            step_results.append({"step": start // step_size + 1, "events": parsed_response})
+
+            snapshots[window_idx + 1] = render_history()
+            snapshots.pop(window_idx - staleness, None)
+
+    merge_event_pool_emotions(event_pool, api_key, base_url, model_name, embed_config, merge_workers)
+    return event_pool.to_dict(dialogues), step_results
+
+
+def merge_event_pool_emotions(event_pool, api_key, base_url, model_name, embed_config=None, max_workers=8):
+    """
+    合并事件池中每个事件的相似情绪。
+
+    先把所有事件的情绪原因一次性批量嵌入（写入嵌入缓存），之后每个事件的本地聚类只读缓存；
+    只有含不确定簇的事件才会调用大模型，这些调用并发执行。
+    """
+    events = [event for _, event in event_pool.iter_events() if len(event["emotions"]) > 1]
+    if not events:
+        return
+    if embed_config is not None:
+        reasons = [str(e.get("reason", "")) for event in events for e in event["emotions"] if isinstance(e, dict)]
+        call_embedding(reasons, **embed_config)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        merged = executor.map(
+            lambda event: merge_similar_emotions_with_llm(
+                event["emotions"], api_key, base_url, model_name, embed_config=embed_config
+            ),
+            events,
+        )
+        for event, emotions in zip(events, merged):
+            event["emotions"] = emotions
+
+
+def compare_event_pools(reference, candidate):
+    """
+    比较两个事件池（例如串行模式与流水线模式）的差异，用于权衡延迟与质量。
+
+    返回每个说话人的事件数、事件名重合度(Jaccard)、句子覆盖重合度(Jaccard)、情绪数量，
+    以及所有说话人上的平均值。
+    """
+    holders = sorted(set(reference) | set(candidate), key=str)
+    per_holder = {}
+    for holder in holders:
+        ref_events = reference.get(holder, {}).get("events", [])
+        cand_events = candidate.get(holder, {}).get("events", [])
+        ref_names = {e.get("event") for e in ref_events}
+        cand_names = {e.get("event") for e in cand_events}
+        ref_ids = {i for e in ref_events for i in e.get("sentence_ids", [])}
+        cand_ids = {i for e in cand_events for i in e.get("sentence_ids", [])}
+        per_holder[holder] = {
+            "reference_events": len(ref_events),
+            "candidate_events": len(cand_events),
+            "event_name_jaccard": _jaccard(ref_names, cand_names),
+            "sentence_jaccard": _jaccard(ref_ids, cand_ids),
+            "reference_emotions": sum(len(e.get("emotions", [])) for e in ref_events),
+            "candidate_emotions": sum(len(e.get("emotions", [])) for e in cand_events),
+        }
+
+    def mean(key):
+        return round(sum(h[key] for h in per_holder.values()) / len(per_holder), 4) if per_holder else 1.0
+
+    return {
+        "event_name_jaccard": mean("event_name_jaccard"),
+        "sentence_jaccard": mean("sentence_jaccard"),
+        "holders": per_holder,
+    }
+
+
+def _jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return round(len(a & b) / len(a | b), 4)
+
+
+def run_segmentation(
+    dialogues,
+    llm_cfg,
+    window_size,
+    step_size,
+    speaker_timestamps,
+    other_text,
+    pipeline_depth,
+    staleness,
+    compare_serial,
+    context_tokens,
+    embed_config=None,
+):
+    """运行滑动窗口切分；compare_serial 时额外跑一次完全串行模式，返回两者的差异和耗时"""
+    started = time.time()
+    event_pool, step_results = segment_events_by_topic_with_sliding_window(
+        dialogues,
+        llm_cfg["api_key"],
+        llm_cfg["base_url"],
+        llm_cfg["model"],
+        window_size,
+        step_size,
+        speaker_timestamps,
+        other_text,
+        pipeline_depth=pipeline_depth,
+        staleness=staleness,
+        context_tokens=context_tokens,
+        embed_config=embed_config,
+    )
+    elapsed = time.time() - started
+
+    comparison = None
+    if compare_serial:
+        started = time.time()
+        serial_pool, _ = segment_events_by_topic_with_sliding_window(
+            dialogues,
+            llm_cfg["api_key"],
+            llm_cfg["base_url"],
+            llm_cfg["model"],
+            window_size,
+            step_size,
+            speaker_timestamps,
+            other_text,
+            context_tokens=context_tokens,
+            embed_config=embed_config,
+        )
+        comparison = compare_event_pools(serial_pool, event_pool)
+        comparison["pipeline_depth"] = pipeline_depth
+        comparison["staleness"] = staleness
+        comparison["pipelined_seconds"] = round(elapsed, 2)
+        comparison["serial_seconds"] = round(time.time() - started, 2)
+    return event_pool, step_results, comparison
 
 
 def main():
@@ -320,6 +499,25 @@ def main():
     parser.add_argument("--batch", type=int, default=1)
     parser.add_argument("--window_sizes", type=str, default="20", help="滑动窗口大小，多个用逗号分隔，比如 '10,40'")
     parser.add_argument("--step_sizes", type=str, default="10", help="滑动步长，多个用逗号分隔，比如 '8,30'")
+    parser.add_argument("--pipeline_depth", type=int, default=1, help="每个文件同时在途的窗口请求数")
+    parser.add_argument(
+        "--staleness", type=int, default=0, help="窗口可见的事件池落后的窗口数，0 为原本的完全串行模式"
+    )
+    parser.add_argument(
+        "--compare_serial", action="store_true", help="额外运行一次串行模式，输出流水线模式与串行模式的差异"
+    )
+    parser.add_argument(
+        "--context_tokens", type=int, default=1500, help="历史事件摘要的token预算，0 表示使用完整的JSON事件池"
+    )
+    parser.add_argument(
+        "--embedding_model",
+        type=str,
+        default="zhipu",
+        help="合并相似情绪时使用的嵌入模型（config中的embed_config），为空字符串时不使用嵌入",
+    )
+    parser.add_argument(
+        "--embedding_cache", type=str, default=".cache/embeddings.sqlite", help="嵌入向量缓存文件"
+    )
     args = parser.parse_args()
     window_sizes = list(map(int, args.window_sizes.split(",")))
     step_sizes = list(map(int, args.step_sizes.split(",")))
@@ -329,6 +527,10 @@ def main():
         raise ValueError("需要提供相同数量的滑动窗口和步长组合")
 
     llm_cfg = load_yaml_config(args.config_path, args.llm_model, "llm_config")
+    embed_config = None
+    if args.embedding_model:
+        embed_config = load_yaml_config(args.config_path, args.embedding_model, "embed_config")
+        set_embedding_cache(args.embedding_cache)
     os.makedirs(args.output_dir, exist_ok=True)
     all_files = sorted([f for f in os.listdir(args.input_dir) if f.endswith(".json") and f.startswith("output_chat")])
 
@@ -360,22 +562,25 @@ def main():
 
                     futures[
                         executor.submit(
-                            segment_events_by_topic_with_sliding_window,
+                            run_segmentation,
                             dialogues,
-                            llm_cfg["api_key"],
-                            llm_cfg["base_url"],
-                            llm_cfg["model"],
+                            llm_cfg,
                             window_size,
                             step_size,
                             speaker_timestamps,  # 传递说话人和时间戳信息
-                            other_text
+                            other_text,
+                            args.pipeline_depth,
+                            args.staleness,
+                            args.compare_serial,
+                            args.context_tokens,
+                            embed_config,
                         )
                     ] = (fname, window_size, step_size)
 
             # Handle task results as they complete
             for future in concurrent.futures.as_completed(futures):
                 fname, window_size, step_size = futures[future]
-                event_pool, step_results = future.result()
+                event_pool, step_results, comparison = future.result()
 
                 match = re.search(r"(\d+)", fname)
                 if match:
@@ -392,6 +597,16 @@ def main():
                 with open(step_results_path, "w", encoding="utf-8") as f:
                     json.dump(step_results, f, ensure_ascii=False, indent=2)
 
+                if comparison is not None:
+                    comparison_path = os.path.join(args.output_dir, f"output_emotions_{number}_pipeline_diff.json")
+                    print(
+                        f"{comparison_path}: event_name_jaccard={comparison['event_name_jaccard']}, "
+                        f"sentence_jaccard={comparison['sentence_jaccard']}, "
+                        f"{comparison['pipelined_seconds']}s vs {comparison['serial_seconds']}s serial"
+                    )
+                    with open(comparison_path, "w", encoding="utf-8") as f:
+                        json.dump(comparison, f, ensure_ascii=False, indent=2)
+
                 pbar.update(1)
 
 
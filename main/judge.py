@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from openai import AsyncOpenAI
+
+from utils import clean_response
+
+JUDGE_SYSTEM_PROMPT = """
+你是一个负责对比两个文本的评测器。
+我会给你两个文本A和B，你需要判断它们语义是否相似，或者在描述一个相似的态度和事件。
+如果语义基本一致或高度近似(意思相或者目标相同)，请输出1，否则输出0。只需要输出一个数字0或1，不要输出其他解释。
+
+### 注意
+- 输出只有一个数字，没有其他内容。
+- 如果两个句子相似，则输出数字 1，否则输出数字 0。
+
+### 输入示例
+
+文本A: 我爱吃苹果
+文本B: 我觉得苹果很好吃
+请判断是否相似(0或1):
+
+### 输出示例
+
+1
+
+"""
+
+PACKED_JUDGE_SYSTEM_PROMPT = """
+你是一个负责对比文本的评测器。
+我会给你若干组编号的文本对(A和B)，你需要逐组判断它们语义是否相似，或者在描述一个相似的态度和事件。
+如果语义基本一致或高度近似(意思相或者目标相同)，该组输出1，否则输出0。
+
+### 注意
+- 按编号顺序输出一个JSON数组，数组长度必须等于文本对的数量，每个元素只能是数字0或1。
+- 不要输出其他解释。
+
+### 输入示例
+
+[1] 文本A: 我爱吃苹果
+[1] 文本B: 我觉得苹果很好吃
+[2] 文本A: 今天下雨了
+[2] 文本B: 我明天要考试
+请逐组判断是否相似(0或1):
+
+### 输出示例
+
+[1, 0]
+
+"""
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_async_client(judge_config):
+    """Return the pooled AsyncOpenAI client for a (base_url, api_key) pair."""
+    key = (judge_config["base_url"], judge_config["api_key"])
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(api_key=judge_config["api_key"], base_url=judge_config["base_url"], max_retries=5)
+            _clients[key] = client
+    return client
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", str(text)).strip()
+
+
+def parse_verdict(content):
+    """1 or 0 if the stripped reply is exactly "1" or "0", otherwise None (unparsable)."""
+    content = (content or "").strip()
+    return int(content) if content in ("0", "1") else None
+
+
+def parse_verdict_vector(content, n):
+    """Parse a packed reply into n verdicts, or return None if it does not line up with the pairs."""
+    content = clean_response(content or "")
+    try:
+        values = json.loads(content)
+        if isinstance(values, list) and len(values) == n:
+            verdicts = [parse_verdict(str(v)) for v in values]
+            return None if None in verdicts else verdicts
+    except (json.JSONDecodeError, TypeError):
+        pass
+    digits = re.findall(r"(?<![\d\[])[01](?![\d\]])", content)
+    if len(digits) == n:
+        return [int(d) for d in digits]
+    return None
+
+
+class TokenBucket:
+    """Async token bucket: at most `rate` acquisitions per second, with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class VerdictCache:
+    """Persistent judge verdicts keyed by judge model and the normalized (unordered) text pair."""
+
+    def __init__(self, path):
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, verdict INTEGER)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model, text_a, text_b):
+        a, b = sorted((normalize_text(text_a), normalize_text(text_b)))
+        digest = hashlib.sha256(f"{a}\x00{b}".encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT verdict FROM verdicts WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key, verdict):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?)", (key, int(verdict)))
+            self._conn.commit()
+
+
+class LLMJudge:
+    """
+    Use the LLM specified in judge_config to determine if two texts are similar, returning 0 or 1.
+
+    Note: If the LLM does not return a number or provides additional explanations, it will be rated 0 points.
+    Therefore, a LLM with stronger instruction-following capabilities and a larger weight should be used.
+    In this work, we used the [GLM-4-Plus](https://arxiv.org/abs/2406.12793).
+
+    Changing the LLM may affect the actual score evaluation, and a certain range of error is considered normal.
+
+    Verdicts are cached on disk, requests go through one pooled AsyncOpenAI client and an optional token-bucket
+    rate limit, and with pack_size > 1 concurrent `judge` calls are packed into a single prompt that returns a
+    vector of verdicts (falling back to one call per pair if the reply cannot be parsed).
+    """
+
+    def __init__(
+        self, judge_config, cache_path=None, pack_size=1, requests_per_second=None, max_concurrency=None, pack_delay=0.05
+    ):
+        self.config = judge_config
+        self.model = judge_config["model"]
+        self.client = get_async_client(judge_config)
+        self.cache = VerdictCache(cache_path) if cache_path else None
+        self.pack_size = max(1, int(pack_size))
+        self.pack_delay = pack_delay
+        self.rate_limiter = TokenBucket(requests_per_second) if requests_per_second else None
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.cache_hits = 0
+        self.api_calls = 0
+        self.unparsable = 0
+        self._pending = []
+        self._flush_handle = None
+
+    async def judge(self, text_a, text_b):
+        key = VerdictCache.make_key(self.model, text_a, text_b)
+        if self.cache is not None:
+            verdict = self.cache.get(key)
+            if verdict is not None:
+                self.cache_hits += 1
+                return verdict
+
+        if self.pack_size > 1:
+            verdict = await self._enqueue(text_a, text_b)
+        else:
+            verdict = await self._ask_single(text_a, text_b)
+
+        if verdict is None:
+            # Unparsable replies are rated 0 but not cached, so the next run asks again.
+            self.unparsable += 1
+            return 0
+        if self.cache is not None:
+            self.cache.put(key, verdict)
+        return verdict
+
+    async def judge_many(self, pairs):
+        return list(await asyncio.gather(*(self.judge(a, b) for a, b in pairs)))
+
+    async def _complete(self, messages, max_tokens):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        self.api_calls += 1
+        if self.semaphore is not None:
+            async with self.semaphore:
+                response = await self.client.chat.completions.create(
+                    model=self.model, messages=messages, temperature=0.0, max_tokens=max_tokens
+                )
+        else:
+            response = await self.client.chat.completions.create(
+                model=self.model, messages=messages, temperature=0.0, max_tokens=max_tokens
+            )
+        return (response.choices[0].message.content or "").strip()
+
+    async def _ask_single(self, text_a, text_b):
+        messages = [
+            {"role": "system", "content": JUDGE_SYSTEM_PROMPT},
+            {"role": "user", "content": f"文本A: {text_a}\n文本B: {text_b}\n请判断是否相似(0或1):"},
+        ]
+        return parse_verdict(await self._complete(messages, max_tokens=8))
+
+    async def _ask_packed(self, pairs):
+        lines = []
+        for i, (text_a, text_b) in enumerate(pairs, 1):
+            lines.append(f"[{i}] 文本A: {text_a}\n[{i}] 文本B: {text_b}")
+        messages = [
+            {"role": "system", "content": PACKED_JUDGE_SYSTEM_PROMPT},
+            {"role": "user", "content": "\n".join(lines) + "\n请逐组判断是否相似(0或1):"},
+        ]
+        verdicts = parse_verdict_vector(await self._complete(messages, max_tokens=8 + 4 * len(pairs)), len(pairs))
+        if verdicts is None:
+            verdicts = await asyncio.gather(*(self._ask_single(a, b) for a, b in pairs))
+        return list(verdicts)
+
+    def _enqueue(self, text_a, text_b):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text_a, text_b, future))
+        if len(self._pending) >= self.pack_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.pack_delay, self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            batch, self._pending = self._pending[: self.pack_size], self._pending[self.pack_size :]
+            asyncio.ensure_future(self._resolve(batch))
+
+    async def _resolve(self, batch):
+        try:
+            verdicts = await self._ask_packed([(a, b) for a, b, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), verdict in zip(batch, verdicts):
+            if not future.done():
+                future.set_result(verdict)
@@ -1,7 +1,11 @@
 import base64
+import hashlib
 import json
 import os
 import re
+import sqlite3
+import threading
+from collections import OrderedDict
 
 import numpy as np
 import yaml
@@ -91,10 +95,106 @@ def call_large_model(
     return {}
 
 
-def call_embedding(texts, api_key, base_url, model="embedding-3"):
-    if isinstance(texts, list):
-        texts = [" " if text == "" else text for text in texts]
-
+class EmbeddingCache:
+    """
+    Content-addressed embedding store keyed on (model, sha256(text)).
+
+    A bounded in-memory LRU sits in front of a SQLite file, so repeated evaluation runs and threshold
+    sweeps reuse vectors instead of re-embedding the same GT / prediction texts.
+    """
+
+    def __init__(self, path, max_memory_items=100000):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, dim INTEGER, vector BLOB)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, text):
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def _remember(self, key, emb):
+        self._lru[key] = emb
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_memory_items:
+            self._lru.popitem(last=False)
+
+    def get_many(self, model, texts):
+        """Return {text: embedding} for every text already cached."""
+        found = {}
+        with self._lock:
+            missing = {}
+            for text in texts:
+                key = self.make_key(model, text)
+                emb = self._lru.get(key)
+                if emb is not None:
+                    self._lru.move_to_end(key)
+                    found[text] = emb
+                else:
+                    missing[key] = text
+
+            keys = list(missing)
+            for i in range(0, len(keys), 500):
+                chunk = keys[i : i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    emb = np.frombuffer(blob, dtype="float32").copy()
+                    self._remember(key, emb)
+                    found[missing[key]] = emb
+
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, model, items):
+        """Store an iterable of (text, embedding) pairs."""
+        rows = []
+        with self._lock:
+            for text, emb in items:
+                emb = np.asarray(emb, dtype="float32")
+                key = self.make_key(model, text)
+                self._remember(key, emb)
+                rows.append((key, model, int(emb.shape[0]), emb.tobytes()))
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+
+_embedding_cache = None
+_embedding_cache_enabled = True
+
+
+def set_embedding_cache(path):
+    """Point call_embedding at a cache file; pass None to disable caching."""
+    global _embedding_cache, _embedding_cache_enabled
+    _embedding_cache = EmbeddingCache(path) if path else None
+    _embedding_cache_enabled = bool(path)
+    return _embedding_cache
+
+
+def get_embedding_cache():
+    global _embedding_cache
+    if _embedding_cache is None and _embedding_cache_enabled:
+        _embedding_cache = EmbeddingCache(os.environ.get("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite"))
+    return _embedding_cache
+
+
+def _request_embeddings(texts, api_key, base_url, model):
     client = OpenAI(api_key=api_key, base_url=base_url)
     response = client.embeddings.create(model=model, input=texts)
     embeddings = []
@@ -104,6 +204,30 @@ def call_embedding(texts, api_key, base_url, model="embedding-3"):
     return embeddings
 
 
+def call_embedding(texts, api_key, base_url, model="embedding-3", max_batch_size=64):
+    """
+    Embed texts through the cache: each unique string missing from the cache is sent to the API once,
+    and the result list keeps the order (and duplicates) of the input.
+
+    Note: ZhipuAI Embedding-3 accepts at most 64 texts per request, so misses are sent in chunks of max_batch_size.
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    texts = [" " if text == "" else text for text in texts]
+
+    cache = get_embedding_cache()
+    found = cache.get_many(model, set(texts)) if cache is not None else {}
+    missing = [text for text in dict.fromkeys(texts) if text not in found]
+    for i in range(0, len(missing), max_batch_size):
+        chunk = missing[i : i + max_batch_size]
+        fresh = list(zip(chunk, _request_embeddings(chunk, api_key, base_url, model)))
+        if cache is not None:
+            cache.put_many(model, fresh)
+        found.update(fresh)
+
+    return [found[text] for text in texts]
+
+
 def cosine_similarity(a, b):
     a = np.array(a, dtype=np.float32)
     b = np.array(b, dtype=np.float32)
@@ -114,6 +238,71 @@ def cosine_similarity(a, b):
     return float(np.dot(a, b) / (norm_a * norm_b))
 
 
+def normalize_rows(matrix):
+    """L2-normalize each row; all-zero rows stay zero so their cosine similarity is 0."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def cosine_similarity_matrix(a, b):
+    """Cosine similarity between every row of a and every row of b, as one matrix product."""
+    a = normalize_rows(a)
+    b = normalize_rows(b)
+    if a.size == 0 or b.size == 0:
+        return np.zeros((a.shape[0], b.shape[0]), dtype=np.float32)
+    return a @ b.T
+
+
+MATCH_MODES = ("independent", "greedy", "hungarian")
+
+
+def assign_matches(similarity, mode="independent", min_similarity=0.0):
+    """
+    Match rows (GT items) to columns (predictions) of a similarity matrix.
+
+    - independent: every row takes its own argmax column, so two rows may share one column.
+    - greedy: one-to-one, highest-similarity pairs first.
+    - hungarian: one-to-one assignment maximizing the total similarity (needs scipy).
+
+    Pairs whose similarity is not above min_similarity are left unmatched.
+    Returns an int array with the matched column for each row, or -1.
+    """
+    similarity = np.asarray(similarity, dtype=np.float32)
+    n_rows = similarity.shape[0]
+    assignment = np.full(n_rows, -1, dtype=np.int64)
+    if similarity.size == 0:
+        return assignment
+
+    if mode == "independent":
+        best = similarity.argmax(axis=1)
+        keep = similarity[np.arange(n_rows), best] > min_similarity
+        assignment[keep] = best[keep]
+    elif mode == "greedy":
+        order = np.argsort(-similarity, axis=None, kind="stable")
+        rows, cols = np.unravel_index(order, similarity.shape)
+        used_cols = np.zeros(similarity.shape[1], dtype=bool)
+        remaining = min(similarity.shape)
+        for r, c in zip(rows, cols):
+            if similarity[r, c] <= min_similarity or remaining == 0:
+                break
+            if assignment[r] == -1 and not used_cols[c]:
+                assignment[r] = c
+                used_cols[c] = True
+                remaining -= 1
+    elif mode == "hungarian":
+        try:
+            from scipy.optimize import linear_sum_assignment
+        except ImportError as e:
+            raise ImportError("Hungarian matching requires scipy (pip install scipy)") from e
+        rows, cols = linear_sum_assignment(similarity, maximize=True)
+        keep = similarity[rows, cols] > min_similarity
+        assignment[rows[keep]] = cols[keep]
+    else:
+        raise ValueError(f"未知的匹配模式 '{mode}'，可选: {', '.join(MATCH_MODES)}")
+    return assignment
+
+
 def clean_response(response_str):
     response_str = response_str.strip()
     if response_str.startswith("```") and response_str.endswith("```"):
@@ -190,3 +379,109 @@ def parse_json_response(response):
             pass
 
     return [{}]
+
+
+MERGE_EMOTIONS_PROMPT = """
+你是一名情绪事件分析助手。下面是同一个角色在同一个事件中的几条情绪记录，它们的状态相同、原因相近。
+请把描述同一情绪变化的记录合并为一条，原因要简洁清晰；确实不同的情绪变化需要分别保留，并保持原本的时间顺序。
+
+### 输出格式
+返回一个JSON列表，每个元素包含 "source_id"、"state"、"reason" 三个字段，不要输出任何解释。
+""".strip()
+
+
+def cluster_emotions(emotions, embeddings, dedupe_threshold=0.95, ambiguous_threshold=0.8):
+    """
+    按原因的向量相似度对同一事件中的情绪聚类（只在 state 和 source_id 都相同的情绪之间聚类）。
+
+    以最早出现的情绪为中心：与中心相似度 >= dedupe_threshold 的视为重复，直接去掉；
+    相似度在 [ambiguous_threshold, dedupe_threshold) 之间的与中心组成一个"不确定"簇，交给大模型决定是否合并。
+    返回按时间顺序排列的簇列表 [(成员下标列表, 是否不确定)]。
+    """
+    n = len(emotions)
+    if n == 0:
+        return []
+    similarity = cosine_similarity_matrix(embeddings, embeddings)
+    # 只在 state 和 source_id 都相同的情绪之间聚类，来源不同的情绪即使原因相同也分别保留
+    states = np.array([f'{e.get("state", "")}\x00{e.get("source_id", "")}' for e in emotions])
+    same_state = states[:, None] == states[None, :]
+
+    assigned = np.zeros(n, dtype=bool)
+    clusters = []
+    for i in range(n):
+        if assigned[i]:
+            continue
+        candidates = ~assigned & same_state[i] & (similarity[i] >= ambiguous_threshold)
+        candidates[i] = True
+        duplicates = candidates & (similarity[i] >= dedupe_threshold)
+        members = [i] + [j for j in np.flatnonzero(candidates & ~duplicates) if j != i]
+        assigned |= candidates
+        clusters.append((members, len(members) > 1))
+    return clusters
+
+
+def merge_emotions_with_llm(emotions, api_key, base_url, model_name):
+    """让大模型合并一个不确定簇；结果无效时保留原来的情绪"""
+    messages = [
+        {"role": "system", "content": MERGE_EMOTIONS_PROMPT},
+        {"role": "user", "content": json.dumps(emotions, ensure_ascii=False, indent=2)},
+    ]
+    try:
+        merged = parse_json_response(
+            call_large_model(messages=messages, api_key=api_key, base_url=base_url, model=model_name)
+        )
+    except Exception as e:
+        print(f"Error in merge_emotions_with_llm as {e}")
+        return emotions
+    if isinstance(merged, dict):
+        merged = [merged]
+    if not isinstance(merged, list):
+        return emotions
+    merged = [m for m in merged if isinstance(m, dict) and m.get("state") and m.get("reason")]
+    if not merged or len(merged) > len(emotions):
+        return emotions
+    for m in merged:
+        m.setdefault("source_id", emotions[0].get("source_id"))
+    return merged
+
+
+def merge_similar_emotions_with_llm(
+    emotions, api_key, base_url, model_name, embed_config=None, dedupe_threshold=0.95, ambiguous_threshold=0.8
+):
+    """
+    合并同一事件中相似的情绪记录。
+
+    先用原因的向量相似度在本地去重（见 cluster_emotions），只有不确定的簇才调用大模型。
+    没有 embed_config 时先去掉 state、source_id 和 reason 完全相同的记录，
+    其余 state 和 source_id 相同、仍有多条记录的组全部交给大模型合并。
+    """
+    emotions = [e for e in emotions if isinstance(e, dict)]
+    if len(emotions) < 2:
+        return emotions
+
+    if embed_config is None:
+        seen = set()
+        groups = {}
+        for e in emotions:
+            group = (str(e.get("state", "")), str(e.get("source_id", "")))
+            key = group + (re.sub(r"\s+", "", str(e.get("reason", ""))),)
+            if key not in seen:
+                seen.add(key)
+                groups.setdefault(group, []).append(e)
+        merged = []
+        for cluster in groups.values():
+            if len(cluster) > 1:
+                merged.extend(merge_emotions_with_llm(cluster, api_key, base_url, model_name))
+            else:
+                merged.extend(cluster)
+        return merged
+
+    embeddings = np.stack(call_embedding([str(e.get("reason", "")) for e in emotions], **embed_config))
+    merged = []
+    for members, ambiguous in cluster_emotions(emotions, embeddings, dedupe_threshold, ambiguous_threshold):
+        cluster = [emotions[i] for i in members]
+        if ambiguous:
+            merged.extend(merge_emotions_with_llm(cluster, api_key, base_url, model_name))
+        else:
+            merged.extend(cluster)
+    return merged
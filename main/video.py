@@ -1,4 +1,5 @@
 import os
+import sys
 import argparse
 import re
 import json
@@ -6,45 +7,26 @@ from humanomni import model_init, mm_infer
 from humanomni.utils import disable_torch_init
 from modelscope import BertTokenizer
 
+# 转录解析与 convert_text 共用（列式转录，带二进制缓存 <文件名>.txt.tsc）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "convert_text"))
+from transcript import load_transcript
+
 os.environ['TRANSFORMERS_OFFLINE'] = '1'
 os.environ['CUDA_VISIBLE_DEVICES'] = '0'
 
 def extract_speaker_data(file_path):
+    """取出每条发言（发言人编号按原样保留），跳过以 [ 或 http 开头的元数据行"""
+    transcript = load_transcript(file_path)
     speaker_data = []
-    current_speaker = None
-    current_timestamp = None
-    current_text = []
-    
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            # 匹配发言人行
-            speaker_match = re.match(r'发言人\s*(\d+)\s*(\d{2}:\d{2})', line)
-            if speaker_match:
-                # 保存前一个发言人的数据
-                if current_speaker is not None:
-                    speaker_data.append({
-                        'speaker': current_speaker,
-                        'timestamp': current_timestamp,
-                        'text': ' '.join(current_text)
-                    })
-                
-                # 开始新的发言人记录
-                current_speaker = speaker_match.group(1)
-                current_timestamp = speaker_match.group(2)
-                current_text = []
-            elif line and not line.startswith('[') and not line.startswith('http'):
-                # 添加非空行且非元数据的文本
-                current_text.append(line)
-    
-        # 添加最后一个发言人
-        if current_speaker is not None:
-            speaker_data.append({
-                'speaker': current_speaker,
-                'timestamp': current_timestamp,
-                'text': ' '.join(current_text)
-            })
-    
+    for i in range(len(transcript)):
+        text_lines = [line for line in transcript.segment_lines(i)
+                      if not line.startswith('[') and not line.startswith('http')]
+        speaker_id = transcript.speaker_id(i)
+        speaker_data.append({
+            'speaker': speaker_id if speaker_id is not None else transcript.speaker_label(i),
+            'timestamp': transcript.timestamp(i),
+            'text': ' '.join(text_lines)
+        })
     return speaker_data
 
 def format_prompt(speaker_data):